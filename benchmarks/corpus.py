@@ -0,0 +1,109 @@
+"""
+可复现的合成群聊语料
+
+同样的参数和种子总是生成同样的消息序列，包含中文短句、图片、@ 以及复读
+"""
+
+import random
+from collections.abc import Iterator
+from dataclasses import dataclass
+
+SUBJECTS = ["博士", "牛牛", "帕拉斯", "阿米娅", "凯尔希", "我", "你", "群主", "管理", "大家", "今天", "这个活动"]
+VERBS = ["喝酒", "抽卡", "上班", "摸鱼", "打本", "睡觉", "吃饭", "刷图", "氪金", "下班", "出警", "复读"]
+OBJECTS = ["六星", "理智", "合成玉", "源石", "新皮肤", "危机合约", "肉鸽", "保底", "蓝票", "黄票", "基建", "剿灭"]
+TAILS = ["吗", "了", "啊", "呢", "吧", "！", "？", "……", "草", "哈哈哈", "好耶", "寄"]
+REACTIONS = ["草", "？", "哈哈哈哈", "好耶", "寄了", "确实", "牛牛喝酒", "6", "典", "绷不住了", "awsl", "来了来了"]
+
+
+@dataclass
+class CorpusConfig:
+    groups: int = 20
+    users_per_group: int = 30
+    bots: int = 1
+    messages: int = 20000
+    seed: int = 114514
+    image_ratio: float = 0.08
+    at_ratio: float = 0.05
+    reaction_ratio: float = 0.25
+    phrase_ratio: float = 0.8  # 剩下的文字消息中，群里常说的话占的比例，其余是新句子
+    burst_ratio: float = 0.02  # 开始一轮复读的概率
+    burst_length: tuple[int, int] = (3, 6)
+    start_time: int = 1_700_000_000
+    interval: tuple[int, int] = (1, 30)  # 同一个群相邻两条消息的间隔 ( 秒 )
+
+
+class CorpusGenerator:
+    def __init__(self, config: CorpusConfig) -> None:
+        self.config = config
+        self._random = random.Random(config.seed)
+        self._group_ids = [100000 + i for i in range(config.groups)]
+        self._bot_ids = [10000 + i for i in range(config.bots)]
+        # 每个群的活跃度不同，少数群贡献大部分消息
+        self._group_weights = [1 / (i + 1) for i in range(config.groups)]
+        self._user_weights = [1 / (i + 1) ** 0.8 for i in range(config.users_per_group)]
+        # 每个群有自己常说的话，学到的内容才能被回复出来
+        self._phrases = {group_id: [self._sentence() for _ in range(200)] for group_id in self._group_ids}
+        self._phrase_weights = [1 / (i + 1) for i in range(200)]
+        self._images = [f"{self._random.getrandbits(128):032x}.image" for _ in range(300)]
+        self._times = dict.fromkeys(self._group_ids, config.start_time)
+
+    def __iter__(self) -> Iterator[dict]:
+        generated = 0
+        bursts: dict[int, tuple[str, str, int]] = {}
+        while generated < self.config.messages:
+            group_id = self._random.choices(self._group_ids, weights=self._group_weights)[0]
+            self._times[group_id] += self._random.randint(*self.config.interval)
+
+            if group_id in bursts:
+                raw_message, plain_text, left = bursts.pop(group_id)
+                if left > 1:
+                    bursts[group_id] = (raw_message, plain_text, left - 1)
+            else:
+                raw_message, plain_text = self._message(group_id)
+                if self._random.random() < self.config.burst_ratio:
+                    bursts[group_id] = (raw_message, plain_text, self._random.randint(*self.config.burst_length))
+
+            yield {
+                "group_id": group_id,
+                "user_id": self._user(group_id),
+                "bot_id": self._random.choice(self._bot_ids),
+                "raw_message": raw_message,
+                "plain_text": plain_text,
+                "time": self._times[group_id],
+            }
+            generated += 1
+
+    def _user(self, group_id: int) -> int:
+        index = self._random.choices(range(self.config.users_per_group), weights=self._user_weights)[0]
+        return group_id * 1000 + index
+
+    def _phrase(self, group_id: int) -> str:
+        return self._random.choices(self._phrases[group_id], weights=self._phrase_weights)[0]
+
+    def _sentence(self) -> str:
+        return (
+            self._random.choice(SUBJECTS)
+            + self._random.choice(VERBS)
+            + self._random.choice(OBJECTS)
+            + self._random.choice(TAILS)
+        )
+
+    def _message(self, group_id: int) -> tuple[str, str]:
+        roll = self._random.random()
+        if roll < self.config.image_ratio:
+            return f"[CQ:image,file={self._random.choice(self._images)}]", ""
+        roll -= self.config.image_ratio
+        if roll < self.config.at_ratio:
+            text = self._phrase(group_id)
+            return f"[CQ:at,qq={self._user(group_id)}] {text}", f" {text}"
+        roll -= self.config.at_ratio
+        if roll < self.config.reaction_ratio:
+            text = self._random.choice(REACTIONS)
+            return text, text
+
+        # 常说的话占大多数，偶尔冒出一句新的
+        if self._random.random() < self.config.phrase_ratio:
+            text = self._phrase(group_id)
+        else:
+            text = self._sentence()
+        return text, text
@@ -0,0 +1,242 @@
+"""
+复读机 ( Chat.learn / Chat.answer / Chat.speak ) 的吞吐和延迟基准
+
+在仓库根目录运行：
+
+    python -m benchmarks.repeater --mongo local --messages 20000 --output before.json
+    python -m benchmarks.repeater --mongo local --messages 20000 --compare before.json
+
+--mongo local 连接本地 mongod，使用单独的 PallasBotBench 库，跑完后删除；
+--mongo memory 使用 mongomock-motor 作为内存中的替代品 ( 需要 pip install mongomock-motor )，
+统计不到数据库操作数，部分更新语法也可能不支持，只适合粗略比较
+
+--storage 选择复读机的存储后端，对比两种后端回复路径的延迟：
+
+    python -m benchmarks.repeater --storage mongo --output mongo.json
+    python -m benchmarks.repeater --storage sqlite --compare mongo.json
+
+sqlite 后端使用单独的数据库文件，跑之前和跑完后删除；群配置等仍然保存在 MongoDB 中，mongo_ops 只统计这部分
+"""
+
+import argparse
+import asyncio
+import json
+import resource
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import nonebot
+from beanie import init_beanie
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+from benchmarks.corpus import CorpusConfig, CorpusGenerator
+from src.common.db import DOCUMENT_MODELS
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self) -> None:
+        self.commands: Counter[str] = Counter()
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        self.commands[event.command_name] += 1
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        pass
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        pass
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, round(pct / 100 * (len(values) - 1)))
+    return values[index]
+
+
+def peak_rss_mb() -> float:
+    # Linux 下 ru_maxrss 的单位是 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def remove_sqlite(path: str) -> None:
+    for suffix in ("", "-wal", "-shm"):
+        Path(path + suffix).unlink(missing_ok=True)
+
+
+async def connect(args: argparse.Namespace, counter: CommandCounter):
+    if args.mongo == "memory":
+        from mongomock_motor import AsyncMongoMockClient  # noqa: PLC0415
+
+        client = AsyncMongoMockClient()
+    else:
+        client = AsyncIOMotorClient(
+            args.host, args.port, unicode_decode_error_handler="ignore", event_listeners=[counter]
+        )
+
+    database = client[args.database]
+    await client.drop_database(args.database)
+    await init_beanie(database=database, document_models=DOCUMENT_MODELS)
+    return client
+
+
+@dataclass
+class ReplayStats:
+    answer_latency: list[float] = field(default_factory=list)
+    learn_latency: list[float] = field(default_factory=list)
+    speak_latency: list[float] = field(default_factory=list)
+    answers: int = 0
+
+
+async def replay_message(args: argparse.Namespace, index: int, data: dict, stats: ReplayStats) -> None:
+    """
+    依次回复、学习一条消息，按参数定期写回和主动发言，记录各自的耗时
+    """
+
+    from src.plugins.repeater.model import Chat, ChatData  # noqa: PLC0415
+
+    chat = Chat(ChatData(**data))
+    begin = time.perf_counter()
+    answer_generator = await chat.answer()
+    if answer_generator:
+        stats.answers += len([item async for item in answer_generator])
+    stats.answer_latency.append(time.perf_counter() - begin)
+
+    begin = time.perf_counter()
+    await chat.learn()
+    stats.learn_latency.append(time.perf_counter() - begin)
+
+    if index % args.flush_every == 0:
+        await Chat.flush_context()
+    if index % args.speak_every == 0:
+        begin = time.perf_counter()
+        await Chat.speak()
+        stats.speak_latency.append(time.perf_counter() - begin)
+
+
+def build_report(args: argparse.Namespace, stats: ReplayStats, elapsed: float, commands: Counter[str]) -> dict:
+    # 内存中的替代品统计不到数据库操作
+    mongo_ops = sum(commands.values()) if args.mongo == "local" else None
+    ms = 1000
+    return {
+        "messages": args.messages,
+        "groups": args.groups,
+        "seed": args.seed,
+        "mongo": args.mongo,
+        "storage": args.storage,
+        "elapsed_s": round(elapsed, 3),
+        "messages_per_s": round(args.messages / elapsed, 1),
+        "answer_p50_ms": round(percentile(stats.answer_latency, 50) * ms, 3),
+        "answer_p99_ms": round(percentile(stats.answer_latency, 99) * ms, 3),
+        "learn_p50_ms": round(percentile(stats.learn_latency, 50) * ms, 3),
+        "learn_p99_ms": round(percentile(stats.learn_latency, 99) * ms, 3),
+        "speak_p99_ms": round(percentile(stats.speak_latency, 99) * ms, 3),
+        "answers": stats.answers,
+        "mongo_ops": mongo_ops,
+        "mongo_ops_per_message": round(mongo_ops / args.messages, 3) if mongo_ops is not None else None,
+        "mongo_commands": dict(commands.most_common()),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+async def replay(args: argparse.Namespace) -> dict:
+    # Chat 的配置在导入时读取，需要先初始化 NoneBot
+    from src.plugins.repeater.model import Chat, keywords_extractor  # noqa: PLC0415
+
+    counter = CommandCounter()
+    client = await connect(args, counter)
+    if args.storage == "sqlite":
+        remove_sqlite(args.sqlite_path)
+    corpus = CorpusGenerator(
+        CorpusConfig(
+            groups=args.groups,
+            users_per_group=args.users,
+            bots=args.bots,
+            messages=args.messages + args.warmup,
+            seed=args.seed,
+        )
+    )
+
+    stats = ReplayStats()
+    commands_before = Counter()
+    start = time.perf_counter()
+    for index, data in enumerate(corpus):
+        if index == args.warmup:
+            # 预热阶段不计入统计
+            stats = ReplayStats()
+            commands_before = counter.commands.copy()
+            start = time.perf_counter()
+        await replay_message(args, index, data, stats)
+
+    await Chat.sync()
+    elapsed = time.perf_counter() - start
+    commands = counter.commands - commands_before
+
+    await Chat.close()
+    keywords_extractor.shutdown()
+    if args.mongo == "local" and not args.keep:
+        await client.drop_database(args.database)
+    if args.storage == "sqlite" and not args.keep:
+        remove_sqlite(args.sqlite_path)
+
+    return build_report(args, stats, elapsed, commands)
+
+
+def print_report(report: dict, baseline: dict | None) -> None:
+    for key, value in report.items():
+        if key == "mongo_commands":
+            continue
+        line = f"{key:>24}: {value}"
+        old = baseline.get(key) if baseline else None
+        if isinstance(value, int | float) and isinstance(old, int | float) and old:
+            line += f"  ({(value - old) / old:+.1%} vs {old})"
+        print(line)
+    if report["mongo_commands"]:
+        print(f"{'mongo_commands':>24}: {report['mongo_commands']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mongo", choices=["local", "memory"], default="local")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=27017)
+    parser.add_argument("--database", default="PallasBotBench")
+    parser.add_argument("--keep", action="store_true", help="跑完后保留基准数据库")
+    parser.add_argument("--storage", choices=["mongo", "sqlite"], default="mongo", help="复读机的存储后端")
+    parser.add_argument("--sqlite-path", default="data/repeater-bench.db")
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--users", type=int, default=30, help="每个群的群友数")
+    parser.add_argument("--bots", type=int, default=1)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--warmup", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=114514)
+    parser.add_argument("--flush-every", type=int, default=500, help="每多少条消息写回一次 Context")
+    parser.add_argument("--speak-every", type=int, default=200, help="每多少条消息尝试一次主动发言")
+    parser.add_argument("--output", help="把结果保存为 json")
+    parser.add_argument("--compare", help="与之前保存的 json 结果对比")
+    args = parser.parse_args()
+
+    # 基准中不保存回复记录快照，也不启用多进程
+    nonebot.init(
+        reply_history_snapshot="",
+        shard_workers=0,
+        repeater_storage=args.storage,
+        repeater_sqlite_path=args.sqlite_path,
+    )
+    report = asyncio.run(replay(args))
+
+    baseline = None
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+    print_report(report, baseline)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ from beanie import Document
 from pydantic import BaseModel
 
 from src.common.db import BotConfigModule, GroupConfigModule, SingProgress, UserConfigModule
+from src.common.utils.locks import StripedLock
 
 KEY_JOINER = "."
 
@@ -14,14 +15,15 @@ class Config:
     _in_memory_cache: dict | None = None
     _module_class: Document | None = None
     _primary_key: str | None = None
-    _lock: asyncio.Lock | None = None
+    # 按 ( 账号, key ) 分段加锁，不同群的冷却、醉酒等互不等待
+    _locks = StripedLock("config")
 
     async def _find(self, key: str) -> Any:
         config_document = await self._module_class.find_one(self._db_filter)
         return getattr(config_document, key) if config_document else None
 
     async def _find_in_memory(self, key: str) -> Any:
-        async with self._lock:
+        async with self._locks((self._document_key, key)):
             if self._document_key not in self._in_memory_cache:
                 self._in_memory_cache[self._document_key] = {}
             cache = self._in_memory_cache[self._document_key]
@@ -33,7 +35,7 @@ class Config:
         )
 
     async def _update_in_memory(self, key: str, value: Any) -> None:
-        async with self._lock:
+        async with self._locks((self._document_key, key)):
             if self._document_key not in self._in_memory_cache:
                 self._in_memory_cache[self._document_key] = {}
             cache = self._in_memory_cache[self._document_key]
@@ -41,10 +43,16 @@ class Config:
 
     @classmethod
     async def _update_all(cls, key: str, value: Any) -> None:
-        for cache_key in cls._in_memory_cache:
-            if cache_key.startswith(key):
-                async with cls._lock:
-                    cls._in_memory_cache[cache_key] = value
+        """
+        修改所有账号缓存中的 key 以及 key.xxx ( 例如每个群的 drunk.群号 )
+        """
+
+        prefix = f"{key}{KEY_JOINER}"
+        # 加锁时可能有新的账号、群写入缓存，先复制一份再遍历
+        for document_key, cache in list(cls._in_memory_cache.items()):
+            for cache_key in [k for k in cache if k == key or k.startswith(prefix)]:
+                async with cls._locks((document_key, cache_key)):
+                    cache[cache_key] = value
 
     def __init__(self, module_class: Document, primary_key: str, key_id: int) -> None:
         self._document_key = key_id
@@ -53,8 +61,6 @@ class Config:
         self.__class__._primary_key = primary_key
         if self.__class__._in_memory_cache is None:
             self.__class__._in_memory_cache = {}
-        if self.__class__._lock is None:
-            self.__class__._lock = asyncio.Lock()
 
 
 class BotConfig(Config):
@@ -147,6 +153,12 @@ class BotConfig(Config):
             on_sober_up(self.bot_id, self.group_id, value)
         return True
 
+    async def set_drunkenness(self, value: int) -> None:
+        """
+        同步醉酒程度，不触发喝酒、醒酒回调
+        """
+        await self._update_in_memory(f"drunk{KEY_JOINER}{self.group_id}", value)
+
     async def drunkenness(self) -> int:
         """
         获取醉酒程度
@@ -7,25 +7,33 @@ from .modules import (
     BlackList,
     BotConfigModule,
     Context,
+    ContextAnswer,
     GroupConfigModule,
     ImageCache,
+    MaintenanceCheckpoint,
     Message,
+    MessageClaim,
+    Sample,
     SingProgress,
     UserConfigModule,
+    merge_samples,
+    sample_key,
 )
 
+DOCUMENT_MODELS = [
+    BotConfigModule,
+    GroupConfigModule,
+    UserConfigModule,
+    Message,
+    Context,
+    ContextAnswer,
+    BlackList,
+    ImageCache,
+    MaintenanceCheckpoint,
+    MessageClaim,
+]
+
 
 async def init_db(host: str, port: int):
     mongo_client = AsyncIOMotorClient(host, port, unicode_decode_error_handler="ignore")
-    await init_beanie(
-        database=mongo_client["PallasBot"],
-        document_models=[
-            BotConfigModule,
-            GroupConfigModule,
-            UserConfigModule,
-            Message,
-            Context,
-            BlackList,
-            ImageCache,
-        ],
-    )
+    await init_beanie(database=mongo_client["PallasBot"], document_models=DOCUMENT_MODELS)
@@ -1,9 +1,13 @@
+import hashlib
 import time
+from collections import Counter
+from collections.abc import Mapping
 from datetime import datetime, timedelta
+from typing import ClassVar
 
 import pymongo
 from beanie import Document
-from pydantic import BaseModel, Field, PrivateAttr
+from pydantic import BaseModel, Field, PrivateAttr, model_validator
 from pymongo import IndexModel
 
 
@@ -72,13 +76,66 @@ class Ban(BaseModel):
     time: int = Field(default_factory=lambda: int(time.time()))
 
 
+def sample_key(message: str) -> int:
+    """
+    消息的随机优先级，同一条消息总是相同；保留 key 最小的 N 条，就是所有不同消息的均匀抽样
+    """
+
+    return int.from_bytes(hashlib.blake2b(message.encode(), digest_size=8).digest(), "big") >> 1
+
+
+class Sample(BaseModel):
+    message: str = Field(...)
+    count: int = 1
+    key: int = 0
+
+    @model_validator(mode="after")
+    def _fill_key(self) -> "Sample":
+        if not self.key:
+            self.key = sample_key(self.message)
+        return self
+
+
+def merge_samples(samples: list[Sample], messages: Mapping[str, int], limit: int = 0) -> None:
+    """
+    把 {消息: 次数} 合并进 samples，超过 limit 条时只保留 key 最小的
+    """
+
+    index = {sample.message: sample for sample in samples}
+    added = False
+    for message, count in messages.items():
+        sample = index.get(message)
+        if sample is None:
+            sample = index[message] = Sample(message=message, count=0)
+            samples.append(sample)
+            added = True
+        sample.count += count
+    if added:
+        samples.sort(key=lambda sample: sample.key)
+        if limit:
+            del samples[limit:]
+
+
 class Answer(BaseModel):
+    # 合并旧数据的 messages 时最多保留多少条不同的消息，0 为不限；由存储后端按 ANSWER_SAMPLES_LIMIT 设置
+    SAMPLES_LIMIT: ClassVar[int] = 0
+
     _topical: int = PrivateAttr(default=0)
     keywords: str = Field(...)
     group_id: int = Field(...)
     count: int = 1
     time: int = Field(default_factory=lambda: int(time.time()))
-    messages: list[str] = Field(default_factory=list)
+    # 去重后的消息及其出现次数，按次数加权随机选择
+    samples: list[Sample] = Field(default_factory=list)
+    # 旧数据中逐条追加的消息，读取时合并进 samples
+    messages: list[str] = Field(default_factory=list, exclude=True)
+
+    @model_validator(mode="after")
+    def _merge_messages(self) -> "Answer":
+        if self.messages:
+            merge_samples(self.samples, Counter(self.messages), self.SAMPLES_LIMIT)
+            self.messages = []
+        return self
 
 
 class Context(Document):
@@ -87,12 +144,18 @@ class Context(Document):
     trigger_count: int = Field(default=1, alias="count")
     answers: list[Answer] = Field(default_factory=list)
     ban: list[Ban] = Field(default_factory=list)
+    # 被超过 N 个群 ban 掉的回复，在 ban 时预先算好
+    cross_group_ban: list[str] = Field(default_factory=list)
     clear_time: int = 0
+    # 文档中还有 flushes：最近几批写回的 flush_id，只用于重试时去重，不读取
 
     class Settings:
         collection = "context"
         indexes = [
             IndexModel([("keywords", pymongo.HASHED)], name="keywords_index"),
+            # 多个进程同时写回时按 keywords upsert，唯一索引保证不会新建出重复的文档
+            # 旧数据中已有重复文档时，请先运行 tools/dedup_contexts.py
+            IndexModel([("keywords", pymongo.ASCENDING)], name="keywords_unique_index", unique=True),
             IndexModel([("count", pymongo.DESCENDING)], name="count_index"),
             IndexModel([("time", pymongo.DESCENDING)], name="time_index"),
             IndexModel(
@@ -103,6 +166,34 @@ class Context(Document):
         ]
 
 
+class ContextAnswer(Document):
+    """
+    拆分存储时，每条 answer 单独一个文档
+    """
+
+    context: str = Field(...)
+    keywords: str = Field(...)
+    group_id: int = Field(...)
+    count: int = 1
+    time: int = Field(default_factory=lambda: int(time.time()))
+    samples: list[Sample] = Field(default_factory=list)
+    # 旧数据中逐条追加的消息
+    messages: list[str] = Field(default_factory=list)
+    # 文档中还有 flushes，同 Context
+
+    class Settings:
+        collection = "context_answer"
+        indexes = [
+            IndexModel(
+                [("context", pymongo.ASCENDING), ("group_id", pymongo.ASCENDING), ("keywords", pymongo.ASCENDING)],
+                name="answer_key_index",
+                unique=True,
+            ),
+            IndexModel([("context", pymongo.ASCENDING), ("count", pymongo.DESCENDING)], name="context_count_index"),
+            IndexModel([("time", pymongo.DESCENDING)], name="time_index"),
+        ]
+
+
 class BlackList(Document):
     group_id: int = Field(...)
     answers: list[str] = Field(default_factory=list)
@@ -126,24 +217,78 @@ class BaseImageCache(Document):
 
 
 class ImageCache(BaseImageCache):
+    """
+    图片只在 media_cache 的 BlobStore 中按内容哈希存一份，这里只记录元数据
+    """
+
     cq_code: str = Field(...)
-    base64_data: str | None = None
+    digest: str | None = None  # 图片内容的 sha256，为空表示还没有缓存
+    size: int = 0
+    base64_data: str | None = None  # 旧数据，读取时迁移到 BlobStore
     ref_times: int = 1
 
     class Settings:
         collection = "image_cache"
-        indexes = [IndexModel([("cq_code", pymongo.HASHED)], name="cq_code_index")]
+        indexes = [
+            IndexModel([("cq_code", pymongo.HASHED)], name="cq_code_index"),
+            # 多个进程同时写回出现次数时按 cq_code upsert，唯一索引保证不会新建出重复的文档
+            # 旧数据中已有重复文档时，请先运行 tools/dedup_image_cache.py
+            IndexModel([("cq_code", pymongo.ASCENDING)], name="cq_code_unique_index", unique=True),
+        ]
+
+
+class MaintenanceCheckpoint(Document):
+    """
+    维护任务的进度，重启后从这里继续
+    """
+
+    name: str = Field(...)
+    state: dict | None = None  # 为 None 时表示没有进行中的一轮
+    started: int = 0
+    finished: int = 0
+
+    class Settings:
+        collection = "maintenance"
+        indexes = [IndexModel([("name", pymongo.ASCENDING)], name="name_index", unique=True)]
+
+
+class MessageClaim(Document):
+    """
+    多个进程之间去重用的消息记录，先插入成功的进程处理这条消息，过期后由 MongoDB 自动删除
+    """
+
+    name: str = Field(...)
+    group_id: int = Field(...)
+    message_id: int = Field(...)
+    expire_at: datetime = Field(...)
+
+    class Settings:
+        collection = "message_claim"
+        indexes = [
+            IndexModel(
+                [("name", pymongo.ASCENDING), ("group_id", pymongo.ASCENDING), ("message_id", pymongo.ASCENDING)],
+                name="claim_index",
+                unique=True,
+            ),
+            IndexModel([("expire_at", pymongo.ASCENDING)], name="expire_index", expireAfterSeconds=0),
+        ]
 
 
 __all__ = [
+    "sample_key",
+    "merge_samples",
     "SingProgress",
     "BotConfigModule",
     "GroupConfigModule",
     "UserConfigModule",
     "Message",
     "Ban",
+    "Sample",
     "Answer",
     "Context",
+    "ContextAnswer",
     "BlackList",
     "ImageCache",
+    "MaintenanceCheckpoint",
+    "MessageClaim",
 ]
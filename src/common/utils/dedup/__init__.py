@@ -0,0 +1,108 @@
+import time
+from collections import OrderedDict
+from datetime import UTC, datetime, timedelta
+
+from nonebot import logger
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from src.common.db import MessageClaim
+
+
+class MongoClaimStore:
+    """
+    多个牛牛进程共享的去重记录，存在 MongoDB 中，靠唯一索引保证只有一个进程能插入成功
+    """
+
+    @staticmethod
+    async def claim(name: str, group_id: int, message_id: int, ttl: float) -> bool:
+        try:
+            await MessageClaim.get_motor_collection().insert_one({
+                "name": name,
+                "group_id": group_id,
+                "message_id": message_id,
+                "expire_at": datetime.now(UTC) + timedelta(seconds=ttl),
+            })
+        except DuplicateKeyError:
+            return False
+        return True
+
+
+class MessageDedup:
+    """
+    按群记录最近处理过的 message_id，同一条消息只处理一次 ( 多账号在同一个群里时会各收到一次 )
+
+    每个群一个按插入顺序排列的 OrderedDict，查询、插入、淘汰都是 O(1)；
+    超过 ttl 秒或超过 capacity 条的记录从最早的开始淘汰
+
+    指定 store 时，本进程第一次见到的消息还要到共享存储中登记，多个进程之间也只处理一次；
+    共享存储不可用时只按本进程的记录判断
+    """
+
+    def __init__(self, name: str, capacity: int = 1024, ttl: float = 600, store: MongoClaimStore | None = None) -> None:
+        self.name = name
+        self._capacity = max(capacity, 1)
+        self._ttl = ttl
+        self._store = store
+        self._groups: dict[int, OrderedDict[int, float]] = {}
+
+        self.duplicates = 0
+        self.shared_duplicates = 0  # 被其他进程处理过的
+        self.store_errors = 0
+
+    def seen_locally(self, group_id: int, message_id: int, now: float | None = None) -> bool:
+        """
+        本进程是否已经见过这条消息，没见过时记录下来
+        """
+
+        now = time.monotonic() if now is None else now
+        seen = self._groups.get(group_id)
+        if seen is None:
+            seen = self._groups[group_id] = OrderedDict()
+
+        # 过期时间和插入顺序一致，只需要看最早的几条
+        while seen:
+            oldest, expire = next(iter(seen.items()))
+            if expire > now:
+                break
+            del seen[oldest]
+
+        if message_id in seen:
+            self.duplicates += 1
+            return True
+
+        seen[message_id] = now + self._ttl
+        if len(seen) > self._capacity:
+            seen.popitem(last=False)
+        return False
+
+    async def first_seen(self, group_id: int, message_id: int) -> bool:
+        """
+        是否是第一次见到这条消息，是的话调用方负责处理
+        """
+
+        if self.seen_locally(group_id, message_id):
+            return False
+        if self._store is None:
+            return True
+
+        try:
+            claimed = await self._store.claim(self.name, group_id, message_id, self._ttl)
+        except PyMongoError as e:
+            self.store_errors += 1
+            logger.warning(f"message dedup [{self.name}] store error: {e}")
+            return True
+        if not claimed:
+            self.shared_duplicates += 1
+        return claimed
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "groups": len(self._groups),
+            "tracked": sum(len(seen) for seen in self._groups.values()),
+            "duplicates": self.duplicates,
+            "shared_duplicates": self.shared_duplicates,
+            "store_errors": self.store_errors,
+        }
+
+
+__all__ = ["MessageDedup", "MongoClaimStore"]
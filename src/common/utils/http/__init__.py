@@ -0,0 +1,469 @@
+import asyncio
+import importlib.util
+import logging
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, replace
+from typing import Any
+
+import httpx
+from nonebot import logger
+from tenacity import before_sleep_log, retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+
+# 未单独配置的上游共用这个连接池
+DEFAULT_POOL = ""
+# 响应缓存默认最多占用的字节数
+DEFAULT_CACHE_BYTES = 16 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class HostOptions:
+    """
+    一个上游的连接池配置
+    """
+
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 5.0
+    http2: bool = False  # 需要安装 h2，没有安装时退回 HTTP/1.1
+    concurrency: int = 0  # 同时进行的请求数上限，0 为不限
+
+
+class _HostGate:
+    """
+    单个上游的并发上限，同时记录请求数、排队情况
+    """
+
+    def __init__(self, concurrency: int) -> None:
+        self._semaphore = asyncio.Semaphore(concurrency) if concurrency > 0 else None
+
+        self.requests = 0
+        self.in_flight = 0
+        self.waiting = 0  # 当前排队数
+        self.max_waiting = 0
+        self.total_wait = 0.0
+        self.errors = 0
+
+    async def __aenter__(self) -> None:
+        self.requests += 1
+        semaphore = self._semaphore
+        if semaphore is not None:
+            if not semaphore.locked():
+                await semaphore.acquire()
+            else:
+                self.waiting += 1
+                self.max_waiting = max(self.max_waiting, self.waiting)
+                start = time.perf_counter()
+                try:
+                    await semaphore.acquire()
+                finally:
+                    self.waiting -= 1
+                    self.total_wait += time.perf_counter() - start
+        self.in_flight += 1
+
+    async def __aexit__(self, *_) -> None:
+        self.in_flight -= 1
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "total_wait_ms": round(self.total_wait * 1000, 3),
+            "errors": self.errors,
+        }
+
+
+class _ResponseCache:
+    """
+    按字节数限制大小的 LRU 响应缓存，每条记录有自己的过期时间
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._items: OrderedDict[tuple[str, str], tuple[float, httpx.Response, int]] = OrderedDict()
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple[str, str]) -> httpx.Response | None:
+        item = self._items.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expire, response, _ = item
+        if expire <= time.monotonic():
+            self._pop(key)
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return response
+
+    def put(self, key: tuple[str, str], response: httpx.Response, ttl: float) -> None:
+        size = len(response.content)
+        if size > self.max_bytes:
+            return
+        self._pop(key)
+        self._items[key] = (time.monotonic() + ttl, response, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            self._pop(next(iter(self._items)))
+            self.evictions += 1
+
+    def _pop(self, key: tuple[str, str]) -> None:
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.size -= item[2]
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+            "cache_evictions": self.evictions,
+            "cache_entries": len(self._items),
+            "cache_bytes": self.size,
+        }
+
+
+class _Pool:
+    """
+    一个 httpx.AsyncClient，以及每个 client 上还没结束的请求数
+    """
+
+    def __init__(self, options: HostOptions) -> None:
+        self.options = options
+        self.client: httpx.AsyncClient | None = None
+        self.users: dict[httpx.AsyncClient, int] = {}
+        self.rotations = 0
+
+
+class HTTPXClient:
+    """
+    进程内共用的 HTTP 客户端
+
+    锁只保护 client 的创建和替换，请求之间可以并发；
+    单独配置过的上游使用自己的连接池 ( 连接数、keep-alive、HTTP/2 )，其他上游共用默认连接池，
+    每个上游 ( host:port ) 各自限制并发数；
+    指定了 pool 的请求 ( 如下载图片 ) 使用 configure_pool 配置的连接池，按 pool:host 单独限制并发，不影响其他请求
+    """
+
+    _lock = asyncio.Lock()
+    _default_options = HostOptions()
+    _host_options: dict[str, HostOptions] = {}
+    _pool_options: dict[str, HostOptions] = {}
+    _pools: dict[str, _Pool] = {}
+    _gates: dict[str, _HostGate] = {}
+    _retrying: Callable[..., Awaitable[httpx.Response]] | None = None
+    _download_retrying: Callable[..., Awaitable[bytes | None]] | None = None
+    _inflight: dict[tuple[str, str], asyncio.Future] = {}
+    _cache = _ResponseCache(DEFAULT_CACHE_BYTES)
+    _upstream = 0  # 实际发往上游的请求数，包括重试
+    _coalesced = 0  # 合并到其他请求上的 GET 数
+    _oversized = 0  # 超过大小上限被中止的下载数
+
+    DEFAULT_TIMEOUT = 10.0
+
+    DEFAULT_RETRY = {
+        "stop": stop_after_attempt(3),
+        "wait": wait_exponential(multiplier=1, min=1, max=5),
+        "retry": retry_if_exception_type((
+            httpx.ConnectTimeout,
+            httpx.ReadTimeout,
+            httpx.RemoteProtocolError,
+            httpx.NetworkError,
+        )),
+        "before_sleep": before_sleep_log(logger, logging.DEBUG),
+    }
+
+    @staticmethod
+    def _host_key(url: httpx.URL | str) -> str:
+        url = httpx.URL(url)
+        return f"{url.host}:{url.port}" if url.port else url.host
+
+    @classmethod
+    def _route(cls, url: httpx.URL | str | None, pool_name: str | None = None) -> tuple[_Pool, _HostGate]:
+        host = cls._host_key(url) if url is not None else DEFAULT_POOL
+        if pool_name is not None:
+            options = cls._pool_options.get(pool_name, cls._default_options)
+            pool_key, gate_key = pool_name, f"{pool_name}:{host}"
+        else:
+            host_options = cls._host_options.get(host)
+            options = host_options or cls._default_options
+            pool_key = host if host_options is not None else DEFAULT_POOL
+            gate_key = host
+        pool = cls._pools.get(pool_key)
+        if pool is None:
+            pool = cls._pools[pool_key] = _Pool(options)
+        gate = cls._gates.get(gate_key)
+        if gate is None:
+            gate = cls._gates[gate_key] = _HostGate(options.concurrency if host else 0)
+        return pool, gate
+
+    @classmethod
+    def _create(cls, options: HostOptions) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            timeout=cls.DEFAULT_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=options.max_connections,
+                max_keepalive_connections=options.max_keepalive_connections,
+                keepalive_expiry=options.keepalive_expiry,
+            ),
+            http2=options.http2,
+        )
+
+    @classmethod
+    async def _acquire(cls, pool: _Pool) -> httpx.AsyncClient:
+        client = pool.client
+        if client is None or client.is_closed:
+            async with cls._lock:
+                client = pool.client
+                if client is None or client.is_closed:
+                    client = pool.client = cls._create(pool.options)
+        pool.users[client] = pool.users.get(client, 0) + 1
+        return client
+
+    @classmethod
+    async def _release(cls, pool: _Pool, client: httpx.AsyncClient) -> None:
+        users = pool.users[client] - 1
+        if users:
+            pool.users[client] = users
+            return
+        del pool.users[client]
+        # 已经被替换掉的 client 等最后一个请求结束再关闭
+        if client is not pool.client and not client.is_closed:
+            await client.aclose()
+
+    @classmethod
+    async def _rotate(cls, pool: _Pool, client: httpx.AsyncClient) -> None:
+        async with cls._lock:
+            if pool.client is client:
+                pool.client = None
+                pool.rotations += 1
+
+    @classmethod
+    @asynccontextmanager
+    async def get_client(cls, url: httpx.URL | str | None = None, pool_name: str | None = None):
+        """
+        取得 url 所在上游的 client，并占用一个并发名额；不指定 url 时使用默认连接池，不限并发
+        """
+
+        pool, gate = cls._route(url, pool_name)
+        async with gate:
+            client = await cls._acquire(pool)
+            try:
+                yield client
+            except httpx.TransportError as e:
+                logger.error(f"httpx client transport error: {e}")
+                gate.errors += 1
+                # 只替换出错的 client，正在使用它的其他请求不受影响
+                await cls._rotate(pool, client)
+                raise
+            except httpx.HTTPError as e:
+                logger.warning(f"httpx client HTTP error: {e}")
+                gate.errors += 1
+                raise
+            finally:
+                await cls._release(pool, client)
+
+    @classmethod
+    async def close(cls):
+        async with cls._lock:
+            for pool in cls._pools.values():
+                client, pool.client = pool.client, None
+                if client and not client.is_closed and not pool.users.get(client):
+                    await client.aclose()
+
+    @classmethod
+    def _check_options(cls, options: HostOptions) -> HostOptions:
+        if options.http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("http2 is enabled but h2 is not installed, fall back to HTTP/1.1")
+            return replace(options, http2=False)
+        return options
+
+    @classmethod
+    def configure_defaults(
+        cls,
+        timeout: float | None = None,
+        retry_config: dict[str, Any] | None = None,
+        options: HostOptions | None = None,
+        cache_bytes: int | None = None,
+    ):
+        """
+        请在发出请求之前调用，已经创建的连接池不会改变
+        """
+
+        if timeout is not None:
+            cls.DEFAULT_TIMEOUT = timeout
+        if retry_config:
+            cls.DEFAULT_RETRY.update(retry_config)
+            cls._retrying = None
+            cls._download_retrying = None
+        if options is not None:
+            cls._default_options = cls._check_options(options)
+        if cache_bytes is not None:
+            cls._cache = _ResponseCache(cache_bytes)
+
+    @classmethod
+    def configure_host(cls, base_url: str, options: HostOptions) -> None:
+        """
+        给 base_url 所在的上游单独配置连接池和并发上限，请在发出请求之前调用
+        """
+
+        cls._host_options[cls._host_key(base_url)] = cls._check_options(options)
+
+    @classmethod
+    def configure_pool(cls, pool_name: str, options: HostOptions) -> None:
+        """
+        配置一个单独的连接池，请求时用 pool_name 指定；concurrency 按 pool_name 和上游分别限制，请在发出请求之前调用
+        """
+
+        cls._pool_options[pool_name] = cls._check_options(options)
+
+    @classmethod
+    def stats(cls) -> dict[str, dict[str, float]]:
+        """
+        每个上游的请求数、进行中的请求数和排队情况
+        """
+
+        stats = {host or "default": gate.stats() for host, gate in cls._gates.items()}
+        for key, pool in cls._pools.items():
+            if pool.rotations:
+                stats.setdefault(key or "default", {})["rotations"] = pool.rotations
+        return stats
+
+    @classmethod
+    def cache_stats(cls) -> dict[str, int]:
+        """
+        合并的请求数，以及响应缓存的命中情况
+        """
+
+        return {
+            "upstream": cls._upstream,
+            "coalesced": cls._coalesced,
+            "oversized": cls._oversized,
+            **cls._cache.stats(),
+        }
+
+    @classmethod
+    async def _send_once(cls, method: str, url: str, **kwargs) -> httpx.Response:
+        cls._upstream += 1
+        async with cls.get_client(url) as client:
+            response = await client.request(method, url, **kwargs)
+            response.raise_for_status()
+            return response
+
+    @classmethod
+    async def _send(cls, method: str, url: str, **kwargs) -> httpx.Response:
+        # 重试的包装只在配置变化后重建一次，不用每个请求都重新装饰
+        if cls._retrying is None:
+            cls._retrying = retry(**cls.DEFAULT_RETRY)(cls._send_once)
+        return await cls._retrying(method, url, **kwargs)
+
+    @classmethod
+    async def _send_shared(cls, url: str, **kwargs) -> httpx.Response:
+        """
+        相同的 GET 同时只向上游发一次，其他调用等待同一个结果
+        """
+
+        key = (url, repr(sorted(kwargs.items())))
+        task = cls._inflight.get(key)
+        if task is not None:
+            cls._coalesced += 1
+        else:
+            # 放到单独的 task 里，发起者被取消时其他等待者不受影响
+            task = asyncio.ensure_future(cls._send("GET", url, **kwargs))
+            cls._inflight[key] = task
+            task.add_done_callback(lambda done: cls._finish_shared(key, done))
+        return await asyncio.shield(task)
+
+    @classmethod
+    def _finish_shared(cls, key: tuple[str, str], task: asyncio.Future) -> None:
+        if cls._inflight.get(key) is task:
+            del cls._inflight[key]
+        if not task.cancelled():
+            # 所有等待者都被取消时，不提示异常未被获取
+            task.exception()
+
+    @classmethod
+    async def get(cls, url: str, cache_ttl: float = 0, **kwargs) -> httpx.Response | None:
+        """
+        cache_ttl 大于 0 时，成功的响应在这么多秒内直接从缓存返回
+        """
+
+        key = (url, repr(sorted(kwargs.items())))
+        if cache_ttl > 0:
+            response = cls._cache.get(key)
+            if response is not None:
+                return response
+
+        try:
+            response = await cls._send_shared(url, **kwargs)
+        except httpx.HTTPStatusError as e:
+            logger.warning(f"Request GET {url} failed after retries: {e}")
+            return None
+
+        if cache_ttl > 0:
+            cls._cache.put(key, response, cache_ttl)
+        return response
+
+    @classmethod
+    async def _download_once(cls, url: str, max_bytes: int, pool_name: str | None, **kwargs) -> bytes | None:
+        cls._upstream += 1
+        async with cls.get_client(url, pool_name) as client, client.stream("GET", url, **kwargs) as response:
+            response.raise_for_status()
+            length = response.headers.get("content-length", "")
+            if length.isdigit() and int(length) > max_bytes:
+                return None
+            chunks = []
+            size = 0
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+                if size > max_bytes:
+                    return None
+                chunks.append(chunk)
+            return b"".join(chunks)
+
+    @classmethod
+    async def download(cls, url: str, max_bytes: int, pool_name: str | None = None, **kwargs) -> bytes | None:
+        """
+        流式下载，超过 max_bytes 时中止并返回 None，不会把整个大文件读进内存；pool_name 见 configure_pool
+        """
+
+        if cls._download_retrying is None:
+            cls._download_retrying = retry(**cls.DEFAULT_RETRY)(cls._download_once)
+        try:
+            data = await cls._download_retrying(url, max_bytes, pool_name, **kwargs)
+        except Exception as e:
+            logger.warning(f"Download {url} failed after retries: {e}")
+            return None
+        if data is None:
+            cls._oversized += 1
+            logger.warning(f"Download {url} aborted, larger than {max_bytes} bytes")
+        return data
+
+    @classmethod
+    async def post(cls, url: str, json: dict[str, Any] | None = None, **kwargs) -> httpx.Response | None:
+        try:
+            return await cls._send("POST", url, json=json, **kwargs)
+        except Exception as e:
+            logger.warning(f"Request POST {url} failed after retries: {e}")
+            return None
+
+    @classmethod
+    async def delete(cls, url: str, **kwargs) -> httpx.Response | None:
+        try:
+            return await cls._send("DELETE", url, **kwargs)
+        except Exception as e:
+            logger.warning(f"Request DELETE {url} failed after retries: {e}")
+            return None
+
+
+__all__ = ["HTTPXClient", "HostOptions"]
@@ -0,0 +1,75 @@
+import asyncio
+import time
+from collections.abc import Hashable
+
+_registry: dict[str, "StripedLock"] = {}
+
+
+class _Guard:
+    __slots__ = ("_lock", "_owner")
+
+    def __init__(self, owner: "StripedLock", lock: asyncio.Lock) -> None:
+        self._owner = owner
+        self._lock = lock
+
+    async def __aenter__(self) -> None:
+        owner = self._owner
+        owner.acquisitions += 1
+        if not self._lock.locked():
+            await self._lock.acquire()
+            return
+
+        # 只有需要等待时才计时
+        start = time.perf_counter()
+        await self._lock.acquire()
+        wait = time.perf_counter() - start
+        owner.contended += 1
+        owner.total_wait += wait
+        owner.max_wait = max(owner.max_wait, wait)
+
+    async def __aexit__(self, *_) -> None:
+        self._lock.release()
+
+
+class StripedLock:
+    """
+    分段锁，按 key 的哈希分到固定数量的锁上
+
+    同一个 key 总是同一把锁，不同的 key 大多不会互相等待；同时记录等待次数和等待时间，确认锁竞争的情况
+
+        async with Chat._message_locks(group_id):
+            ...
+    """
+
+    def __init__(self, name: str, stripes: int = 64) -> None:
+        self.name = name
+        self._locks = [asyncio.Lock() for _ in range(max(stripes, 1))]
+
+        self.acquisitions = 0
+        self.contended = 0  # 需要等待的次数
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        _registry[name] = self
+
+    def __call__(self, key: Hashable) -> _Guard:
+        return _Guard(self, self._locks[hash(key) % len(self._locks)])
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "acquisitions": self.acquisitions,
+            "contended": self.contended,
+            "total_wait_ms": round(self.total_wait * 1000, 3),
+            "avg_wait_ms": round(self.total_wait / self.contended * 1000, 3) if self.contended else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+        }
+
+
+def lock_stats() -> dict[str, dict[str, float]]:
+    """
+    所有分段锁的等待统计
+    """
+
+    return {name: lock.stats() for name, lock in _registry.items()}
+
+
+__all__ = ["StripedLock", "lock_stats"]
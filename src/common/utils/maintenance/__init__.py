@@ -0,0 +1,237 @@
+import asyncio
+import math
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from datetime import datetime
+
+from nonebot import logger
+
+from src.common.db import MaintenanceCheckpoint
+
+# step(state, limit) 每次处理不超过 limit 条数据，返回新的进度，整轮完成时返回 None
+# 每轮第一次调用时 state 为空 dict，进度需要能存进 Mongo
+MaintenanceStep = Callable[[dict, int], Awaitable[dict | None]]
+# 同一个任务连续失败这么多片就放弃这一轮
+MAX_FAILURES = 3
+
+
+@dataclass
+class MaintenanceJob:
+    name: str
+    step: MaintenanceStep
+    period: int = 24 * 3600  # 每轮的间隔 ( 秒 )
+    batch_size: int = 1000  # 每片的初始大小，之后按实际耗时调整
+    on_finish: Callable[[], Awaitable[None]] | None = None
+    hour: int = 4  # 每轮从本地时间的这个整点开始对齐，不随上一轮的结束时间漂移
+
+
+_jobs: dict[str, MaintenanceJob] = {}
+
+
+def maintenance_job(
+    name: str,
+    period: int = 24 * 3600,
+    batch_size: int = 1000,
+    on_finish: Callable[[], Awaitable[None]] | None = None,
+    hour: int = 4,
+) -> Callable[[MaintenanceStep], MaintenanceStep]:
+    """
+    注册一个可以分片执行的维护任务，由 MaintenanceScheduler 在 hour 点之后的空闲时间逐片执行
+    """
+
+    def decorator(step: MaintenanceStep) -> MaintenanceStep:
+        _jobs[name] = MaintenanceJob(name, step, period, batch_size, on_finish, hour)
+        return step
+
+    return decorator
+
+
+async def run_job(name: str) -> None:
+    """
+    不分时段，一次性跑完一整轮，给手动维护用
+    """
+
+    job = _jobs[name]
+    state: dict | None = {}
+    while state is not None:
+        state = await job.step(state, job.batch_size)
+    if job.on_finish is not None:
+        await job.on_finish()
+
+
+@dataclass(frozen=True)
+class SchedulerOptions:
+    slice_budget: float = 2.0  # 每次 tick 最多用多少时间 ( 秒 )，越忙用得越少
+    busy_rate: float = 1.0  # 事件频率 ( 个 / 秒 ) 达到这个值就算忙，暂停维护任务
+    max_delay: int = 12 * 3600  # 到了时间点之后这么久还没跑完的任务，忙的时候也继续跑 ( 秒 )
+    alpha: float = 0.2  # 事件频率指数加权平均的系数
+    min_batch: int = 10
+    max_batch: int = 10000
+
+
+class MaintenanceScheduler:
+    """
+    维护任务的调度器
+
+    定时 tick，按最近的事件频率决定这次能用多少时间：越闲用得越多，忙的时候不跑，
+    除非任务已经拖得太久。每跑完一片就把进度写回数据库，重启后接着跑
+
+    每个任务按 hour 对齐到固定的时间点 ( 如每天 4 点 )，时间点之后还没开始过新一轮就该跑了；
+    第一次部署时从下一个时间点开始，不会一启动就把所有任务跑一遍
+    """
+
+    def __init__(self, options: SchedulerOptions) -> None:
+        self._slice_budget = options.slice_budget
+        self._busy_rate = options.busy_rate
+        self._max_delay = options.max_delay
+        self._alpha = options.alpha
+        self._min_batch = options.min_batch
+        self._max_batch = options.max_batch
+
+        self._events = 0
+        self._last_tick: float | None = None
+        self._progress: dict[str, dict] = {}
+        self._limits: dict[str, int] = {}
+        self._failed: dict[str, int] = {}  # 每个任务连续失败的次数
+        self._lock = asyncio.Lock()
+
+        self.event_rate = 0.0  # 事件频率的指数加权平均 ( 个 / 秒 )
+        self.slices = 0
+        self.failures = 0
+
+    def record_event(self) -> None:
+        self._events += 1
+
+    def stats(self) -> dict:
+        return {
+            "event_rate": round(self.event_rate, 3),
+            "slices": self.slices,
+            "failures": self.failures,
+            "running": [name for name, progress in self._progress.items() if progress["state"] is not None],
+        }
+
+    async def tick(self) -> None:
+        if self._lock.locked():
+            return
+
+        async with self._lock:
+            now = time.time()
+            self._update_rate(now)
+            budget = self._slice_budget * max(0.0, 1 - self.event_rate / self._busy_rate)
+            deadline = time.monotonic() + budget
+
+            for job in list(_jobs.values()):
+                progress = await self._load(job.name, now)
+                running = progress["state"] is not None
+                slot = self._last_slot(job, now)
+                if not running and progress["started"] >= slot:
+                    continue
+                overdue = now - (progress["started"] if running else slot) >= self._max_delay
+                if time.monotonic() < deadline:
+                    await self._run(job, progress, deadline)
+                elif overdue:
+                    # 拖太久的任务，忙的时候也至少跑一片
+                    await self._run(job, progress, time.monotonic() + self._slice_budget / 4)
+
+    async def _run(self, job: MaintenanceJob, progress: dict, deadline: float) -> None:
+        if progress["state"] is None:
+            progress["state"] = {}
+            progress["started"] = int(time.time())
+            logger.info(f"maintenance [{job.name}] round started")
+
+        limit = self._limits.get(job.name, job.batch_size)
+        target = self._slice_budget / 4
+        while time.monotonic() < deadline:
+            start = time.monotonic()
+            try:
+                state = await job.step(progress["state"], limit)
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"maintenance [{job.name}] slice failed: {e}")
+                await self._on_failure(job, progress)
+                break
+            self._failed.pop(job.name, None)
+            elapsed = time.monotonic() - start
+            self.slices += 1
+
+            # 按实际耗时调整下一片的大小
+            if elapsed > target:
+                limit = max(self._min_batch, limit // 2)
+            elif elapsed < target / 4:
+                limit = min(self._max_batch, limit * 2)
+
+            if state is None:
+                progress["state"] = None
+                progress["finished"] = int(time.time())
+                await self._save(job.name, progress)
+                logger.info(f"maintenance [{job.name}] round finished in {progress['finished'] - progress['started']}s")
+                if job.on_finish is not None:
+                    try:
+                        await job.on_finish()
+                    except Exception as e:
+                        logger.error(f"maintenance [{job.name}] on_finish failed: {e}")
+                break
+
+            progress["state"] = state
+            await self._save(job.name, progress)
+        self._limits[job.name] = limit
+
+    async def _on_failure(self, job: MaintenanceJob, progress: dict) -> None:
+        """
+        同一片连续失败 MAX_FAILURES 次就放弃这一轮，等下一个时间点重新开始，不再每次 tick 都重试
+        """
+
+        failed = self._failed.get(job.name, 0) + 1
+        if failed < MAX_FAILURES:
+            self._failed[job.name] = failed
+            return
+
+        self._failed.pop(job.name, None)
+        progress["state"] = None
+        progress["finished"] = int(time.time())
+        await self._save(job.name, progress)
+        logger.warning(f"maintenance [{job.name}] round abandoned after {failed} consecutive failures")
+
+    def _update_rate(self, now: float) -> None:
+        if self._last_tick is not None and now > self._last_tick:
+            rate = self._events / (now - self._last_tick)
+            self.event_rate += self._alpha * (rate - self.event_rate)
+        self._events = 0
+        self._last_tick = now
+
+    @staticmethod
+    def _last_slot(job: MaintenanceJob, now: float) -> float:
+        """
+        不晚于 now 的最近一个对齐时间点
+        """
+
+        anchor = datetime.fromtimestamp(now).replace(hour=job.hour, minute=0, second=0, microsecond=0).timestamp()
+        return anchor + math.floor((now - anchor) / job.period) * job.period
+
+    async def _load(self, name: str, now: float) -> dict:
+        progress = self._progress.get(name)
+        if progress is not None:
+            return progress
+
+        doc = await MaintenanceCheckpoint.get_motor_collection().find_one({"name": name})
+        if doc is None:
+            # 没有记录时当作刚跑完一轮，从下一个时间点开始
+            progress = {"state": None, "started": int(now), "finished": int(now)}
+            await self._save(name, progress)
+        else:
+            progress = {
+                "state": doc.get("state"),
+                "started": doc.get("started", 0),
+                "finished": doc.get("finished", 0),
+            }
+        self._progress[name] = progress
+        return progress
+
+    @staticmethod
+    async def _save(name: str, progress: dict) -> None:
+        await MaintenanceCheckpoint.get_motor_collection().update_one(
+            {"name": name},
+            {"$set": progress},
+            upsert=True,
+        )
@@ -1,48 +1,184 @@
-import asyncio
-import base64
-import re
-from datetime import datetime, timedelta
-
-import httpx
-from nonebot.adapters.onebot.v11 import MessageSegment
-
-from src.common.db import ImageCache
-from src.common.utils import HTTPXClient
-
-
-async def insert_image(image_seg: MessageSegment):
-    cq_code = re.sub(r"\.image,.+?\]", ".image]", str(image_seg))
-    cache = await ImageCache.find_one(ImageCache.cq_code == cq_code)
-    if not cache:
-        cache = ImageCache(cq_code=cq_code)
-        await cache.insert()
-        return
-    cache.ref_times += 1
-    # 不是经常收到的图不缓存，不然会占用大量空间
-    if cache.ref_times > 2 and cache.base64_data is None:
-        url = image_seg.data["url"]
-        rsp = await HTTPXClient.get(url)
-        if not rsp or rsp.status_code != httpx.codes.OK:
-            return
-        base64_data = base64.b64encode(rsp.content).decode()
-        cache.base64_data = base64_data
-    await cache.save()
-
-
-async def get_image(cq_code) -> bytes | None:
-    cache = await ImageCache.find_one(ImageCache.cq_code == cq_code)
-    if not cache:
-        return None
-    if cache.base64_data is None:
-        return None
-    return base64.b64decode(cache.base64_data)
-
-
-async def clear_image_cache(days: int = 5, times: int = 3):
-    idate = int(str((datetime.now() - timedelta(days=days)).date()).replace("-", ""))
-    await ImageCache.find(ImageCache.date < idate).delete()
-    await ImageCache.find(ImageCache.ref_times < times).delete()
-
-
-if __name__ == "__main__":
-    asyncio.run(clear_image_cache(5, 3))
+import asyncio
+import base64
+import re
+from datetime import datetime, timedelta
+from typing import Literal
+
+from nonebot.adapters.onebot.v11 import MessageSegment
+
+from src.common.db import ImageCache
+from src.common.utils import HostOptions, HTTPXClient
+
+from .ingest import IMAGE_POOL, ImageIngest, IngestOptions
+from .memory import ImageMemoryCache
+from .store import BlobStore, DiskBlobStore, GridFSBlobStore, blob_digest, create_blob_store
+
+
+class _Images:
+    # 由 configure_image_store、configure_image_ingest 替换
+    store: BlobStore = DiskBlobStore("data/images", 1024 * 1024 * 1024)
+    memory = ImageMemoryCache(64 * 1024 * 1024)
+    ingest = ImageIngest(lambda: _Images.store, IngestOptions())
+
+
+def normalize_cq_code(cq_code: str) -> str:
+    """
+    去掉图片 CQ 码中的 url 等每次都会变化的参数
+    """
+
+    return re.sub(r"\.image,.+?\]", ".image]", cq_code)
+
+
+def configure_image_store(
+    backend: Literal["disk", "gridfs"], path: str, max_bytes: int, memory_bytes: int = 64 * 1024 * 1024
+) -> None:
+    """
+    选择图片的存储方式，memory_bytes 为内存中缓存的图片总大小；请在缓存图片之前调用
+    """
+
+    _Images.store = create_blob_store(backend, path, max_bytes)
+    _Images.memory = ImageMemoryCache(memory_bytes)
+
+
+def configure_image_ingest(
+    workers: int, max_pending: int, max_bytes: int, flush_interval: float, concurrency: int = 0
+) -> None:
+    """
+    配置后台下载图片的任务数、待写回的图片数上限、单张图片的大小上限、写回间隔，
+    以及每个图片服务器同时下载的图片数 ( 0 为不限 )；请在 start_image_ingest 之前调用
+    """
+
+    HTTPXClient.configure_pool(IMAGE_POOL, HostOptions(concurrency=concurrency))
+    _Images.ingest = ImageIngest(
+        lambda: _Images.store,
+        IngestOptions(workers=workers, max_pending=max_pending, max_bytes=max_bytes, flush_interval=flush_interval),
+    )
+
+
+def start_image_ingest() -> None:
+    _Images.ingest.start()
+
+
+async def close_image_ingest() -> None:
+    """
+    停止后台任务，并写回还没写回的出现次数
+    """
+
+    await _Images.ingest.close()
+
+
+def image_store_stats() -> dict[str, dict[str, float]]:
+    return {"store": _Images.store.stats(), "memory": _Images.memory.stats(), "ingest": _Images.ingest.stats()}
+
+
+def insert_image(image_seg: MessageSegment) -> bool:
+    """
+    记录收到了一张图片，出现次数和下载都在后台处理，不会等待数据库和下载
+    """
+
+    cq_code = normalize_cq_code(str(image_seg))
+    return _Images.ingest.submit(cq_code, image_seg.data.get("url"))
+
+
+async def get_image(cq_code) -> str | None:
+    """
+    返回可以直接用作 MessageSegment.image 的 file 的 base64 字符串
+    """
+
+    cq_code = normalize_cq_code(cq_code)
+    data = _Images.memory.get(cq_code)
+    if data is not None:
+        return data
+
+    data = await _load_image(cq_code)
+    if data is not None:
+        _Images.memory.put(cq_code, data)
+    return data
+
+
+async def _load_image(cq_code: str) -> str | None:
+    cache = await ImageCache.find_one(ImageCache.cq_code == cq_code)
+    if not cache:
+        return None
+    if cache.base64_data is not None:
+        return await _migrate(cache)
+    if cache.digest is None:
+        return None
+
+    data = await _Images.store.read_base64(cache.digest)
+    if data is None:
+        # blob 已经被淘汰，下次收到这张图时重新下载
+        await ImageCache.get_motor_collection().update_one({"_id": cache.id}, {"$set": {"digest": None, "size": 0}})
+        return None
+    return f"base64://{data}"
+
+
+async def _migrate(cache: ImageCache) -> str:
+    """
+    把旧数据中内嵌的 base64 转存到 BlobStore
+    """
+
+    base64_data = cache.base64_data
+    raw = base64.b64decode(base64_data)
+    digest = await _Images.store.put(raw)
+    await ImageCache.get_motor_collection().update_one(
+        {"_id": cache.id}, {"$set": {"digest": digest, "size": len(raw)}, "$unset": {"base64_data": ""}}
+    )
+    return f"base64://{base64_data}"
+
+
+async def clear_image_cache(days: int = 5, times: int = 3):
+    state: dict | None = {"days": days, "times": times}
+    while state is not None:
+        state = await clear_image_cache_step(state, 1000)
+
+
+async def clear_image_cache_step(state: dict, limit: int) -> dict | None:
+    """
+    分片清理图片缓存，每次按 _id 顺序删除不超过 limit 个文档
+
+    只删除元数据，blob 可能被其他 cq_code 共用，由 BlobStore 按容量淘汰；内存中缓存的同一批图片一起删除
+    """
+
+    if "date" not in state:
+        days = state.get("days", 5)
+        idate = int(str((datetime.now() - timedelta(days=days)).date()).replace("-", ""))
+        return {"date": idate, "times": state.get("times", 3), "last_id": None}
+
+    query = {"$or": [{"date": {"$lt": state["date"]}}, {"ref_times": {"$lt": state["times"]}}]}
+    if state["last_id"] is not None:
+        query = {"$and": [query, {"_id": {"$gt": state["last_id"]}}]}
+    collection = ImageCache.get_motor_collection()
+    docs = await collection.find(query, {"_id": 1, "cq_code": 1}).sort("_id", 1).limit(limit).to_list(length=limit)
+    ids = [doc["_id"] for doc in docs]
+    if ids:
+        await collection.delete_many({"_id": {"$in": ids}})
+        _Images.memory.invalidate([doc["cq_code"] for doc in docs])
+    if len(ids) < limit:
+        return None
+    return {**state, "last_id": ids[-1]}
+
+
+__all__ = [
+    "BlobStore",
+    "DiskBlobStore",
+    "GridFSBlobStore",
+    "blob_digest",
+    "ImageIngest",
+    "IngestOptions",
+    "ImageMemoryCache",
+    "clear_image_cache",
+    "clear_image_cache_step",
+    "close_image_ingest",
+    "configure_image_ingest",
+    "configure_image_store",
+    "get_image",
+    "image_store_stats",
+    "insert_image",
+    "normalize_cq_code",
+    "start_image_ingest",
+]
+
+
+if __name__ == "__main__":
+    asyncio.run(clear_image_cache(5, 3))
@@ -0,0 +1,214 @@
+import asyncio
+import contextlib
+from collections import Counter
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import datetime
+
+from nonebot import logger
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from src.common.db import ImageCache
+from src.common.utils import HTTPXClient
+
+from .store import BlobStore
+
+# 收到超过这么多次的图片才下载缓存，不然会占用大量空间
+CACHE_REF_TIMES = 2
+# 每次写回、查询的文档数
+FLUSH_BATCH = 1000
+# 下载图片用的连接池，并发上限只作用于图片服务器
+IMAGE_POOL = "image"
+
+
+def _today() -> int:
+    return int(str(datetime.now().date()).replace("-", ""))
+
+
+@dataclass(frozen=True)
+class IngestOptions:
+    workers: int = 2  # 后台下载任务数
+    max_pending: int = 10000  # 最多有多少种图片的出现次数等待写回
+    max_bytes: int = 10 * 1024 * 1024  # 单张图片的大小上限
+    flush_interval: float = 10  # 出现次数的写回间隔 ( 秒 )
+    download_queue: int = 256
+
+
+class ImageIngest:
+    """
+    在后台记录图片的出现次数并下载常见的图片，不阻塞消息处理
+
+    出现次数先在内存中合并，每隔 flush_interval 秒用 $inc 批量写回，写回失败的部分合并回去下次再写；
+    待写回的图片超过 max_pending 种时，新出现的图片这一次不计数，已经在等待写回的图片照常累加；
+    出现次数超过 CACHE_REF_TIMES 的图片交给 workers 个下载任务，下载队列满时跳过，下次写回时再尝试
+    """
+
+    def __init__(self, store: Callable[[], BlobStore], options: IngestOptions) -> None:
+        self._store = store
+        self._workers = max(options.workers, 1)
+        self._max_pending = options.max_pending
+        self._max_bytes = options.max_bytes
+        self._flush_interval = options.flush_interval
+
+        self._refs: Counter[str] = Counter()
+        self._urls: dict[str, str] = {}
+        self._queue: asyncio.Queue[tuple[str, str]] = asyncio.Queue(maxsize=options.download_queue)
+        self._downloading: set[str] = set()
+        self._tasks: list[asyncio.Task] = []
+
+        self.submitted = 0
+        self.dropped = 0  # 因为待写回的图片太多而没有计数的次数
+        self.flushed = 0
+        self.flush_errors = 0
+        self.skipped_downloads = 0  # 下载队列满时跳过的次数
+        self.downloaded = 0
+        self.failed_downloads = 0
+
+    def submit(self, cq_code: str, url: str | None) -> bool:
+        """
+        记录图片出现了一次，立即返回；返回 False 表示这次没有计数
+        """
+
+        self.submitted += 1
+        if cq_code not in self._refs and len(self._refs) >= self._max_pending:
+            self.dropped += 1
+            return False
+        self._refs[cq_code] += 1
+        if url:
+            # 图片链接会过期，保留最新的
+            self._urls[cq_code] = url
+        return True
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks.append(asyncio.create_task(self._flush_loop()))
+        self._tasks.extend(asyncio.create_task(self._download_loop()) for _ in range(self._workers))
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        self._tasks = []
+        await self.flush()
+
+    async def flush(self) -> None:
+        if not self._refs:
+            return
+        refs, self._refs = self._refs, Counter()
+        urls, self._urls = self._urls, {}
+
+        collection = ImageCache.get_motor_collection()
+        codes = list(refs)
+        date = _today()
+        for start in range(0, len(codes), FLUSH_BATCH):
+            batch = codes[start : start + FLUSH_BATCH]
+            requests = [
+                UpdateOne(
+                    {"cq_code": cq_code},
+                    {
+                        "$inc": {"ref_times": refs[cq_code]},
+                        "$set": {"date": date},
+                        "$setOnInsert": {"digest": None, "size": 0},
+                    },
+                    upsert=True,
+                )
+                for cq_code in batch
+            ]
+            try:
+                await collection.bulk_write(requests, ordered=False)
+            except PyMongoError as e:
+                self.flush_errors += 1
+                logger.warning(f"image ingest flush failed: {e}")
+                if isinstance(e, BulkWriteError) and e.details.get("writeErrors"):
+                    # 其余的已经写入了，只把失败的合并回去；并发 upsert 撞上唯一索引的，下次会按更新写入
+                    batch = [batch[error["index"]] for error in e.details["writeErrors"]]
+                self._restore(batch, refs, urls)
+                continue
+            self.flushed += len(batch)
+            try:
+                candidates = await collection.find(
+                    {
+                        "cq_code": {"$in": [cq_code for cq_code in batch if cq_code in urls]},
+                        "ref_times": {"$gt": CACHE_REF_TIMES},
+                        "digest": None,
+                        "base64_data": None,
+                    },
+                    {"cq_code": 1},
+                ).to_list(length=None)
+            except PyMongoError as e:
+                # 出现次数已经写入了，下次写回时再尝试下载
+                logger.warning(f"image ingest find download candidates failed: {e}")
+                continue
+            for doc in candidates:
+                self._enqueue(doc["cq_code"], urls[doc["cq_code"]])
+
+    def _restore(self, codes: list[str], refs: Counter[str], urls: dict[str, str]) -> None:
+        """
+        把写回失败的出现次数合并回待写回的计数中
+
+        连接断开时无法确定是否已经写入，也整批合并回去：出现次数只用来决定是否下载和清理，多算一次比丢掉好
+        """
+
+        for cq_code in codes:
+            self._refs[cq_code] += refs[cq_code]
+            if cq_code in urls:
+                # 这期间收到的链接更新
+                self._urls.setdefault(cq_code, urls[cq_code])
+
+    def _enqueue(self, cq_code: str, url: str) -> None:
+        if cq_code in self._downloading:
+            return
+        try:
+            self._queue.put_nowait((cq_code, url))
+        except asyncio.QueueFull:
+            self.skipped_downloads += 1
+            return
+        self._downloading.add(cq_code)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.exception(f"image ingest flush error: {e}")
+
+    async def _download_loop(self) -> None:
+        while True:
+            cq_code, url = await self._queue.get()
+            try:
+                await self._download(cq_code, url)
+            except Exception as e:
+                self.failed_downloads += 1
+                logger.warning(f"image ingest download {cq_code} failed: {e}")
+            finally:
+                self._downloading.discard(cq_code)
+                self._queue.task_done()
+
+    async def _download(self, cq_code: str, url: str) -> None:
+        data = await HTTPXClient.download(url, self._max_bytes, IMAGE_POOL)
+        if not data:
+            self.failed_downloads += 1
+            return
+        digest = await self._store().put(data)
+        await ImageCache.get_motor_collection().update_one(
+            {"cq_code": cq_code, "digest": None}, {"$set": {"digest": digest, "size": len(data)}}
+        )
+        self.downloaded += 1
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "pending": len(self._refs),
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "flushed": self.flushed,
+            "flush_errors": self.flush_errors,
+            "queued_downloads": self._queue.qsize(),
+            "skipped_downloads": self.skipped_downloads,
+            "downloaded": self.downloaded,
+            "failed_downloads": self.failed_downloads,
+        }
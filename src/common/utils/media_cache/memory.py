@@ -0,0 +1,62 @@
+from collections import OrderedDict
+
+
+class ImageMemoryCache:
+    """
+    按总字节数限制的 LRU，缓存发送时用的图片数据 ( base64 file 字符串 )，按规范化后的 cq_code 索引
+
+    同一批表情包每天会被发送很多次，命中时不用查询数据库和读取图片
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._items: OrderedDict[str, str] = OrderedDict()
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, cq_code: str) -> str | None:
+        data = self._items.get(cq_code)
+        if data is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(cq_code)
+        self.hits += 1
+        return data
+
+    def put(self, cq_code: str, data: str) -> None:
+        if len(data) > self.max_bytes:
+            return
+        self._pop(cq_code)
+        self._items[cq_code] = data
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            self._pop(next(iter(self._items)))
+            self.evictions += 1
+
+    def invalidate(self, cq_codes: list[str]) -> None:
+        for cq_code in cq_codes:
+            if self._pop(cq_code):
+                self.invalidations += 1
+
+    def _pop(self, cq_code: str) -> bool:
+        data = self._items.pop(cq_code, None)
+        if data is None:
+            return False
+        self.size -= len(data)
+        return True
+
+    def stats(self) -> dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._items),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,269 @@
+import asyncio
+import base64
+import hashlib
+import mmap
+import os
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Literal, override
+
+from gridfs.errors import NoFile
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from nonebot import logger
+from pymongo.errors import DuplicateKeyError
+
+from src.common.db import ImageCache
+
+
+def blob_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class _LRUBudget:
+    """
+    按总字节数限制的 LRU 索引，只记录 digest 和大小
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._sizes: OrderedDict[str, int] = OrderedDict()
+        self.size = 0
+
+    def __contains__(self, digest: str) -> bool:
+        return digest in self._sizes
+
+    def __len__(self) -> int:
+        return len(self._sizes)
+
+    def touch(self, digest: str) -> None:
+        if digest in self._sizes:
+            self._sizes.move_to_end(digest)
+
+    def add(self, digest: str, size: int) -> list[str]:
+        """
+        记录一个 blob，返回需要淘汰的 digest ( 最近最少使用的在前 )
+        """
+
+        self.discard(digest)
+        self._sizes[digest] = size
+        self.size += size
+        evicted = []
+        # 刚加入的 blob 本身超出预算时也保留，等下一次淘汰
+        while self.size > self.max_bytes and len(self._sizes) > 1:
+            oldest, oldest_size = self._sizes.popitem(last=False)
+            self.size -= oldest_size
+            evicted.append(oldest)
+        return evicted
+
+    def discard(self, digest: str) -> None:
+        size = self._sizes.pop(digest, None)
+        if size is not None:
+            self.size -= size
+
+
+class BlobStore(ABC):
+    """
+    按内容哈希 ( sha256 ) 存放图片原始数据，内容相同的图片只存一份
+
+    总大小超过 max_bytes 时淘汰最近最少读取的 blob；ImageCache 中指向已淘汰 blob 的记录在读取时清除
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self._budget = _LRUBudget(max_bytes)
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+
+        self.evictions = 0
+
+    async def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if self._loaded:
+                return
+            # 按最近使用时间从旧到新，超出预算的部分直接淘汰
+            evicted = []
+            for digest, size in await self._scan():
+                evicted.extend(self._budget.add(digest, size))
+            await self._evict(evicted)
+            self._loaded = True
+            logger.info(f"image store loaded {len(self._budget)} blobs, {self._budget.size} bytes")
+
+    async def put(self, data: bytes) -> str:
+        """
+        保存图片，返回 digest；已经存在时不重复写入
+        """
+
+        await self._ensure_loaded()
+        digest = blob_digest(data)
+        if digest in self._budget:
+            self._budget.touch(digest)
+            return digest
+        await self._write(digest, data)
+        await self._evict(self._budget.add(digest, len(data)))
+        return digest
+
+    async def read_base64(self, digest: str) -> str | None:
+        """
+        读取图片并编码为 base64，blob 不存在时返回 None
+        """
+
+        await self._ensure_loaded()
+        data = await self._read_base64(digest)
+        if data is None:
+            self._budget.discard(digest)
+        else:
+            self._budget.touch(digest)
+        return data
+
+    async def _evict(self, digests: list[str]) -> None:
+        for digest in digests:
+            self.evictions += 1
+            await self._delete(digest)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "blobs": len(self._budget),
+            "bytes": self._budget.size,
+            "max_bytes": self._budget.max_bytes,
+            "evictions": self.evictions,
+        }
+
+    @abstractmethod
+    async def _scan(self) -> list[tuple[str, int]]:
+        """
+        启动后第一次使用时列出已有的 blob 及大小，按最近使用时间从旧到新排列
+        """
+
+    @abstractmethod
+    async def _write(self, digest: str, data: bytes) -> None: ...
+
+    @abstractmethod
+    async def _read_base64(self, digest: str) -> str | None: ...
+
+    @abstractmethod
+    async def _delete(self, digest: str) -> None: ...
+
+
+class DiskBlobStore(BlobStore):
+    """
+    存放在本地目录，按 digest 前两级分目录：root/ab/cd/abcd...
+
+    读取时 mmap 文件直接编码，不额外复制一份图片；读取会更新文件的修改时间，重启后按它恢复 LRU 顺序
+    """
+
+    def __init__(self, root: str, max_bytes: int) -> None:
+        super().__init__(max_bytes)
+        self._root = Path(root)
+
+    def _path(self, digest: str) -> Path:
+        return self._root / digest[:2] / digest[2:4] / digest
+
+    @staticmethod
+    async def _run(func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    @override
+    async def _scan(self) -> list[tuple[str, int]]:
+        def scan() -> list[tuple[str, int]]:
+            if not self._root.exists():
+                return []
+            entries = []
+            for path in self._root.glob("??/??/*"):
+                if path.name.endswith(".tmp"):
+                    path.unlink(missing_ok=True)
+                    continue
+                stat = path.stat()
+                entries.append((stat.st_mtime, path.name, stat.st_size))
+            entries.sort()
+            return [(digest, size) for _, digest, size in entries]
+
+        return await self._run(scan)
+
+    @override
+    async def _write(self, digest: str, data: bytes) -> None:
+        def write() -> None:
+            path = self._path(digest)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # 先写临时文件再改名，读取时不会看到写了一半的图片
+            tmp = path.with_name(f"{digest}.{os.getpid()}.tmp")
+            tmp.write_bytes(data)
+            tmp.replace(path)
+
+        await self._run(write)
+
+    @override
+    async def _read_base64(self, digest: str) -> str | None:
+        def read() -> str | None:
+            path = self._path(digest)
+            try:
+                with path.open("rb") as f:
+                    if os.fstat(f.fileno()).st_size == 0:
+                        return ""
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        data = base64.b64encode(mapped).decode()
+                os.utime(path)
+            except FileNotFoundError:
+                return None
+            return data
+
+        return await self._run(read)
+
+    @override
+    async def _delete(self, digest: str) -> None:
+        await self._run(lambda: self._path(digest).unlink(missing_ok=True))
+
+
+class GridFSBlobStore(BlobStore):
+    """
+    存放在 MongoDB 的 GridFS 中，适合多个牛牛进程共用或没有本地持久化目录的部署；blob 的 _id 就是 digest
+
+    GridFS 中不记录读取时间，重启后按写入时间恢复 LRU 顺序
+    """
+
+    def __init__(self, max_bytes: int, bucket_name: str = "image_blob") -> None:
+        super().__init__(max_bytes)
+        self._bucket_name = bucket_name
+        self._bucket: AsyncIOMotorGridFSBucket | None = None
+
+    def _get_bucket(self) -> AsyncIOMotorGridFSBucket:
+        if self._bucket is None:
+            database = ImageCache.get_motor_collection().database
+            self._bucket = AsyncIOMotorGridFSBucket(database, bucket_name=self._bucket_name)
+        return self._bucket
+
+    @override
+    async def _scan(self) -> list[tuple[str, int]]:
+        files = ImageCache.get_motor_collection().database[f"{self._bucket_name}.files"]
+        cursor = files.find({}, {"length": 1}).sort("uploadDate", 1)
+        return [(doc["_id"], doc["length"]) async for doc in cursor]
+
+    @override
+    async def _write(self, digest: str, data: bytes) -> None:
+        try:
+            await self._get_bucket().upload_from_stream_with_id(digest, digest, data)
+        except DuplicateKeyError:
+            # 其他进程已经写入了相同的图片
+            pass
+
+    @override
+    async def _read_base64(self, digest: str) -> str | None:
+        try:
+            stream = await self._get_bucket().open_download_stream(digest)
+        except NoFile:
+            return None
+        return base64.b64encode(await stream.read()).decode()
+
+    @override
+    async def _delete(self, digest: str) -> None:
+        try:
+            await self._get_bucket().delete(digest)
+        except NoFile:
+            pass
+
+
+def create_blob_store(backend: Literal["disk", "gridfs"], path: str, max_bytes: int) -> BlobStore:
+    if backend == "gridfs":
+        return GridFSBlobStore(max_bytes)
+    return DiskBlobStore(path, max_bytes)
@@ -7,13 +7,17 @@ from nonebot.rule import Rule
 from ulid import ULID
 
 from src.common.config import BotConfig, GroupConfig, TaskManager
-from src.common.utils import HTTPXClient
+from src.common.utils import HostOptions, HTTPXClient
 
 from .config import Config
 
 plugin_config = get_plugin_config(Config)
 
 SERVER_URL = f"http://{plugin_config.ai_server_host}:{plugin_config.ai_server_port}"
+HTTPXClient.configure_host(
+    SERVER_URL,
+    HostOptions(http2=plugin_config.ai_server_http2, concurrency=plugin_config.ai_server_concurrency),
+)
 CHAT_COOLDOWN_KEY = "chat"
 
 
@@ -1,12 +1,13 @@
 import asyncio
 import random
 
-from nonebot import logger, on_message, require
+from nonebot import logger, on_message
 from nonebot.adapters.onebot.v11 import GroupMessageEvent, permission
 from nonebot.exception import ActionFailed
 from nonebot.rule import Rule
 
 from src.common.config import BotConfig
+from src.common.utils.maintenance import maintenance_job
 
 
 async def is_drink_msg(event: GroupMessageEvent) -> bool:
@@ -60,9 +61,6 @@ async def _(event: GroupMessageEvent):
         await drink_msg.finish("呃......咳嗯，下次不能喝、喝这么多了......")
 
 
-update_sched = require("nonebot_plugin_apscheduler").scheduler
-
-
-@update_sched.scheduled_job("cron", hour="4")
-async def update_data():
+@maintenance_job("drink.fully_sober_up")
+async def fully_sober_up(state: dict, limit: int) -> None:
     await BotConfig.fully_sober_up()
@@ -0,0 +1,32 @@
+from nonebot import get_plugin_config, require
+from nonebot.adapters import Event
+from nonebot.message import event_preprocessor
+
+from src.common.utils.maintenance import MaintenanceScheduler, SchedulerOptions
+
+from .config import Config
+
+plugin_config = get_plugin_config(Config)
+
+scheduler = MaintenanceScheduler(
+    SchedulerOptions(
+        slice_budget=plugin_config.maintenance_slice_budget,
+        busy_rate=plugin_config.maintenance_busy_rate,
+        max_delay=plugin_config.maintenance_max_delay,
+    )
+)
+
+
+@event_preprocessor
+async def record_event(event: Event):
+    # 只统计消息，心跳、生命周期等元事件不代表有人在用
+    if event.get_type() == "message":
+        scheduler.record_event()
+
+
+maintenance_sched = require("nonebot_plugin_apscheduler").scheduler
+
+
+@maintenance_sched.scheduled_job("interval", seconds=plugin_config.maintenance_tick_interval)
+async def maintenance_tick():
+    await scheduler.tick()
@@ -0,0 +1,12 @@
+from pydantic import BaseModel
+
+
+class Config(BaseModel, extra="ignore"):
+    # 多久检查一次维护任务 ( 秒 )
+    maintenance_tick_interval: int = 60
+    # 每次检查最多用多少时间跑维护任务 ( 秒 )，越忙用得越少
+    maintenance_slice_budget: float = 2.0
+    # 消息频率 ( 条 / 秒，不含心跳等元事件 ) 达到这个值就算忙，暂停维护任务
+    maintenance_busy_rate: float = 1.0
+    # 到了维护时间点之后这么久还没跑完的任务，忙的时候也继续跑 ( 秒 )
+    maintenance_max_delay: int = 12 * 3600
@@ -3,7 +3,7 @@ import random
 import re
 import time
 
-from nonebot import get_bot, get_driver, logger, on_message, on_notice, require
+from nonebot import get_bot, get_driver, get_plugin_config, logger, on_message, on_notice, require
 from nonebot.adapters import Bot
 from nonebot.adapters.onebot.v11 import GroupMessageEvent, GroupRecallNoticeEvent, Message, MessageSegment, permission
 from nonebot.exception import ActionFailed
@@ -12,25 +12,84 @@ from nonebot.rule import Rule, keyword, to_me
 from nonebot.typing import T_State
 
 from src.common.config import BotConfig
+from src.common.utils import HTTPXClient
 from src.common.utils.array2cqcode import try_convert_to_cqcode
-from src.common.utils.media_cache import get_image, insert_image
+from src.common.utils.dedup import MessageDedup, MongoClaimStore
+from src.common.utils.locks import lock_stats
+from src.common.utils.maintenance import maintenance_job
+from src.common.utils.media_cache import (
+    clear_image_cache_step,
+    close_image_ingest,
+    configure_image_ingest,
+    configure_image_store,
+    get_image,
+    image_store_stats,
+    insert_image,
+    start_image_ingest,
+)
+
+from .config import Config
+from .model import Chat, keywords_extractor
+from .sharding import router
 
-from .model import Chat
+plugin_config = get_plugin_config(Config)
+
+configure_image_store(
+    plugin_config.image_store,
+    plugin_config.image_store_path,
+    plugin_config.image_store_max_mb * 1024 * 1024,
+    plugin_config.image_memory_cache_mb * 1024 * 1024,
+)
+configure_image_ingest(
+    plugin_config.image_download_workers,
+    plugin_config.image_ingest_pending_size,
+    plugin_config.image_max_mb * 1024 * 1024,
+    plugin_config.image_ref_flush_interval,
+    plugin_config.image_download_concurrency,
+)
 
-message_id_lock = asyncio.Lock()
-message_id_dict = {}
+# 多账号登陆，且在同一群中时；避免一条消息被处理多次
+message_dedup = MessageDedup(
+    "repeater",
+    capacity=plugin_config.message_dedup_size,
+    ttl=plugin_config.message_dedup_ttl,
+    store=MongoClaimStore() if plugin_config.message_dedup_shared else None,
+)
 
 driver = get_driver()
 
 
+_background_tasks = set()
+
+
 @driver.on_startup
 async def startup():
+    # 图片在 NoneBot 进程中处理，与是否分 worker 无关
+    start_image_ingest()
+
+    if router is not None:
+        # 学习和回复都在 worker 进程中，这里只做转发
+        await router.start()
+        return
+
     await Chat.update_global_blacklist()
+    Chat.load_reply_history()
+    # 过滤器构建完成之前所有查询照常走数据库，不阻塞启动
+    task = asyncio.create_task(Chat.build_context_filter())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
 
 
 @driver.on_shutdown
 async def shutdown():
-    await Chat.sync()
+    await close_image_ingest()
+
+    if router is not None:
+        await router.close()
+        return
+
+    await Chat.close()
+    keywords_extractor.shutdown()
 
 
 async def is_shutup(self_id: int, group_id: int) -> bool:
@@ -74,7 +133,11 @@ async def post_proc(message: Message, self_id: int, group_id: int) -> Message:
         else:
             new_msg += seg
 
-    if not await Chat.reply_post_proc(str(message), str(new_msg), self_id, group_id):
+    if router is not None:
+        post_proc_ok = await router.reply_post_proc(str(message), str(new_msg), self_id, group_id)
+    else:
+        post_proc_ok = await Chat.reply_post_proc(str(message), str(new_msg), self_id, group_id)
+    if not post_proc_ok:
         logger.warning(
             f"bot [{self_id}] post_proc failed in group [{group_id}]: [{str(message)[:30]}] -> [{str(new_msg)[:30]}]"
         )
@@ -91,35 +154,28 @@ any_msg = on_message(
 
 @any_msg.handle()
 async def _(bot: Bot, event: GroupMessageEvent):
-    to_learn = True
-    # 多账号登陆，且在同一群中时；避免一条消息被处理多次
-    async with message_id_lock:
-        message_id = event.message_id
-        group_id = event.group_id
-        if group_id in message_id_dict:
-            if message_id in message_id_dict[group_id]:
-                to_learn = False
-        else:
-            message_id_dict[group_id] = []
-
-        group_message = message_id_dict[group_id]
-        group_message.append(message_id)
-        if len(group_message) > 100:
-            group_message = group_message[:-10]
+    to_learn = await message_dedup.first_seen(event.group_id, event.message_id)
 
     chat: Chat = Chat(event)
 
     answers = None
     config = BotConfig(event.self_id, event.group_id)
-    if await config.is_cooldown("repeat"):
-        answers = await chat.answer()
+    can_answer = await config.is_cooldown("repeat")
 
     if to_learn:
         for seg in event.message:
             if seg.type == "image":
-                await insert_image(seg)
-
-        await chat.learn()
+                insert_image(seg)
+
+    if router is not None:
+        answers = await router.chat(chat.chat_data, await config.drunkenness(), can_answer, to_learn)
+    else:
+        if can_answer:
+            answer_generator = await chat.answer()
+            if answer_generator:
+                answers = [item async for item in answer_generator]
+        if to_learn:
+            await chat.learn()
 
     if not answers:
         return
@@ -142,11 +198,17 @@ async def _(bot: Bot, event: GroupMessageEvent):
             shutup = await is_shutup(event.self_id, event.group_id)
             if not shutup:  # 说明这条消息失效了
                 logger.info(f"bot [{event.self_id}] ready to ban [{str(item)}] in group [{event.group_id}]")
-                await Chat.ban(event.group_id, event.self_id, str(item), "ActionFailed")
+                await ban(event.group_id, event.self_id, str(item), "ActionFailed")
                 break
         delay = random.randint(1, 3)
 
 
+async def ban(group_id: int, bot_id: int, ban_raw_message: str, reason: str) -> bool:
+    if router is not None:
+        return await router.ban(group_id, bot_id, ban_raw_message, reason)
+    return await Chat.ban(group_id, bot_id, ban_raw_message, reason)
+
+
 async def is_config_admin(event: GroupMessageEvent) -> bool:
     return await BotConfig(event.self_id).is_admin_of_bot(event.user_id)
 
@@ -184,7 +246,7 @@ async def _(bot: Bot, event: GroupMessageEvent):
     except ActionFailed:
         logger.warning(f"bot [{event.self_id}] failed to delete [{raw_message}] in group [{event.group_id}]")
 
-    if await Chat.ban(event.group_id, event.self_id, raw_message, str(event.user_id)):
+    if await ban(event.group_id, event.self_id, raw_message, str(event.user_id)):
         await ban_msg.finish("这对角可能会不小心撞倒些家具，我会尽量小心。")
 
 
@@ -229,7 +291,7 @@ async def _(bot: Bot, event: GroupRecallNoticeEvent, state: T_State):
 
     logger.info(f"bot [{event.self_id}] ready to ban [{raw_message}] in group [{event.group_id}]")
 
-    if await Chat.ban(event.group_id, event.self_id, raw_message, str(f"recall by {event.operator_id}")):
+    if await ban(event.group_id, event.self_id, raw_message, str(f"recall by {event.operator_id}")):
         await ban_recalled_msg.finish("这对角可能会不小心撞倒些家具，我会尽量小心。")
 
 
@@ -256,7 +318,7 @@ async def _(bot: Bot, event: GroupMessageEvent, state: T_State):
             f"bot [{event.self_id}] failed to delete latest reply [{event.raw_message}] in group [{event.group_id}]"
         )
 
-    if await Chat.ban(event.group_id, event.self_id, "", str(event.user_id)):
+    if await ban(event.group_id, event.self_id, "", str(event.user_id)):
         await ban_msg_latest.finish("这对角可能会不小心撞倒些家具，我会尽量小心。")
 
 
@@ -265,12 +327,12 @@ speak_sched = require("nonebot_plugin_apscheduler").scheduler
 
 @speak_sched.scheduled_job("interval", seconds=60)
 async def speak_up():
-    ret = await Chat.speak()
-    if not ret:
-        return
+    ret = await router.speak() if router is not None else await Chat.speak()
+    if ret:
+        await send_speak(*ret)
 
-    bot_id, group_id, messages, target_id = ret
 
+async def send_speak(bot_id: int, group_id: int, messages: list[Message], target_id: int | None):
     for msg in messages:
         logger.info(f"bot [{bot_id}] ready to speak [{msg}] to group [{group_id}]")
         await get_bot(str(bot_id)).call_api(
@@ -291,10 +353,46 @@ async def speak_up():
         await asyncio.sleep(random.randint(2, 5))
 
 
-update_sched = require("nonebot_plugin_apscheduler").scheduler
+flush_sched = require("nonebot_plugin_apscheduler").scheduler
+
+
+@flush_sched.scheduled_job("interval", seconds=Chat.CONTEXT_FLUSH_INTERVAL)
+async def flush_context():
+    # 多进程模式下由各个 worker 自己写回
+    if router is None:
+        await Chat.flush_context()
+
+
+async def clearup_context_step(state: dict, limit: int) -> dict | None:
+    if router is None:
+        return await Chat.clearup_context_step(state, limit)
+
+    # 多进程模式下在 router 中清理，学到的内容和缓存都在 worker 里
+    if not state:
+        await router.broadcast("clearup", False)
+    state = await Chat.clearup_context_step(state, limit)
+    if state is None:
+        await router.broadcast("clearup", True)
+    return state
 
 
-@update_sched.scheduled_job("cron", hour="4")
 async def update_data():
-    await Chat.sync()
-    await Chat.clearup_context()
+    logger.info(f"lock wait stats: {lock_stats()}")
+    logger.info(f"message dedup stats: {message_dedup.stats()}")
+    logger.info(f"http client stats: {HTTPXClient.stats()}, {HTTPXClient.cache_stats()}")
+    logger.info(f"image store stats: {image_store_stats()}")
+    if router is not None:
+        logger.info(f"repeater worker restarts: {router.restarts}")
+        await router.broadcast("stats")
+        return
+
+    # 清理掉的 Context 仍留在过滤器里，重建一次
+    await Chat.build_context_filter()
+    logger.info(f"context cache stats: {Chat.context_cache_stats()}")
+    logger.info(f"message writer stats: {Chat.message_writer_stats()}")
+
+
+# 分片执行，由 maintenance 插件在空闲时调度
+maintenance_job("repeater.clearup_context", on_finish=update_data)(clearup_context_step)
+if plugin_config.image_cache_clearup:
+    maintenance_job("media_cache.clear_image_cache")(clear_image_cache_step)
@@ -0,0 +1,110 @@
+import heapq
+import random
+from collections import Counter
+
+from .message_buffer import ChatMessage
+
+
+class GroupActivity:
+    __slots__ = ("count", "due_time", "ewma_interval", "last_time", "user_counts", "version")
+
+    def __init__(self) -> None:
+        self.count = 0  # 消息缓存中该群的消息数
+        self.last_time = 0
+        self.ewma_interval: float | None = None  # 发言间隔的指数加权平均 ( 秒 )
+        self.due_time = 0.0  # 到这个时刻还没人说话，就可以主动发言了
+        self.version = 0
+        self.user_counts: Counter[int] = Counter()  # 消息缓存中每个人的发言数
+
+    @property
+    def rate(self) -> float:
+        """
+        发言频率 ( 条 / 秒 )
+        """
+
+        if not self.ewma_interval:
+            return 0.0
+        return 1 / self.ewma_interval
+
+
+class ActivityTracker:
+    """
+    增量维护各群的活跃度，并按可以主动发言的时刻排成小根堆
+    """
+
+    def __init__(self, speak_threshold: int, basic_delay: int = 600, min_messages: int = 10, alpha: float = 0.1):
+        self._speak_threshold = speak_threshold
+        self._basic_delay = basic_delay
+        self._min_messages = min_messages
+        self._alpha = alpha
+        self._groups: dict[int, GroupActivity] = {}
+        self._heap: list[tuple[float, int, int]] = []
+
+    def __contains__(self, group_id: int) -> bool:
+        return group_id in self._groups
+
+    def get(self, group_id: int) -> GroupActivity | None:
+        return self._groups.get(group_id)
+
+    def record(self, message: ChatMessage, evicted: ChatMessage | None = None) -> None:
+        """
+        记录一条新消息，evicted 为被挤出消息缓存的旧消息
+        """
+
+        activity = self._groups.get(message.group_id)
+        if activity is None:
+            activity = self._groups[message.group_id] = GroupActivity()
+
+        if activity.count:
+            interval = max(message.time - activity.last_time, 0)
+            if activity.ewma_interval is None:
+                activity.ewma_interval = interval
+            else:
+                activity.ewma_interval += self._alpha * (interval - activity.ewma_interval)
+        activity.last_time = max(activity.last_time, message.time)
+
+        activity.count += 1
+        activity.user_counts[message.user_id] += 1
+        if evicted is not None:
+            activity.count -= 1
+            activity.user_counts[evicted.user_id] -= 1
+            if activity.user_counts[evicted.user_id] <= 0:
+                del activity.user_counts[evicted.user_id]
+
+        # 已经超过平均发言间隔 N 倍的时间没有人说话了，才主动发言
+        activity.version += 1
+        if activity.count < self._min_messages or activity.ewma_interval is None:
+            return
+        activity.due_time = activity.last_time + activity.ewma_interval * self._speak_threshold + self._basic_delay
+        heapq.heappush(self._heap, (activity.due_time, activity.version, message.group_id))
+        if len(self._heap) > 4 * len(self._groups) + 64:
+            self._compact()
+
+    def pop_due(self, cur_time: float) -> int | None:
+        """
+        弹出一个已经到了主动发言时刻的群，没有则返回 None
+
+        弹出后直到该群有新消息之前，都不会再被弹出
+        """
+
+        while self._heap and self._heap[0][0] <= cur_time:
+            _, version, group_id = heapq.heappop(self._heap)
+            if self._groups[group_id].version == version:
+                return group_id
+        return None
+
+    def _compact(self) -> None:
+        # 每条消息都会压入新的条目，旧条目要等到时刻过了才会弹出，积累太多时重建一次
+        self._heap = [entry for entry in self._heap if self._groups[entry[2]].version == entry[1]]
+        heapq.heapify(self._heap)
+
+    def sample_user(self, group_id: int) -> int | None:
+        """
+        按近期发言数加权随机选一个群友
+        """
+
+        activity = self._groups.get(group_id)
+        if activity is None or not activity.user_counts:
+            return None
+        users = list(activity.user_counts)
+        return random.choices(users, weights=[activity.user_counts[user] for user in users])[0]
@@ -0,0 +1,65 @@
+from collections import Counter, defaultdict
+
+from src.common.db import Ban
+
+
+class ContextBans:
+    """
+    单个 Context 的 ban 记录索引，在加载或新增 ban 时计算一次
+    """
+
+    __slots__ = ("by_group", "cross_group")
+
+    def __init__(self, by_group: dict[int, set[str]], cross_group: set[str]) -> None:
+        self.by_group = by_group
+        # 超过 N 个群都 ban 了的回复，全局生效
+        self.cross_group = cross_group
+
+    @staticmethod
+    def cross_group_keywords(bans: list[Ban], threshold: int) -> set[str]:
+        ban_count = Counter(ban.keywords for ban in bans)
+        return {keywords for keywords, count in ban_count.items() if count >= threshold}
+
+    @classmethod
+    def from_bans(cls, bans: list[Ban], cross_group: list[str] | None, threshold: int) -> "ContextBans":
+        by_group: dict[int, set[str]] = defaultdict(set)
+        for ban in bans:
+            by_group[ban.group_id].add(ban.keywords)
+        # 旧数据没有预先计算好的 cross_group，现算一次
+        if cross_group:
+            cross = set(cross_group)
+        else:
+            cross = cls.cross_group_keywords(bans, threshold)
+        return cls(dict(by_group), cross)
+
+    def is_banned(self, keywords: str, group_id: int, global_flag: int) -> bool:
+        if keywords in self.cross_group:
+            return True
+        for ban_group_id in (group_id, global_flag):
+            group_bans = self.by_group.get(ban_group_id)
+            if group_bans and keywords in group_bans:
+                return True
+        return False
+
+
+class BanView:
+    """
+    分层的黑名单视图：全局 -> 群 -> Context，逐层判断，不合并集合
+    """
+
+    __slots__ = ("_context_bans", "_global_flag", "_group_id", "_layers")
+
+    def __init__(
+        self, layers: tuple[set[str], ...], group_id: int, global_flag: int, context_bans: ContextBans | None = None
+    ) -> None:
+        self._layers = layers
+        self._group_id = group_id
+        self._global_flag = global_flag
+        self._context_bans = context_bans
+
+    def __contains__(self, keywords: str) -> bool:
+        if any(keywords in layer for layer in self._layers):
+            return True
+        return self._context_bans is not None and self._context_bans.is_banned(
+            keywords, self._group_id, self._global_flag
+        )
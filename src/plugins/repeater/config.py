@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic import BaseModel
 
 
@@ -10,6 +12,8 @@ class Config(BaseModel, extra="ignore"):
     topics_size: int = 16
     # 上下文命中后，额外的权重系数
     topics_importance: int = 10000
+    # 上下文关键词的权重半衰期 ( 秒 )，越早出现的关键词权重越低；0 为不衰减，只按出现次数
+    topics_half_life: int = 0
     # N 个群有相同的回复，就跨群作为全局回复
     cross_group_threshold: int = 2
     # 复读的阈值，群里连续多少次有相同的发言，就复读
@@ -32,5 +36,68 @@ class Config(BaseModel, extra="ignore"):
     save_time_threshold: int = 3600
     # 单个群超过多少条聊天记录就进行一次持久化，与时间是或的关系
     save_count_threshold: int = 1000
-    # 保存时，给内存中保留的大小
+    # 内存中每个群保留最近多少条聊天记录，用于主动发言、统计活跃度等
     save_reserved_size: int = 100
+    # 聊天记录持久化队列最多积压多少条，超过后新的聊天记录不再保存
+    message_queue_size: int = 10000
+    # 内存中缓存多少个热点 Context
+    context_cache_size: int = 10000
+    # 缓存的 Context 多久之后重新从数据库加载 ( 秒 )，0 为不过期
+    # 分多个 worker 或多个牛牛进程共用数据库时，其他进程学到的内容最迟这么久之后可见
+    context_cache_ttl: int = 300
+    # 每隔多久将缓存中学到的内容批量写回数据库 ( 秒 )
+    context_flush_interval: int = 10
+    # answer 的存储方式：embedded 内嵌在 context 文档中；split 存到单独的 context_answer 集合
+    answer_storage: Literal["embedded", "split"] = "embedded"
+    # 每个 answer 最多保留多少条不同的消息 ( 相同的消息只记录次数 )，超过后随机保留；0 为不限
+    answer_samples_limit: int = 50
+    # Context、群消息、黑名单的存储后端：mongo 或嵌入式的 sqlite；sqlite 不需要单独部署数据库，answer 总是单独存放
+    repeater_storage: Literal["mongo", "sqlite"] = "mongo"
+    # sqlite 数据库文件的路径
+    repeater_sqlite_path: str = "data/repeater.db"
+    # 布隆过滤器预计容纳多少个 Context，用于跳过不存在的 Context 的查询
+    context_filter_capacity: int = 10000000
+    # 布隆过滤器的误判率
+    context_filter_error_rate: float = 0.01
+    # 关键词提取使用的线程数 / 进程数
+    keywords_workers: int = 1
+    # 关键词提取在线程池 ( thread ) 还是进程池 ( process ) 中执行，进程池能利用多核，但每个进程都会加载一份词典
+    keywords_executor: Literal["thread", "process"] = "thread"
+    # 缓存多少条消息的关键词
+    keywords_cache_size: int = 10000
+    # 关键词提取攒批的等待时间 ( 秒 )
+    keywords_batch_delay: float = 0.005
+    # 每个 bot 在每个群记录多少条自己的回复，用于后处理及 ban
+    reply_history_size: int = 100
+    # 回复记录的快照文件，留空则不保存；保存后重启也能 ban 掉重启前的回复
+    reply_history_snapshot: str = ""
+    # 学习和回复放到多少个 worker 进程中执行，按群分配；0 为在 NoneBot 进程中执行
+    shard_workers: int = 0
+    # 与 worker 进程通信的 unix socket 所在目录
+    shard_socket_dir: str = "data/repeater"
+    # 多账号在同一个群时用于去重，每个群记录最近多少条消息
+    message_dedup_size: int = 1024
+    # 去重记录保留多久 ( 秒 )
+    message_dedup_ttl: int = 600
+    # 多个牛牛进程 ( 不同账号分别部署 ) 在同一个群时，通过 MongoDB 共享去重记录
+    message_dedup_shared: bool = False
+    # 每个图片服务器同时下载多少张图片，0 为不限
+    image_download_concurrency: int = 4
+    # 图片的存储方式：disk 按内容哈希存放在本地目录；gridfs 存放在 MongoDB 中
+    image_store: Literal["disk", "gridfs"] = "disk"
+    # disk 方式的图片目录
+    image_store_path: str = "data/images"
+    # 图片最多占用多少空间 ( MB )，超过后淘汰最久没有用到的图片
+    image_store_max_mb: int = 1024
+    # 内存中缓存多少 MB 发送过的图片，常用的表情包不用每次都读取
+    image_memory_cache_mb: int = 64
+    # 后台下载图片的任务数
+    image_download_workers: int = 2
+    # 最多有多少种图片的出现次数等待写回，超过后新出现的图片暂不计数
+    image_ingest_pending_size: int = 10000
+    # 单张图片的大小上限 ( MB )，超过的不缓存
+    image_max_mb: int = 10
+    # 每隔多久把图片的出现次数批量写回数据库 ( 秒 )
+    image_ref_flush_interval: int = 10
+    # 每天空闲时删除 5 天前、或出现不到 3 次的图片记录，删除后这些图片无法再被发送
+    image_cache_clearup: bool = False
@@ -0,0 +1,313 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from nonebot import logger
+
+from src.common.db import Answer, Ban, Context, Sample, merge_samples
+
+from .ban_index import ContextBans
+from .bloom_filter import BloomFilter
+from .message_buffer import ChatMessage
+from .storage import AnswerDelta, ContextDelta, RepeaterStorage
+
+
+@dataclass(frozen=True)
+class ContextCacheOptions:
+    capacity: int = 10000  # 缓存多少个 Context
+    # 缓存的 Context 多久之后重新从存储后端加载 ( 秒 )，0 为不过期；
+    # 多个 worker 或多个进程共用数据库时，其他进程学到的内容最迟这么久之后可见
+    ttl: float = 0
+    filter_capacity: int = 10_000_000
+    filter_error_rate: float = 0.01
+    cross_group_threshold: int = 2
+
+
+class ContextCache:
+    """
+    热点 Context 的读缓存 + 学习内容的写回缓冲
+
+    学习时不读取文档，只在内存中累积增量，由定时任务合并成原子的累加操作批量写回存储后端；
+    每批增量带一个 flush_id，写回失败时整批原样保留，下次用同一个 flush_id 重新写入，不会重复累加
+
+    存储后端拆分存储 answer 时，缓存的 Context 只包含 ban 等信息
+
+    另外用布隆过滤器记录所有 Context 的 keywords，确定不存在的直接返回，不再查库
+
+    缓存的 Context 同时缓存其 ban 记录的索引，只在加载和新增 ban 时计算
+
+    缓存只包含本进程学到的内容，加载超过 ttl 秒的 Context 会重新加载，叠加上本进程还没写回的增量
+    """
+
+    def __init__(self, storage: RepeaterStorage, options: ContextCacheOptions) -> None:
+        self._capacity = options.capacity
+        self._ttl = options.ttl
+        self._storage = storage
+        self._split = storage.split_answers
+        self._cross_group_threshold = options.cross_group_threshold
+        self._contexts: OrderedDict[str, Context] = OrderedDict()
+        self._loaded_at: dict[str, float] = {}
+        self._bans: dict[str, ContextBans] = {}
+        self._pending: dict[str, ContextDelta] = {}
+        # 正在写回或者写回失败、等待重试的一批：( flush_id, 增量 )
+        self._flushing: tuple[str, dict[str, ContextDelta]] | None = None
+        self._loading: dict[str, asyncio.Task] = {}
+        self._flush_lock = asyncio.Lock()
+
+        self._filter_capacity = options.filter_capacity
+        self._filter_error_rate = options.filter_error_rate
+        self._filter: BloomFilter | None = None  # 还没构建完成时为 None，所有查询都走数据库
+        self._building_filter: BloomFilter | None = None
+        self._filter_lock = asyncio.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.flushed = 0
+        self.filter_negatives = 0  # 被过滤器拦下、没有查库的次数
+        self.filter_positives = 0  # 过滤器放行、查了库的次数
+        self.filter_false_positives = 0  # 过滤器放行，但库里其实没有的次数
+
+    def __len__(self) -> int:
+        return len(self._contexts)
+
+    async def get(self, keywords: str) -> Context | None:
+        """
+        获取 Context，不在缓存中时从存储后端加载，并叠加上尚未写回的学习内容
+        """
+
+        context = self._contexts.get(keywords)
+        if context is not None and self._ttl and time.monotonic() - self._loaded_at[keywords] > self._ttl:
+            # 其他进程可能写入了新的内容，丢掉重新加载
+            self._pop(keywords)
+            self.expired += 1
+            context = None
+        if context is not None:
+            self._contexts.move_to_end(keywords)
+            self.hits += 1
+            return context
+
+        if not self._unflushed(keywords) and self._filter is not None:
+            if keywords not in self._filter:
+                self.filter_negatives += 1
+                return None
+            self.filter_positives += 1
+
+        self.misses += 1
+        # 同一个 keywords 并发加载时只查一次库
+        task = self._loading.get(keywords)
+        if task is None:
+            task = asyncio.ensure_future(self._storage.find_context(keywords))
+            self._loading[keywords] = task
+            task.add_done_callback(lambda _: self._loading.pop(keywords, None))
+
+        context = await asyncio.shield(task)
+        cached = self._contexts.get(keywords)
+        if cached is not None:
+            return cached
+
+        deltas = self._unflushed(keywords)
+        if context is None:
+            if not deltas:
+                if self._filter is not None:
+                    self.filter_false_positives += 1
+                return None
+            context = Context(keywords=keywords, trigger_count=0)
+        for delta in deltas:
+            self._apply(context, delta)
+        self._put(context)
+        return context
+
+    async def answers(self, context: Context, count_threshold: int) -> list[Answer]:
+        """
+        获取 Context 的 answer，拆分存储时只从存储后端取 count 达到阈值的
+        """
+
+        if not self._split:
+            return context.answers
+
+        answers = await self._storage.find_answers(context.keywords, count_threshold)
+        for delta in self._unflushed(context.keywords):
+            self._apply_answers(answers, delta)
+        return answers
+
+    def bans(self, context: Context) -> ContextBans | None:
+        """
+        获取 Context 的 ban 记录索引，没有 ban 记录时返回 None
+        """
+
+        if not context.ban:
+            return None
+        bans = self._bans.get(context.keywords)
+        if bans is not None:
+            return bans
+        bans = ContextBans.from_bans(context.ban, context.cross_group_ban, self._cross_group_threshold)
+        if self._contexts.get(context.keywords) is context:
+            self._bans[context.keywords] = bans
+        return bans
+
+    def learn(self, pre_keywords: str, message: ChatMessage) -> None:
+        """
+        记录一次学习：在 pre_keywords 之后有人说了 message，不访问数据库
+        """
+
+        for bloom_filter in (self._filter, self._building_filter):
+            if bloom_filter is not None:
+                bloom_filter.add(pre_keywords)
+
+        delta = ContextDelta(count=1, time=message.time)
+        answer_delta = AnswerDelta(count=1, time=message.time)
+        if message.is_plain_text:
+            answer_delta.messages[message.raw_message] += 1
+        else:
+            answer_delta.sample = message.raw_message
+        delta.answers[message.group_id, message.keywords] = answer_delta
+
+        context = self._contexts.get(pre_keywords)
+        if context is not None:
+            self._apply(context, delta)
+
+        pending = self._pending.get(pre_keywords)
+        if pending is None:
+            self._pending[pre_keywords] = delta
+        else:
+            pending.merge(delta)
+
+    async def ban(self, keywords: str, ban: Ban) -> None:
+        """
+        原子地追加一条 ban 记录，并重新计算跨群 ban 的汇总
+        """
+
+        # 先写回，保证刚学到、还没落库的 Context 也能被 ban
+        await self.flush()
+        cross_group_ban = await self._storage.push_ban(keywords, ban, self._cross_group_threshold)
+        if cross_group_ban is None:
+            return
+
+        context = self._contexts.get(keywords)
+        if context is not None:
+            context.ban.append(ban)
+            context.cross_group_ban = cross_group_ban
+        self._bans.pop(keywords, None)
+
+    async def build_filter(self) -> None:
+        """
+        从存储后端流式读取所有 Context 的 keywords，重新构建布隆过滤器
+        """
+
+        async with self._filter_lock:
+            count = await self._storage.count_contexts()
+            # 预留增长空间，避免容量不够导致误判率上升
+            bloom_filter = BloomFilter(max(self._filter_capacity, count * 2), self._filter_error_rate)
+            self._building_filter = bloom_filter
+            try:
+                async for keywords in self._storage.iter_context_keywords():
+                    bloom_filter.add(keywords)
+            except Exception as e:
+                logger.error(f"build context filter failed: {e}")
+                return
+            finally:
+                self._building_filter = None
+
+            self._filter = bloom_filter
+            logger.info(f"context filter built, {bloom_filter.count} keywords, {bloom_filter.size // 8} bytes")
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "cached": len(self._contexts),
+            "pending": len(self._pending),
+            "retrying": len(self._flushing[1]) if self._flushing is not None else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "flushed": self.flushed,
+            "filter_negatives": self.filter_negatives,
+            "filter_positives": self.filter_positives,
+            "filter_false_positives": self.filter_false_positives,
+        }
+
+    def clear(self) -> None:
+        """
+        丢弃缓存中的文档，未写回的学习内容不受影响
+        """
+
+        self._contexts.clear()
+        self._loaded_at.clear()
+        self._bans.clear()
+
+    async def flush(self) -> int:
+        """
+        将累积的学习内容写回存储后端，返回写回的 Context 数量
+
+        上一批写回失败时先用原来的 flush_id 重试那一批，成功后再写新学到的内容
+        """
+
+        flushed = 0
+        async with self._flush_lock:
+            while True:
+                if self._flushing is None:
+                    if not self._pending:
+                        return flushed
+                    self._flushing = (uuid.uuid4().hex, self._pending)
+                    self._pending = {}
+
+                flush_id, pending = self._flushing
+                try:
+                    await self._storage.apply_deltas(pending, flush_id)
+                except Exception as e:
+                    logger.error(f"flush context cache failed, retry the same batch later: {e}")
+                    return flushed
+                self._flushing = None
+                flushed += len(pending)
+                self.flushed += len(pending)
+
+    def _unflushed(self, keywords: str) -> list[ContextDelta]:
+        """
+        还没有写回成功的增量，从存储后端加载的文档需要叠加上
+        """
+
+        batches = [self._pending]
+        if self._flushing is not None:
+            batches.append(self._flushing[1])
+        return [batch[keywords] for batch in batches if keywords in batch]
+
+    def _apply_answers(self, answers: list[Answer], delta: ContextDelta) -> None:
+        for (group_id, keywords), answer_delta in delta.answers.items():
+            answer = next(
+                (answer for answer in answers if answer.group_id == group_id and answer.keywords == keywords),
+                None,
+            )
+            if answer is None:
+                answer = Answer(
+                    keywords=keywords,
+                    group_id=group_id,
+                    count=0,
+                    time=answer_delta.time,
+                    samples=[Sample(message=answer_delta.sample)] if answer_delta.sample is not None else [],
+                )
+                answers.append(answer)
+            answer.count += answer_delta.count
+            answer.time = max(answer.time, answer_delta.time)
+            merge_samples(answer.samples, answer_delta.messages, self._storage.samples_limit)
+
+    def _apply(self, context: Context, delta: ContextDelta) -> None:
+        context.trigger_count += delta.count
+        context.time = max(context.time, delta.time)
+        if not self._split:
+            self._apply_answers(context.answers, delta)
+
+    def _put(self, context: Context) -> None:
+        keywords = context.keywords
+        self._contexts[keywords] = context
+        self._contexts.move_to_end(keywords)
+        self._loaded_at[keywords] = time.monotonic()
+        self._bans.pop(keywords, None)
+        while len(self._contexts) > self._capacity:
+            self._pop(next(iter(self._contexts)))
+
+    def _pop(self, keywords: str) -> None:
+        self._contexts.pop(keywords, None)
+        self._loaded_at.pop(keywords, None)
+        self._bans.pop(keywords, None)
@@ -0,0 +1,146 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+
+from nonebot import logger
+
+try:
+    import jieba_fast.analyse as jieba_analyse
+
+    logger.info("Using jieba_fast for repeater")
+except ImportError:
+    import jieba.analyse as jieba_analyse
+
+    logger.info("Using jieba for repeater")
+
+
+def extract_tags(text: str, top_k: int) -> list[str]:
+    return jieba_analyse.extract_tags(text, topK=top_k)
+
+
+def extract_tags_batch(texts: list[str], top_k: int) -> list[list[str]]:
+    # 进程池中执行时需要能被 pickle，所以是模块级函数
+    return [extract_tags(text, top_k) for text in texts]
+
+
+@dataclass(frozen=True)
+class KeywordsExtractorOptions:
+    workers: int = 1
+    use_process: bool = False  # 在进程池而不是线程池中提取
+    cache_size: int = 10000
+    batch_delay: float = 0.005  # 等待多久把同时到达的消息合并成一批 ( 秒 )
+    batch_size: int = 64
+
+
+class KeywordsExtractor:
+    """
+    在线程池 / 进程池中提取关键词，不阻塞事件循环
+
+    同一时间段内到达的消息会合并成一批提交，结果按 plain_text 做 LRU 缓存
+    """
+
+    def __init__(self, top_k: int, options: KeywordsExtractorOptions) -> None:
+        self._top_k = top_k
+        self._workers = options.workers
+        self._use_process = options.use_process
+        self._cache_size = options.cache_size
+        self._batch_delay = options.batch_delay
+        self._batch_size = options.batch_size
+
+        self._executor: Executor | None = None
+        self._cache: OrderedDict[str, list[str]] = OrderedDict()
+        self._batch: dict[str, asyncio.Future] = {}
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._timer: asyncio.TimerHandle | None = None
+
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+
+    def get_cached(self, text: str) -> list[str] | None:
+        keywords = self._cache.get(text)
+        if keywords is not None:
+            self._cache.move_to_end(text)
+        return keywords
+
+    def extract_sync(self, text: str) -> list[str]:
+        """
+        同步提取，仅用于没有预先调用 extract 的场景
+        """
+
+        keywords = self.get_cached(text)
+        if keywords is None:
+            keywords = extract_tags(text, self._top_k)
+            self._put(text, keywords)
+        return keywords
+
+    async def extract(self, text: str) -> list[str]:
+        keywords = self.get_cached(text)
+        if keywords is not None:
+            self.hits += 1
+            return keywords
+
+        self.misses += 1
+        future = self._inflight.get(text)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._inflight[text] = future
+            self._batch[text] = future
+            if len(self._batch) >= self._batch_size:
+                self._submit()
+            elif self._timer is None:
+                self._timer = loop.call_later(self._batch_delay, self._submit)
+
+        return await asyncio.shield(future)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self._use_process:
+                self._executor = ProcessPoolExecutor(max_workers=self._workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="keywords")
+        return self._executor
+
+    def _submit(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._batch:
+            return
+
+        batch = self._batch
+        self._batch = {}
+        self.batches += 1
+        texts = list(batch)
+        loop = asyncio.get_running_loop()
+        result = loop.run_in_executor(self._get_executor(), extract_tags_batch, texts, self._top_k)
+
+        def on_done(result: asyncio.Future) -> None:
+            for text in texts:
+                self._inflight.pop(text, None)
+            if result.cancelled() or result.exception() is not None:
+                exception = result.exception() if not result.cancelled() else asyncio.CancelledError()
+                for future in batch.values():
+                    if not future.done():
+                        future.set_exception(exception)
+                return
+            for text, keywords in zip(texts, result.result(), strict=True):
+                self._put(text, keywords)
+                future = batch[text]
+                if not future.done():
+                    future.set_result(keywords)
+
+        result.add_done_callback(on_done)
+
+    def _put(self, text: str, keywords: list[str]) -> None:
+        self._cache[text] = keywords
+        self._cache.move_to_end(text)
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
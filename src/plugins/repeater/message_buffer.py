@@ -0,0 +1,92 @@
+from collections.abc import Iterator, Sequence
+from dataclasses import dataclass
+
+from beanie import PydanticObjectId
+
+from src.common.db import Message as MessageModel
+
+
+@dataclass(slots=True, eq=False)
+class ChatMessage:
+    """
+    内存中缓存的群消息，只在持久化时才转换为 MessageModel
+    """
+
+    group_id: int
+    user_id: int
+    bot_id: int
+    raw_message: str
+    is_plain_text: bool
+    plain_text: str
+    keywords: str
+    time: int
+
+    def to_model(self) -> MessageModel:
+        return MessageModel(
+            id=PydanticObjectId(),
+            group_id=self.group_id,
+            user_id=self.user_id,
+            bot_id=self.bot_id,
+            raw_message=self.raw_message,
+            is_plain_text=self.is_plain_text,
+            plain_text=self.plain_text,
+            keywords=self.keywords,
+            time=self.time,
+        )
+
+
+class MessageRing(Sequence[ChatMessage]):
+    """
+    定长环形缓冲区，下标 0 为最早的消息，-1 为最新的消息
+    """
+
+    __slots__ = ("_capacity", "_items", "_size", "_start")
+
+    def __init__(self, capacity: int) -> None:
+        self._capacity = max(capacity, 1)
+        self._items: list[ChatMessage | None] = [None] * self._capacity
+        self._start = 0
+        self._size = 0
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, index: int) -> ChatMessage:
+        if isinstance(index, slice):
+            raise TypeError("MessageRing does not support slicing, use tail() instead")
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("MessageRing index out of range")
+        return self._items[(self._start + index) % self._capacity]
+
+    def __iter__(self) -> Iterator[ChatMessage]:
+        for i in range(self._size):
+            yield self._items[(self._start + i) % self._capacity]
+
+    def append(self, message: ChatMessage) -> ChatMessage | None:
+        """
+        追加一条消息，缓冲区满时返回被挤出的最早的消息
+        """
+
+        evicted = None
+        if self._size < self._capacity:
+            self._items[(self._start + self._size) % self._capacity] = message
+            self._size += 1
+        else:
+            evicted = self._items[self._start]
+            self._items[self._start] = message
+            self._start = (self._start + 1) % self._capacity
+        return evicted
+
+    def tail(self, n: int) -> list[ChatMessage]:
+        """
+        最新的 n 条消息，按时间先后排列
+        """
+
+        n = min(max(n, 0), self._size)
+        return [self[i] for i in range(self._size - n, self._size)]
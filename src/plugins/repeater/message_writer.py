@@ -0,0 +1,157 @@
+import asyncio
+import contextlib
+
+from nonebot import logger
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_exponential
+
+from .message_buffer import ChatMessage
+from .storage import RepeaterStorage
+
+
+class MessageWriter:
+    """
+    群消息的后台持久化队列
+
+    消息处理时只入队，由后台任务攒批后批量写入存储后端，写入失败时重试，关闭时写完队列中剩余的消息
+    """
+
+    def __init__(
+        self,
+        storage: RepeaterStorage,
+        queue_size: int,
+        batch_size: int,
+        flush_interval: float,
+        retry_attempts: int = 3,
+    ) -> None:
+        self._storage = storage
+        self._queue_size = queue_size
+        self._batch_size = max(batch_size, 1)
+        self._flush_interval = flush_interval
+        self._retrying = AsyncRetrying(
+            stop=stop_after_attempt(retry_attempts),
+            wait=wait_exponential(multiplier=1, min=1, max=10),
+            retry=retry_if_exception_type(storage.transient_errors),
+            reraise=True,
+        )
+
+        self._queue: asyncio.Queue[ChatMessage] | None = None
+        self._task: asyncio.Task | None = None
+        self._batch: list[ChatMessage] = []
+        self._writing: asyncio.Future | None = None
+
+        self.high_water = 0  # 队列积压的最大长度
+        self.dropped = 0  # 队列满时丢弃的消息数
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+
+    def put(self, message: ChatMessage) -> bool:
+        """
+        消息入队，不等待写库；队列满时丢弃并返回 False
+        """
+
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(f"message writer queue is full, {self.dropped} messages dropped so far")
+            return False
+
+        self.high_water = max(self.high_water, self._queue.qsize())
+        return True
+
+    async def flush(self) -> None:
+        """
+        立即写入后台任务正在攒的一批和队列中当前所有的消息，并等待正在进行的写入完成
+        """
+
+        if self._queue is None:
+            return
+        if self._writing is not None and not self._writing.done():
+            await asyncio.shield(self._writing)
+
+        # 后台任务之后会从空的一批重新开始攒
+        batch = self._batch
+        self._batch = []
+        if batch:
+            await self._write(batch)
+        while not self._queue.empty():
+            batch = self._take(self._batch_size)
+            await self._write(batch)
+
+    async def close(self) -> None:
+        """
+        停止后台任务，并写完剩余的消息
+        """
+
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "high_water": self.high_water,
+            "dropped": self.dropped,
+            "written": self.written,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
+
+    def _ensure_started(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self._queue_size)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def _take(self, limit: int) -> list[ChatMessage]:
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            # 放在成员变量里，被取消时 close()、flush() 还能拿到已经出队的消息；
+            # 先等到消息再取 self._batch，等待期间它可能被 flush() 换掉
+            message = await self._queue.get()
+            self._batch.append(message)
+            deadline = loop.time() + self._flush_interval
+            while len(self._batch) < self._batch_size:
+                self._batch += self._take(self._batch_size - len(self._batch))
+                timeout = deadline - loop.time()
+                if len(self._batch) >= self._batch_size or timeout <= 0:
+                    break
+                try:
+                    message = await asyncio.wait_for(self._queue.get(), timeout)
+                except TimeoutError:
+                    break
+                self._batch.append(message)
+
+            batch = self._batch
+            self._batch = []
+            self._writing = asyncio.ensure_future(self._write(batch))
+            await asyncio.shield(self._writing)
+
+    async def _write(self, batch: list[ChatMessage]) -> None:
+        documents = self._storage.prepare_messages(batch)
+        try:
+            async for attempt in self._retrying.copy():
+                with attempt:
+                    await self._storage.insert_messages(documents)
+        except Exception as e:
+            self.failed += len(documents)
+            logger.error(f"failed to save {len(documents)} messages: {e}")
+            return
+
+        self.written += len(documents)
+        self.batches += 1
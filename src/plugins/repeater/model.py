@@ -1,33 +1,29 @@
-import asyncio
 import random
 import re
 import time
 from collections import defaultdict, deque
 from collections.abc import AsyncGenerator
 from dataclasses import dataclass
-from functools import cached_property, cmp_to_key
+from functools import cached_property
 
 import pypinyin
-from beanie.operators import Or
-from nonebot import get_plugin_config
+from nonebot import get_plugin_config, logger
 from nonebot.adapters.onebot.v11 import GroupMessageEvent, Message
 
 from src.common.config import BotConfig
 from src.common.db import Answer, Ban, Context
-from src.common.db import Message as MessageModel
-from src.common.db.modules import BlackList
+from src.common.utils.locks import StripedLock
 
+from .activity import ActivityTracker
+from .ban_index import BanView
 from .config import Config
-
-try:
-    import jieba_fast.analyse as jieba_analyse
-
-    print("Using jieba_fast for repeater")
-except ImportError:
-    import jieba.analyse as jieba_analyse
-
-    print("Using jieba for repeater")
-
+from .context_cache import ContextCache, ContextCacheOptions
+from .keywords import KeywordsExtractor, KeywordsExtractorOptions
+from .message_buffer import ChatMessage, MessageRing
+from .message_writer import MessageWriter
+from .reply_history import ReplyHistory, ReplyRecord, load_snapshot, save_snapshot
+from .storage import create_storage
+from .topics import TopicWindow
 
 plugin_config = get_plugin_config(Config)
 
@@ -56,7 +52,19 @@ class ChatData:
         if not self.is_plain_text and len(self.plain_text) == 0:
             return []
 
-        return jieba_analyse.extract_tags(self.plain_text, topK=ChatData._keywords_size)
+        return keywords_extractor.extract_sync(self.plain_text)
+
+    async def prepare(self) -> None:
+        """
+        在工作线程 / 进程中提前提取关键词，之后访问 keywords 等属性不会阻塞事件循环
+        """
+
+        if "_keywords_list" in self.__dict__:
+            return
+        if not self.is_plain_text and len(self.plain_text) == 0:
+            self._keywords_list = []
+            return
+        self._keywords_list = await keywords_extractor.extract(self.plain_text)
 
     @cached_property
     def keywords_len(self) -> int:
@@ -75,15 +83,26 @@ class ChatData:
 
     @cached_property
     def keywords_pinyin(self) -> str:
-        return "".join(
-            [item[0] for item in pypinyin.pinyin(self.keywords, style=pypinyin.NORMAL, errors="default")]
-        ).lower()
+        return "".join([
+            item[0] for item in pypinyin.pinyin(self.keywords, style=pypinyin.NORMAL, errors="default")
+        ]).lower()
 
     @cached_property
     def to_me(self) -> bool:
         return self.plain_text.startswith("牛牛")
 
 
+keywords_extractor = KeywordsExtractor(
+    ChatData._keywords_size,
+    KeywordsExtractorOptions(
+        workers=plugin_config.keywords_workers,
+        use_process=plugin_config.keywords_executor == "process",
+        cache_size=plugin_config.keywords_cache_size,
+        batch_delay=plugin_config.keywords_batch_delay,
+    ),
+)
+
+
 class Chat:
     # 可以试着改改的参数
 
@@ -91,6 +110,7 @@ class Chat:
     ANSWER_THRESHOLD_WEIGHTS = plugin_config.answer_threshold_weights
     TOPICS_SIZE = plugin_config.topics_size
     TOPICS_IMPORTANCE = plugin_config.topics_importance
+    TOPICS_HALF_LIFE = plugin_config.topics_half_life
     CROSS_GROUP_THRESHOLD = plugin_config.cross_group_threshold
     REPEAT_THRESHOLD = plugin_config.repeat_threshold
     SPEAK_THRESHOLD = plugin_config.speak_threshold
@@ -105,6 +125,19 @@ class Chat:
     SAVE_TIME_THRESHOLD = plugin_config.save_time_threshold
     SAVE_COUNT_THRESHOLD = plugin_config.save_count_threshold
     SAVE_RESERVED_SIZE = plugin_config.save_reserved_size
+    MESSAGE_QUEUE_SIZE = plugin_config.message_queue_size
+    REPLY_HISTORY_SIZE = plugin_config.reply_history_size
+    REPLY_HISTORY_SNAPSHOT = plugin_config.reply_history_snapshot
+
+    CONTEXT_CACHE_SIZE = plugin_config.context_cache_size
+    CONTEXT_CACHE_TTL = plugin_config.context_cache_ttl
+    CONTEXT_FLUSH_INTERVAL = plugin_config.context_flush_interval
+    SPLIT_ANSWERS = plugin_config.answer_storage == "split"
+    STORAGE_BACKEND = plugin_config.repeater_storage
+    SQLITE_PATH = plugin_config.repeater_sqlite_path
+    ANSWER_SAMPLES_LIMIT = plugin_config.answer_samples_limit
+    CONTEXT_FILTER_CAPACITY = plugin_config.context_filter_capacity
+    CONTEXT_FILTER_ERROR_RATE = plugin_config.context_filter_error_rate
 
     # 最好别动的参数
 
@@ -117,21 +150,44 @@ class Chat:
 
     # 运行期变量
 
-    _reply_dict = defaultdict(lambda: defaultdict(list))  # 牛牛回复的消息缓存，暂未做持久化
-    _message_dict: dict[int, list[MessageModel]] = defaultdict(list)  # 群消息缓存
+    _reply_dict: dict[int, dict[int, ReplyHistory]] = defaultdict(
+        lambda: defaultdict(lambda: ReplyHistory(Chat.REPLY_HISTORY_SIZE))
+    )  # 牛牛回复的消息缓存
+    _message_dict: dict[int, MessageRing] = defaultdict(lambda: MessageRing(Chat.SAVE_RESERVED_SIZE))  # 群消息缓存
 
-    _reply_lock = asyncio.Lock()  # 回复消息缓存锁
-    _message_lock = asyncio.Lock()
-    _topics_lock = asyncio.Lock()
+    # 按群分段加锁，一个群处理得慢不会拖慢其他群
+    _reply_locks = StripedLock("repeater.reply")  # 回复消息缓存锁
+    _message_locks = StripedLock("repeater.message")
+    _activity = ActivityTracker(SPEAK_THRESHOLD)  # 各群活跃度
+    _topics_locks = StripedLock("repeater.topics")
 
-    _late_save_time = 0  # 上次保存（消息数据持久化）的时刻 ( time.time(), 秒 )
+    _storage = create_storage(
+        STORAGE_BACKEND, SPLIT_ANSWERS, SQLITE_PATH, ANSWER_SAMPLES_LIMIT
+    )  # Context、群消息、黑名单的存储后端
+
+    _message_writer = MessageWriter(
+        _storage, queue_size=MESSAGE_QUEUE_SIZE, batch_size=SAVE_COUNT_THRESHOLD, flush_interval=SAVE_TIME_THRESHOLD
+    )  # 群消息后台持久化队列
 
     _blacklist_answer = defaultdict(set)
     _blacklist_answer_reserve = defaultdict(set)
 
-    _recent_topics = defaultdict(lambda: deque(maxlen=Chat.TOPICS_SIZE))
+    _recent_topics: dict[int, TopicWindow] = defaultdict(
+        lambda: TopicWindow(Chat.TOPICS_SIZE, Chat.TOPICS_HALF_LIFE)
+    )  # 各群最近的话题关键词
     _recent_speak = defaultdict(lambda: deque(maxlen=Chat.DUPLICATE_REPLY))  # 主动发言记录，避免重复内容
 
+    _context_cache = ContextCache(
+        _storage,
+        ContextCacheOptions(
+            capacity=CONTEXT_CACHE_SIZE,
+            ttl=CONTEXT_CACHE_TTL,
+            filter_capacity=CONTEXT_FILTER_CAPACITY,
+            filter_error_rate=CONTEXT_FILTER_ERROR_RATE,
+            cross_group_threshold=CROSS_GROUP_THRESHOLD,
+        ),
+    )  # 热点 Context 写回缓存
+
     ###
 
     def __init__(self, data: ChatData | GroupMessageEvent):
@@ -158,6 +214,9 @@ class Chat:
         if len(self.chat_data.raw_message.strip()) == 0:
             return False
 
+        await self.chat_data.prepare()
+
+        message = self._chat_message()
         group_id = self.chat_data.group_id
         if group_id in Chat._message_dict:
             group_msgs = Chat._message_dict[group_id]
@@ -167,17 +226,17 @@ class Chat:
                 group_pre_msg = None
 
             # 群里的上一条发言
-            await self._context_insert(group_pre_msg)
+            await self._context_insert(group_pre_msg, message)
 
             user_id = self.chat_data.user_id
             if group_pre_msg and group_pre_msg.user_id != user_id:
                 # 该用户在群里的上一条发言（倒序三句之内）
-                for msg in group_msgs[:-3:-1]:
+                for msg in reversed(group_msgs.tail(2)):
                     if msg.user_id == user_id:
-                        await self._context_insert(msg)
+                        await self._context_insert(msg, message)
                         break
 
-        await self._message_insert()
+        await self._message_insert(message)
         return True
 
     async def answer(self) -> AsyncGenerator[Message, None, None] | None:
@@ -188,6 +247,8 @@ class Chat:
         if self.chat_data.is_plain_text and len(self.chat_data.plain_text) < 2:
             return None
 
+        await self.chat_data.prepare()
+
         # # 不要一直回复同一个内容
         # if self.chat_data.raw_message == latest_reply['pre_raw_message']:
         #     return None
@@ -205,47 +266,44 @@ class Chat:
 
         raw_message = self.chat_data.raw_message
         keywords = self.chat_data.keywords
-        async with Chat._reply_lock:
+        async with Chat._reply_locks(group_id):
             group_bot_replies.append(
-                {
-                    "time": int(time.time()),
-                    "pre_raw_message": raw_message,
-                    "pre_keywords": keywords,
-                    "reply": Chat.REPLY_FLAG,
-                    "reply_keywords": Chat.REPLY_FLAG,
-                }
+                ReplyRecord(
+                    time=int(time.time()),
+                    pre_raw_message=raw_message,
+                    pre_keywords=keywords,
+                    reply=Chat.REPLY_FLAG,
+                    reply_keywords=Chat.REPLY_FLAG,
+                )
             )
 
         async def yield_results(results: tuple[list[str], str]) -> AsyncGenerator[Message, None, None]:
             answer_list, answer_keywords = results
             group_bot_replies = Chat._reply_dict[group_id][bot_id]
             for item in answer_list:
-                async with Chat._reply_lock:
+                async with Chat._reply_locks(group_id):
                     group_bot_replies.append(
-                        {
-                            "time": int(time.time()),
-                            "pre_raw_message": raw_message,
-                            "pre_keywords": keywords,
-                            "reply": item,
-                            "reply_keywords": answer_keywords,
-                        }
+                        ReplyRecord(
+                            time=int(time.time()),
+                            pre_raw_message=raw_message,
+                            pre_keywords=keywords,
+                            reply=item,
+                            reply_keywords=answer_keywords,
+                        )
                     )
                 if "[CQ:" not in item:
-                    async with Chat._topics_lock:
-                        Chat._recent_topics[group_id] += [
-                            k for k in answer_keywords.split(" ") if not k.startswith("牛牛")
-                        ]
-                async with Chat._topics_lock:
-                    Chat._recent_topics[group_id] += [
-                        k for k in self.chat_data._keywords_list if not k.startswith("牛牛")
-                    ]
+                    async with Chat._topics_locks(group_id):
+                        Chat._recent_topics[group_id].extend(
+                            [k for k in answer_keywords.split(" ") if not k.startswith("牛牛")], self.chat_data.time
+                        )
+                async with Chat._topics_locks(group_id):
+                    Chat._recent_topics[group_id].extend(
+                        [k for k in self.chat_data._keywords_list if not k.startswith("牛牛")], self.chat_data.time
+                    )
                 # if "[CQ:" not in item and len(item) > Chat.DRUNK_TTS_THRESHOLD and await self.config.drunkenness():
                 #     yield Message(Chat._text_to_speech(item))
                 yield Message(item)
 
-            async with Chat._reply_lock:
-                group_bot_replies = group_bot_replies[-Chat.SAVE_RESERVED_SIZE :]
-
         return yield_results(results)
 
     @staticmethod
@@ -257,13 +315,8 @@ class Chat:
         if raw_message == new_msg:
             return True
 
-        reply_data = Chat._reply_dict[group_id][bot_id][::-1]
-        for item in reply_data:
-            if item["reply"] == raw_message:
-                async with Chat._reply_lock:
-                    item["reply"] = new_msg
-                return True
-        return False
+        async with Chat._reply_locks(group_id):
+            return Chat._reply_dict[group_id][bot_id].replace_reply(raw_message, new_msg)
 
     @staticmethod
     async def speak() -> tuple[int, int, list[Message], int | None] | None:
@@ -271,101 +324,47 @@ class Chat:
         主动发言，返回当前最希望发言的 bot 账号、群号、发言消息 List、戳一戳目标，也有可能不发言
         """
 
-        basic_msgs_len = 10
-        basic_delay = 600
-
-        def group_popularity_cmp(lhs: tuple[int, list[MessageModel]], rhs: tuple[int, list[MessageModel]]) -> int:
-            def cmp(a: int, b: int):
-                return (a > b) - (a < b)
-
-            lhs_group_id, lhs_msgs = lhs
-            rhs_group_id, rhs_msgs = rhs
-
-            lhs_len = len(lhs_msgs)
-            rhs_len = len(rhs_msgs)
-
-            if lhs_len < basic_msgs_len or rhs_len < basic_msgs_len:
-                return cmp(lhs_len, rhs_len)
-
-            lhs_duration = lhs_msgs[-1].time - lhs_msgs[0].time
-            rhs_duration = rhs_msgs[-1].time - rhs_msgs[0].time
-
-            if not lhs_duration or not rhs_duration:
-                return cmp(lhs_len, rhs_len)
-
-            return cmp(lhs_len / lhs_duration, rhs_len / rhs_duration)
-
-        # 按群聊热度排序
-        popularity = sorted(Chat._message_dict.items(), key=cmp_to_key(group_popularity_cmp))
-
         cur_time = time.time()
-        for group_id, group_msgs in popularity:
+        # 只处理已经超过平均发言间隔 N 倍的时间没有人说话的群
+        while (group_id := Chat._activity.pop_due(cur_time)) is not None:
+            group_msgs = Chat._message_dict[group_id]
             group_replies = Chat._reply_dict[group_id]
-            if not len(group_replies) or len(group_msgs) < basic_msgs_len:
+            if not len(group_replies) or not len(group_msgs):
                 continue
 
             # 一般来说所有牛牛都是一起回复的，最后发言时间应该是一样的，随意随便选一个[0]就好了
             group_replies_front = list(group_replies.values())[0]
-            if not len(group_replies_front) or group_replies_front[-1]["time"] > group_msgs[-1].time:
-                continue
-
-            msgs_len = len(group_msgs)
-            latest_time = group_msgs[-1].time
-            duration = latest_time - group_msgs[0].time
-            avg_interval = duration / msgs_len
-
-            # 已经超过平均发言间隔 N 倍的时间没有人说话了，才主动发言
-            if cur_time - latest_time < avg_interval * Chat.SPEAK_THRESHOLD + basic_delay:
+            if not len(group_replies_front) or group_replies_front[-1].time > group_msgs[-1].time:
                 continue
 
             # append 一个 flag, 防止这个群热度特别高，但压根就没有可用的 context 时，每次 speak 都查这个群，浪费时间
-            async with Chat._reply_lock:
+            async with Chat._reply_locks(group_id):
                 group_replies_front.append(
-                    {
-                        "time": int(cur_time),
-                        "pre_raw_message": Chat.SPEAK_FLAG,
-                        "pre_keywords": Chat.SPEAK_FLAG,
-                        "reply": Chat.SPEAK_FLAG,
-                        "reply_keywords": Chat.SPEAK_FLAG,
-                    }
+                    ReplyRecord(
+                        time=int(cur_time),
+                        pre_raw_message=Chat.SPEAK_FLAG,
+                        pre_keywords=Chat.SPEAK_FLAG,
+                        reply=Chat.SPEAK_FLAG,
+                        reply_keywords=Chat.SPEAK_FLAG,
+                    )
                 )
 
             bot_id = random.choice([bid for bid in group_replies.keys() if bid])
 
-            ban_keywords = await Chat._find_ban_keywords(context=None, group_id=group_id)
-
-            recently = Chat._recent_speak[group_id]
-
-            def msg_filter(msg: MessageModel) -> bool:
-                cur_raw_message = msg.raw_message
-                cur_keywords = msg.keywords
-                return (
-                    cur_keywords not in ban_keywords  # noqa: B023
-                    and cur_raw_message not in recently  # noqa: B023
-                    and not cur_raw_message.startswith("牛牛")
-                    and not cur_raw_message.startswith("[CQ:xml")
-                    and "\n" not in cur_raw_message
-                )
-
-            available_messages = list(filter(msg_filter, Chat._message_dict[group_id]))
-            if not available_messages:
+            speak = await Chat._select_speak(group_id, bot_id)
+            if speak is None:
                 continue
-
-            taken_name = await BotConfig(bot_id, group_id).taken_name()
-            pretend_msg = list(filter(lambda msg: msg.user_id == taken_name, available_messages))
-            first_message = pretend_msg[0] if pretend_msg else available_messages[0]
-            speak = first_message.raw_message
             Chat._recent_speak[group_id].append(speak)
 
-            async with Chat._reply_lock:
+            async with Chat._reply_locks(group_id):
                 group_replies[bot_id].append(
-                    {
-                        "time": int(cur_time),
-                        "pre_raw_message": Chat.SPEAK_FLAG,
-                        "pre_keywords": Chat.SPEAK_FLAG,
-                        "reply": speak,
-                        "reply_keywords": Chat.SPEAK_FLAG,
-                    }
+                    ReplyRecord(
+                        time=int(cur_time),
+                        pre_raw_message=Chat.SPEAK_FLAG,
+                        pre_keywords=Chat.SPEAK_FLAG,
+                        reply=speak,
+                        reply_keywords=Chat.SPEAK_FLAG,
+                    )
                 )
 
             speak_list = [
@@ -396,6 +395,35 @@ class Chat:
 
         return None
 
+    @staticmethod
+    async def _select_speak(group_id: int, bot_id: int) -> str | None:
+        """
+        从群里最近的消息中选一条主动发言的内容，优先选被模仿的群友说的话
+        """
+
+        ban_keywords = Chat._find_ban_keywords(context=None, group_id=group_id)
+        recently = Chat._recent_speak[group_id]
+
+        def msg_filter(msg: ChatMessage) -> bool:
+            cur_raw_message = msg.raw_message
+            cur_keywords = msg.keywords
+            return (
+                cur_keywords not in ban_keywords
+                and cur_raw_message not in recently
+                and not cur_raw_message.startswith("牛牛")
+                and not cur_raw_message.startswith("[CQ:xml")
+                and "\n" not in cur_raw_message
+            )
+
+        available_messages = list(filter(msg_filter, Chat._message_dict[group_id]))
+        if not available_messages:
+            return None
+
+        taken_name = await BotConfig(bot_id, group_id).taken_name()
+        pretend_msg = list(filter(lambda msg: msg.user_id == taken_name, available_messages))
+        first_message = pretend_msg[0] if pretend_msg else available_messages[0]
+        return first_message.raw_message
+
     @staticmethod
     async def ban(group_id: int, bot_id: int, ban_raw_message: str, reason: str) -> bool:
         """
@@ -405,38 +433,15 @@ class Chat:
         if group_id not in Chat._reply_dict:
             return False
 
-        ban_reply = None
-        reply_data = Chat._reply_dict[group_id][bot_id][::-1]
-
-        for reply in reply_data:
-            cur_reply = reply["reply"]
-            # 为空时就直接 ban 最后一条回复
-            if not ban_raw_message or ban_raw_message in cur_reply:
-                ban_reply = reply
-                break
-
-        # 这种情况一般是有些 CQ 码，牛牛发送的时候，和被回复的时候，里面的内容不一样
-        if not ban_reply:
-            search = re.search(r"(\[CQ:[a-zA-z0-9-_.]+)", ban_raw_message)
-            if search:
-                type_keyword = search.group(1)
-                for reply in reply_data:
-                    cur_reply = reply["reply"]
-                    if type_keyword in cur_reply:
-                        ban_reply = reply
-                        break
-
+        ban_reply = Chat._reply_dict[group_id][bot_id].find(ban_raw_message)
         if not ban_reply:
             return False
 
-        pre_keywords = reply["pre_keywords"]
-        keywords = reply["reply_keywords"]
+        pre_keywords = ban_reply.pre_keywords
+        keywords = ban_reply.reply_keywords
 
-        context_to_ban = await Context.find_one(Context.keywords == pre_keywords)
-        if context_to_ban:
-            ban_reason = Ban(keywords=keywords, group_id=group_id, reason=reason, time=int(time.time()))
-            context_to_ban.ban.append(ban_reason)
-            await context_to_ban.save()
+        ban_reason = Ban(keywords=keywords, group_id=group_id, reason=reason, time=int(time.time()))
+        await Chat._context_cache.ban(pre_keywords, ban_reason)
 
         if keywords in Chat._blacklist_answer_reserve[group_id]:
             Chat._blacklist_answer[group_id].add(keywords)
@@ -448,80 +453,61 @@ class Chat:
         return True
 
     @staticmethod
-    async def get_random_message_from_each_group() -> dict[int, MessageModel]:
+    async def get_random_message_from_each_group() -> dict[int, ChatMessage]:
         """
-        获取每个群近期一条随机发言
-
-        TODO: 随机权重可以改为 keywords 出现频率 或 用户发言频率 正相关
+        获取每个群近期一条随机发言，发言越多的群友越容易被选中
         """
 
-        return {
-            group_id: random.choice(group_msgs) for group_id, group_msgs in Chat._message_dict.items() if group_msgs
-        }
+        messages = {}
+        for group_id, group_msgs in Chat._message_dict.items():
+            user_id = Chat._activity.sample_user(group_id)
+            if user_id is None:
+                continue
+            messages[group_id] = next((msg for msg in reversed(group_msgs) if msg.user_id == user_id), group_msgs[-1])
+        return messages
+
+    def _chat_message(self) -> ChatMessage:
+        return ChatMessage(
+            group_id=self.chat_data.group_id,
+            user_id=self.chat_data.user_id,
+            bot_id=self.chat_data.bot_id,
+            raw_message=self.chat_data.raw_message,
+            is_plain_text=self.chat_data.is_plain_text,
+            plain_text=self.chat_data.plain_text,
+            keywords=self.chat_data.keywords,
+            time=self.chat_data.time,
+        )
 
-    async def _message_insert(self):
+    async def _message_insert(self, message: ChatMessage):
         group_id = self.chat_data.group_id
 
-        async with Chat._message_lock:
-            Chat._message_dict[group_id].append(
-                MessageModel(
-                    group_id=group_id,
-                    user_id=self.chat_data.user_id,
-                    bot_id=self.chat_data.bot_id,
-                    raw_message=self.chat_data.raw_message,
-                    is_plain_text=self.chat_data.is_plain_text,
-                    plain_text=self.chat_data.plain_text,
-                    keywords=self.chat_data.keywords,
-                    time=self.chat_data.time,
-                )
-            )
+        async with Chat._message_locks(group_id):
+            evicted = Chat._message_dict[group_id].append(message)
+            Chat._activity.record(message, evicted)
 
-        if self.chat_data.is_plain_text:
-            async with Chat._topics_lock:
-                Chat._recent_topics[group_id] += [k for k in self.chat_data._keywords_list if not k.startswith("牛牛")]
+        # 只入队，由后台任务写库
+        Chat._message_writer.put(message)
 
-        cur_time = self.chat_data.time
-        if Chat._late_save_time == 0:
-            Chat._late_save_time = cur_time - 1
-            return
-
-        if len(Chat._message_dict[group_id]) > Chat.SAVE_COUNT_THRESHOLD:
-            await Chat._sync(cur_time)
-
-        elif cur_time - Chat._late_save_time > Chat.SAVE_TIME_THRESHOLD:
-            await Chat._sync(cur_time)
+        if self.chat_data.is_plain_text:
+            async with Chat._topics_locks(group_id):
+                Chat._recent_topics[group_id].extend(
+                    [k for k in self.chat_data._keywords_list if not k.startswith("牛牛")], self.chat_data.time
+                )
 
     @staticmethod
-    async def _sync(cur_time: int = time.time()):
+    async def _sync():
         """
         持久化
         """
 
-        async with Chat._message_lock:
-            save_list = [
-                msg
-                for group_msgs in Chat._message_dict.values()
-                for msg in group_msgs
-                if msg.time > Chat._late_save_time
-            ]
-            if not save_list:
-                return
-
-            new_dict = {
-                group_id: group_msgs[-Chat.SAVE_RESERVED_SIZE :] for group_id, group_msgs in Chat._message_dict.items()
-            }
-            Chat._message_dict.clear()
-            Chat._message_dict.update(new_dict)
+        await Chat._message_writer.flush()
 
-            Chat._late_save_time = cur_time
-
-        await MessageModel.insert_many(save_list)
-
-    async def _context_insert(self, pre_msg: MessageModel):
+    @staticmethod
+    async def _context_insert(pre_msg: ChatMessage, message: ChatMessage):
         if not pre_msg:
             return
 
-        raw_message = self.chat_data.raw_message
+        raw_message = message.raw_message
 
         # 在复读，不学
         if pre_msg.raw_message == raw_message:
@@ -531,42 +517,7 @@ class Chat:
         if "[CQ:reply," in raw_message:
             return
 
-        keywords = self.chat_data.keywords
-        group_id = self.chat_data.group_id
-        pre_keywords = pre_msg.keywords
-        cur_time = self.chat_data.time
-
-        context = await Context.find_one(Context.keywords == pre_keywords)
-        if context:
-            answer_index = next(
-                (
-                    idx
-                    for idx, answer in enumerate(context.answers)
-                    if answer.group_id == group_id and answer.keywords == keywords
-                ),
-                -1,
-            )
-            if answer_index != -1:
-                context.answers[answer_index].count += 1
-                context.answers[answer_index].time = cur_time
-                if self.chat_data.is_plain_text:
-                    context.answers[answer_index].messages.append(raw_message)
-            else:
-                context.answers.append(
-                    Answer(keywords=keywords, group_id=group_id, count=1, time=cur_time, messages=[raw_message])
-                )
-            context.time = cur_time
-            context.trigger_count += 1
-            await context.save()
-
-        else:
-            context = Context(
-                keywords=pre_keywords,
-                time=cur_time,
-                trigger_count=1,
-                answers=[Answer(keywords=keywords, group_id=group_id, count=1, time=cur_time, messages=[raw_message])],
-            )
-            await context.insert()
+        Chat._context_cache.learn(pre_msg.keywords, message)
 
     async def _context_find(self) -> tuple[list[str], str] | None:
         group_id = self.chat_data.group_id
@@ -578,11 +529,11 @@ class Chat:
         if group_id in Chat._message_dict:
             group_msgs = Chat._message_dict[group_id]
             if len(group_msgs) >= Chat.REPEAT_THRESHOLD and all(
-                item.raw_message == raw_message for item in group_msgs[-Chat.REPEAT_THRESHOLD + 1 :]
+                item.raw_message == raw_message for item in group_msgs.tail(Chat.REPEAT_THRESHOLD - 1)
             ):
                 # 到这里说明当前群里是在复读
                 group_bot_replies = Chat._reply_dict[group_id][bot_id]
-                if len(group_bot_replies) and group_bot_replies[-1]["reply"] != raw_message:
+                if len(group_bot_replies) and group_bot_replies[-1].reply != raw_message:
                     return (
                         [
                             raw_message,
@@ -593,7 +544,7 @@ class Chat:
                     # 复读过一次就不再回复这句话了
                     return None
 
-        context = await Context.find_one(Context.keywords == keywords)
+        context = await Chat._context_cache.get(keywords)
 
         if not context:
             return None
@@ -614,30 +565,33 @@ class Chat:
         else:
             cross_group_threshold = Chat.CROSS_GROUP_THRESHOLD
 
-        ban_keywords = await Chat._find_ban_keywords(context=context, group_id=group_id)
+        ban_keywords = Chat._find_ban_keywords(context=context, group_id=group_id)
 
         candidate_answers: dict[str, Answer] = {}
         other_group_cache = {}
         answers_count = defaultdict(int)
-        recent_replies = [r["reply_keywords"] for r in Chat._reply_dict[group_id][bot_id][-Chat.DUPLICATE_REPLY :]]
-        recent_message = [m.raw_message for m in Chat._message_dict[group_id][-Chat.DUPLICATE_REPLY :]]
+        recent_replies = [r.reply_keywords for r in Chat._reply_dict[group_id][bot_id].tail(Chat.DUPLICATE_REPLY)]
+        recent_message = [m.raw_message for m in Chat._message_dict[group_id].tail(Chat.DUPLICATE_REPLY)]
 
         def candidate_append(dst: dict[str, Answer], answer: Answer):
+            # 缓存中的 Context 是共享的，复制一份再修改
+            answer = answer.model_copy(update={"samples": list(answer.samples)})
             answer_key = answer.keywords
             if "[CQ:" not in answer_key:
                 topics = Chat._recent_topics[group_id]
                 for key in answer_key.split(" "):
                     if key in topics:
-                        answer._topical += topics.count(key)
+                        answer._topical += topics.weight(key, self.chat_data.time)
 
             if answer_key not in dst:
                 dst[answer_key] = answer
             else:
                 pre_answer = dst[answer_key]
                 pre_answer.count += answer.count
-                pre_answer.messages += answer.messages
+                pre_answer.samples += answer.samples
 
-        for answer in context.answers:
+        answers = await Chat._context_cache.answers(context, 1 if is_drunk else answer_count_threshold)
+        for answer in answers:
             count = answer.count
             if not is_drunk and count < answer_count_threshold:
                 continue
@@ -646,7 +600,11 @@ class Chat:
             if answer_key in ban_keywords or answer_key in recent_replies or answer_key == keywords:
                 continue
 
-            sample_msg = answer.messages[0]
+            # 其他 bot 刚追加、还没写入消息的 answer
+            if not answer.samples:
+                continue
+
+            sample_msg = answer.samples[0].message
             if self.chat_data.is_image and "[CQ:" not in sample_msg:
                 # 图片消息不回复纯文本。图片经常是表情包，后面的纯文本啥都有，很乱
                 continue
@@ -688,7 +646,11 @@ class Chat:
             min(answer.count, 10) + answer._topical * Chat.TOPICS_IMPORTANCE for answer in candidate_answers.values()
         ]
         final_answer = random.choices(list(candidate_answers.values()), weights=weights)[0]
-        answer_str = random.choice(final_answer.messages)
+        # 按消息出现的次数加权，和从所有原始消息中随机选一条的分布相同
+        answer_str = random.choices(
+            [sample.message for sample in final_answer.samples],
+            weights=[sample.count for sample in final_answer.samples],
+        )[0]
         answer_keywords = final_answer.keywords
         answer_str = answer_str.removeprefix("牛牛")
 
@@ -717,14 +679,11 @@ class Chat:
 
     @staticmethod
     async def _select_blacklist() -> None:
-        all_blacklist = await BlackList.find_all().to_list()
-
-        for item in all_blacklist:
-            group_id = item.group_id
-            if item.answers:
-                Chat._blacklist_answer[group_id] |= set(item.answers)
-            if item.answers_reserve:
-                Chat._blacklist_answer_reserve[group_id] |= set(item.answers_reserve)
+        for group_id, answers, answers_reserve in await Chat._storage.load_blacklists():
+            if answers:
+                Chat._blacklist_answer[group_id] |= set(answers)
+            if answers_reserve:
+                Chat._blacklist_answer_reserve[group_id] |= set(answers_reserve)
 
     @staticmethod
     async def _sync_blacklist() -> None:
@@ -733,9 +692,7 @@ class Chat:
         for group_id, answers in Chat._blacklist_answer.items():
             if not len(answers):
                 continue
-            await BlackList.find_one(BlackList.group_id == group_id).upsert(
-                {"$set": {"answers": list(answers)}}, on_insert=BlackList(group_id=group_id, answers=list(answers))
-            )
+            await Chat._storage.save_blacklist(group_id, "answers", list(answers))
 
         for group_id, answers_set in Chat._blacklist_answer_reserve.items():
             if not len(answers_set):
@@ -744,10 +701,7 @@ class Chat:
             if group_id in Chat._blacklist_answer:
                 filtered_answers = answers_set - Chat._blacklist_answer[group_id]
 
-            await BlackList.find_one(BlackList.group_id == group_id).upsert(
-                {"$set": {"answers_reserve": list(filtered_answers)}},
-                on_insert=BlackList(group_id=group_id, answers_reserve=list(filtered_answers)),
-            )
+            await Chat._storage.save_blacklist(group_id, "answers_reserve", list(filtered_answers))
 
     @staticmethod
     async def clearup_context() -> None:
@@ -755,75 +709,126 @@ class Chat:
         清理所有超过 15 天没人说、且没有学会的话
         """
 
-        cur_time = int(time.time())
-        expiration = cur_time - 15 * 24 * 3600  # 15 天前
+        state: dict | None = {}
+        while state is not None:
+            state = await Chat.clearup_context_step(state, 1000)
 
-        await Context.find(Context.time < expiration, Context.trigger_count < Chat.ANSWER_THRESHOLD).delete()
+    @staticmethod
+    async def clearup_context_step(state: dict, limit: int) -> dict | None:
+        """
+        分片清理，每次按主键顺序处理不超过 limit 个文档，返回新的进度，清理完成时返回 None
 
-        all_context = await Context.find(Or(Context.trigger_count > 100, Context.clear_time < expiration)).to_list()
-        for context in all_context:
-            answers = [ans for ans in context.answers if ans.count > 1 or ans.time > expiration]
-            context.answers = answers
-            context.clear_time = cur_time
-            await context.save()
+        依次为删除过期的 Context、拆分存储时删除过期的 answer 文档、内嵌存储时过滤 answers
+        """
+
+        if not state:
+            # 先把学到的内容写回，再开始清理
+            await Chat.sync()
+            cur_time = int(time.time())
+            return {
+                "phase": "delete",
+                "last_id": None,
+                "done": 0,
+                "cur_time": cur_time,
+                "expiration": cur_time - 15 * 24 * 3600,  # 15 天前
+            }
+
+        state = await Chat._storage.clearup_step(state, limit, Chat.ANSWER_THRESHOLD)
+        if state is None:
+            # 缓存中的文档可能已经被清理掉了，之后从存储后端重新加载
+            Chat._context_cache.clear()
+        return state
 
     @staticmethod
-    async def _find_ban_keywords(context: Context | None, group_id) -> set:
+    def _find_ban_keywords(context: Context | None, group_id) -> BanView:
         """
         找到在 group_id 群中对应 context 不能回复的关键词
+
+        依次查全局、本群、针对单条回复的黑名单，不合并集合
         """
 
-        # 全局的黑名单
-        ban_keywords = Chat._blacklist_answer[Chat.BLACKLIST_FLAG] | Chat._blacklist_answer[group_id]
-        # 针对单条回复的黑名单
-        if context is not None and context.ban:
-            ban_count = defaultdict(int)
-            for ban in context.ban:
-                ban_key = ban.keywords
-                if ban.group_id in {group_id, Chat.BLACKLIST_FLAG}:
-                    ban_keywords.add(ban_key)
-                else:
-                    # 超过 N 个群都把这句话 ban 了，那就全局 ban 掉
-                    ban_count[ban_key] += 1
-                    if ban_count[ban_key] == Chat.CROSS_GROUP_THRESHOLD:
-                        ban_keywords.add(ban_key)
-        return ban_keywords
+        layers = (Chat._blacklist_answer[Chat.BLACKLIST_FLAG], Chat._blacklist_answer[group_id])
+        context_bans = Chat._context_cache.bans(context) if context is not None else None
+        return BanView(layers, group_id, Chat.BLACKLIST_FLAG, context_bans)
 
     @staticmethod
-    async def sync():
-        await Chat._sync()
-        await Chat._sync_blacklist()
+    async def build_context_filter() -> None:
+        """
+        重新构建 Context keywords 的布隆过滤器
+        """
 
+        await Chat._context_cache.build_filter()
 
-if __name__ == "__main__":
-    # Chat.clearup_context()
-    # # while True:
-    test_data: ChatData = ChatData(
-        group_id=1234567,
-        user_id=1111111,
-        raw_message="完了又有新bug",
-        plain_text="完了又有新bug",
-        time=time.time(),
-        bot_id=0,
-    )
+    @staticmethod
+    def context_cache_stats() -> dict[str, int]:
+        """
+        Context 缓存及布隆过滤器的命中统计
+        """
 
-    test_chat: Chat = Chat(test_data)
+        return Chat._context_cache.stats()
 
-    print(test_chat.answer())
-    test_chat.learn()
+    @staticmethod
+    def clear_context_cache() -> None:
+        """
+        丢弃缓存的 Context，之后从数据库重新加载
+        """
 
-    test_answer_data: ChatData = ChatData(
-        group_id=1234567,
-        user_id=1111111,
-        raw_message="完了又有新bug",
-        plain_text="完了又有新bug",
-        time=time.time(),
-        bot_id=0,
-    )
+        Chat._context_cache.clear()
+
+    @staticmethod
+    async def flush_context() -> int:
+        """
+        将学到的 Context 批量写回数据库
+        """
+
+        return await Chat._context_cache.flush()
 
-    test_answer: Chat = Chat(test_answer_data)
-    print(test_chat.answer())
-    test_answer.learn()
+    @staticmethod
+    def message_writer_stats() -> dict[str, int]:
+        """
+        群消息持久化队列的积压、丢弃等统计
+        """
+
+        return Chat._message_writer.stats()
+
+    @staticmethod
+    def load_reply_history() -> None:
+        """
+        读取重启前保存的回复记录
+        """
 
-    # time.sleep(5)
-    # print(Chat.speak())
+        if not Chat.REPLY_HISTORY_SNAPSHOT:
+            return
+        try:
+            count = load_snapshot(Chat._reply_dict, Chat.REPLY_HISTORY_SNAPSHOT)
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning(f"failed to load reply history snapshot: {e}")
+            return
+        logger.info(f"loaded {count} reply history records")
+
+    @staticmethod
+    def save_reply_history() -> None:
+        if not Chat.REPLY_HISTORY_SNAPSHOT:
+            return
+        try:
+            save_snapshot(Chat._reply_dict, Chat.REPLY_HISTORY_SNAPSHOT)
+        except OSError as e:
+            logger.warning(f"failed to save reply history snapshot: {e}")
+
+    @staticmethod
+    async def close():
+        """
+        关闭前写完所有缓存的数据
+        """
+
+        Chat.save_reply_history()
+        await Chat.flush_context()
+        await Chat._message_writer.close()
+        await Chat._sync_blacklist()
+        await Chat._storage.close()
+
+    @staticmethod
+    async def sync():
+        await Chat.flush_context()
+        await Chat._sync()
+        await Chat._sync_blacklist()
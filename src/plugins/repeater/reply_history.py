@@ -0,0 +1,143 @@
+import json
+import re
+from collections import deque
+from pathlib import Path
+
+CQ_TYPE_PATTERN = re.compile(r"(\[CQ:[a-zA-z0-9-_.]+)")
+
+
+class ReplyRecord:
+    __slots__ = ("pre_keywords", "pre_raw_message", "reply", "reply_keywords", "time")
+
+    def __init__(self, time: int, pre_raw_message: str, pre_keywords: str, reply: str, reply_keywords: str) -> None:
+        self.time = time
+        self.pre_raw_message = pre_raw_message
+        self.pre_keywords = pre_keywords
+        self.reply = reply
+        self.reply_keywords = reply_keywords
+
+    def to_dict(self) -> dict:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
+class ReplyHistory:
+    """
+    某个 bot 在某个群的定长回复记录
+
+    按回复内容、CQ 码类型分别索引到最近的一条记录，后处理和 ban 时不用逆序遍历
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self._records: deque[ReplyRecord] = deque()
+        self._capacity = max(capacity, 1)
+        self._by_reply: dict[str, ReplyRecord] = {}
+        self._by_type: dict[str, ReplyRecord] = {}
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __getitem__(self, index: int) -> ReplyRecord:
+        return self._records[index]
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def append(self, record: ReplyRecord) -> None:
+        if len(self._records) >= self._capacity:
+            self._unindex(self._records.popleft())
+        self._records.append(record)
+        self._index(record)
+
+    def tail(self, n: int) -> list[ReplyRecord]:
+        """
+        最近的 n 条记录，按时间先后排列
+        """
+
+        n = min(max(n, 0), len(self._records))
+        return [self._records[i] for i in range(len(self._records) - n, len(self._records))]
+
+    def replace_reply(self, reply: str, new_reply: str) -> bool:
+        """
+        将最近一条内容为 reply 的记录替换为 new_reply
+        """
+
+        record = self._by_reply.get(reply)
+        if record is None:
+            return False
+        self._unindex(record)
+        record.reply = new_reply
+        self._index(record)
+        return True
+
+    def find(self, raw_message: str) -> ReplyRecord | None:
+        """
+        找到最近一条与 raw_message 对应的回复，raw_message 为空时返回最后一条回复
+        """
+
+        if not self._records:
+            return None
+        if not raw_message:
+            return self._records[-1]
+
+        record = self._by_reply.get(raw_message)
+        if record is not None:
+            return record
+
+        # 被回复的消息可能只是回复内容的一部分，记录数有上限，遍历的代价是固定的
+        for record in reversed(self._records):
+            if raw_message in record.reply:
+                return record
+
+        # 这种情况一般是有些 CQ 码，牛牛发送的时候，和被回复的时候，里面的内容不一样
+        search = CQ_TYPE_PATTERN.search(raw_message)
+        if search:
+            return self._by_type.get(search.group(1))
+        return None
+
+    def _index(self, record: ReplyRecord) -> None:
+        self._by_reply[record.reply] = record
+        for type_keyword in CQ_TYPE_PATTERN.findall(record.reply):
+            self._by_type[type_keyword] = record
+
+    def _unindex(self, record: ReplyRecord) -> None:
+        if self._by_reply.get(record.reply) is record:
+            del self._by_reply[record.reply]
+        for type_keyword in CQ_TYPE_PATTERN.findall(record.reply):
+            if self._by_type.get(type_keyword) is record:
+                del self._by_type[type_keyword]
+
+
+def save_snapshot(histories: dict[int, dict[int, ReplyHistory]], path: str) -> None:
+    """
+    保存所有群的回复记录，重启后管理员仍可以 ban 掉重启前的回复
+    """
+
+    data = {
+        str(group_id): {str(bot_id): [record.to_dict() for record in history] for bot_id, history in bots.items()}
+        for group_id, bots in histories.items()
+    }
+    snapshot = Path(path)
+    snapshot.parent.mkdir(parents=True, exist_ok=True)
+    tmp = snapshot.with_suffix(snapshot.suffix + ".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(snapshot)
+
+
+def load_snapshot(histories: dict[int, dict[int, ReplyHistory]], path: str) -> int:
+    """
+    读取回复记录，返回读取到的记录数
+    """
+
+    snapshot = Path(path)
+    if not snapshot.exists():
+        return 0
+
+    data = json.loads(snapshot.read_text(encoding="utf-8"))
+    count = 0
+    for group_id, bots in data.items():
+        for bot_id, records in bots.items():
+            history = histories[int(group_id)][int(bot_id)]
+            for record in records:
+                history.append(ReplyRecord(**record))
+                count += 1
+    return count
@@ -0,0 +1,286 @@
+import asyncio
+import bisect
+import contextlib
+import hashlib
+import itertools
+import pickle
+import struct
+import sys
+from pathlib import Path
+
+from nonebot import get_plugin_config, logger
+from nonebot.adapters.onebot.v11 import Message
+
+from .config import Config
+from .message_buffer import ChatMessage
+from .model import ChatData
+
+plugin_config = get_plugin_config(Config)
+
+HEADER = struct.Struct("!I")
+# 子进程里先初始化 NoneBot，再注册一个空的 repeater 包，只导入 worker 用到的模块，
+# 不执行包的 __init__ ( 注册 matcher、定时任务等 )
+WORKER_COMMAND = f"""
+import sys, types
+import nonebot
+nonebot.init()
+package = types.ModuleType({__package__!r})
+package.__path__ = [{str(Path(__file__).parent)!r}]
+sys.modules[package.__name__] = package
+from {__package__}.worker import main
+main()
+"""
+# 等待 worker 开始监听的时间 ( 秒 )
+CONNECT_TIMEOUT = 60
+# 关闭时等待 worker 退出的时间 ( 秒 )
+CLOSE_TIMEOUT = 30
+# worker 意外退出后，隔多久重新启动 ( 秒 )
+RESTART_DELAY = 5
+
+
+async def read_frame(reader: asyncio.StreamReader):
+    (size,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return pickle.loads(await reader.readexactly(size))
+
+
+def write_frame(writer: asyncio.StreamWriter, obj) -> None:
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    writer.write(HEADER.pack(len(data)) + data)
+
+
+def socket_path(socket_dir: str, index: int) -> str:
+    return str(Path(socket_dir) / f"repeater-{index}.sock")
+
+
+class HashRing:
+    """
+    一致性哈希环，worker 数量变化时只有少部分群会换到别的 worker
+    """
+
+    def __init__(self, nodes: int, replicas: int = 64) -> None:
+        points = sorted((self._hash(f"{node}-{replica}"), node) for node in range(nodes) for replica in range(replicas))
+        self._keys = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+    def get(self, key: int) -> int:
+        index = bisect.bisect(self._keys, self._hash(str(key))) % len(self._keys)
+        return self._nodes[index]
+
+
+class WorkerClient:
+    """
+    与一个 worker 进程的连接，请求带编号，可以并发多个
+    """
+
+    def __init__(self, index: int, path: str) -> None:
+        self.index = index
+        self._path = path
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._pending: dict[int, asyncio.Future] = {}
+        self._ids = itertools.count()
+        self._reader_task: asyncio.Task | None = None
+
+    async def connect(self) -> None:
+        """
+        一直重试到 worker 开始监听为止，超时由调用方用 asyncio.timeout 控制
+        """
+
+        while True:
+            try:
+                self._reader, self._writer = await asyncio.open_unix_connection(self._path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                # worker 还在加载 jieba 等，等它开始监听
+                await asyncio.sleep(0.5)
+        self._reader_task = asyncio.create_task(self._read_loop())
+
+    async def call(self, op: str, *args):
+        if self._writer is None or self._writer.is_closing():
+            raise ConnectionError(f"repeater worker [{self.index}] is not connected")
+
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        write_frame(self._writer, (request_id, op, args))
+        await self._writer.drain()
+        return await future
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            with contextlib.suppress(ConnectionError):
+                await self._writer.wait_closed()
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._reader_task
+
+    def _resolve(self, request_id: int, ok: bool, result) -> None:
+        future = self._pending.pop(request_id, None)
+        if future is None or future.done():
+            return
+        if ok:
+            future.set_result(result)
+        else:
+            future.set_exception(RuntimeError(f"repeater worker [{self.index}]: {result}"))
+
+    async def _read_loop(self) -> None:
+        try:
+            while True:
+                self._resolve(*await read_frame(self._reader))
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            logger.error(f"repeater worker [{self.index}] disconnected: {e}")
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"repeater worker [{self.index}] disconnected"))
+            self._pending.clear()
+
+
+class ShardRouter:
+    """
+    多进程模式下的路由，按 group_id 的一致性哈希把群分给 N 个 worker 进程
+
+    群消息缓存、话题、回复记录等按群的状态只存在于负责该群的 worker 中，
+    NoneBot 进程只负责转发 ChatData 和取回回复，冷却、醉酒等状态仍在 NoneBot 进程里
+
+    每个 worker 都有一个监视任务，worker 意外退出或启动后连不上时，隔 RESTART_DELAY 秒重新启动；
+    重启期间发给这个 worker 的请求会抛出 ConnectionError
+    """
+
+    def __init__(self, workers: int, socket_dir: str) -> None:
+        self._socket_dir = socket_dir
+        self._ring = HashRing(workers)
+        self._clients = [WorkerClient(index, socket_path(socket_dir, index)) for index in range(workers)]
+        self._processes: list[asyncio.subprocess.Process | None] = [None] * workers
+        self._watchers: list[asyncio.Task] = []
+        self._closing = False
+        self._speak_next = 0
+
+        self.restarts = 0
+
+    def shard(self, group_id: int) -> WorkerClient:
+        return self._clients[self._ring.get(group_id)]
+
+    async def _spawn(self, client: WorkerClient) -> None:
+        path = socket_path(self._socket_dir, client.index)
+        await asyncio.to_thread(Path(path).unlink, missing_ok=True)
+        self._processes[client.index] = await asyncio.create_subprocess_exec(
+            sys.executable, "-c", WORKER_COMMAND, str(client.index), path
+        )
+        async with asyncio.timeout(CONNECT_TIMEOUT):
+            await client.connect()
+
+    async def start(self) -> None:
+        await asyncio.to_thread(Path(self._socket_dir).mkdir, parents=True, exist_ok=True)
+        await asyncio.gather(*(self._spawn(client) for client in self._clients))
+        self._watchers = [asyncio.create_task(self._watch(client)) for client in self._clients]
+        logger.info(f"{len(self._clients)} repeater workers started")
+
+    async def _watch(self, client: WorkerClient) -> None:
+        """
+        worker 退出后重新启动，直到 NoneBot 关闭
+        """
+
+        while True:
+            process = self._processes[client.index]
+            code = await process.wait()
+            if self._closing:
+                return
+            logger.error(f"repeater worker [{client.index}] exited with code {code}, restart in {RESTART_DELAY}s")
+            await client.close()
+            await asyncio.sleep(RESTART_DELAY)
+            self.restarts += 1
+            try:
+                await self._spawn(client)
+            except (OSError, TimeoutError) as e:
+                logger.error(f"repeater worker [{client.index}] failed to restart: {e!r}")
+                # 没有连上的进程也结束掉，下一轮再重新启动
+                with contextlib.suppress(ProcessLookupError):
+                    self._processes[client.index].kill()
+            else:
+                logger.info(f"repeater worker [{client.index}] restarted")
+
+    async def close(self) -> None:
+        self._closing = True
+        for watcher in self._watchers:
+            watcher.cancel()
+        results = await asyncio.gather(*(client.call("close") for client in self._clients), return_exceptions=True)
+        for client, result in zip(self._clients, results, strict=True):
+            if isinstance(result, Exception):
+                logger.warning(f"repeater worker [{client.index}] failed to close: {result}")
+            await client.close()
+        for process in self._processes:
+            if process is None:
+                continue
+            try:
+                async with asyncio.timeout(CLOSE_TIMEOUT):
+                    await process.wait()
+            except TimeoutError:
+                process.kill()
+
+    async def broadcast(self, op: str, *args) -> list:
+        return await asyncio.gather(*(client.call(op, *args) for client in self._clients))
+
+    async def chat(self, chat_data: ChatData, drunkenness: int, answer: bool, learn: bool) -> list[Message] | None:
+        """
+        在负责该群的 worker 中回复并学习这句话
+        """
+
+        data = {
+            "group_id": chat_data.group_id,
+            "user_id": chat_data.user_id,
+            "raw_message": chat_data.raw_message,
+            "plain_text": chat_data.plain_text,
+            "time": chat_data.time,
+            "bot_id": chat_data.bot_id,
+        }
+        answers = await self.shard(chat_data.group_id).call("chat", data, drunkenness, answer, learn)
+        if answers is None:
+            return None
+        return [Message(item) for item in answers]
+
+    async def reply_post_proc(self, raw_message: str, new_msg: str, bot_id: int, group_id: int) -> bool:
+        return await self.shard(group_id).call("post_proc", raw_message, new_msg, bot_id, group_id)
+
+    async def ban(self, group_id: int, bot_id: int, ban_raw_message: str, reason: str) -> bool:
+        return await self.shard(group_id).call("ban", group_id, bot_id, ban_raw_message, reason)
+
+    async def speak(self) -> tuple[int, int, list[Message], int | None] | None:
+        """
+        与单进程时一样，每次最多只有一个群主动发言
+
+        从上次发言的下一个 worker 开始依次询问，有 worker 要发言就停下，
+        没问到的 worker 中到期的群留到下一次，不会因为 worker 多而发言更频繁
+        """
+
+        workers = len(self._clients)
+        for offset in range(workers):
+            index = (self._speak_next + offset) % workers
+            try:
+                result = await self._clients[index].call("speak")
+            except ConnectionError as e:
+                logger.warning(f"repeater worker [{index}] skipped speak: {e}")
+                continue
+            if result is None:
+                continue
+            self._speak_next = index + 1
+            bot_id, group_id, messages, target_id = result
+            return bot_id, group_id, [Message(item) for item in messages], target_id
+        return None
+
+    async def get_random_message_from_each_group(self) -> dict[int, ChatMessage]:
+        messages = {}
+        for result in await self.broadcast("random_messages"):
+            messages.update(result)
+        return messages
+
+
+router = (
+    ShardRouter(plugin_config.shard_workers, plugin_config.shard_socket_dir) if plugin_config.shard_workers else None
+)
@@ -0,0 +1,32 @@
+from typing import Literal
+
+from src.common.db import Answer
+
+from .base import AnswerDelta, BlacklistField, ContextDelta, RepeaterStorage
+from .mongo import MongoStorage
+from .sqlite import SQLiteStorage
+
+
+def create_storage(
+    backend: Literal["mongo", "sqlite"], split: bool, sqlite_path: str, samples_limit: int = 0
+) -> RepeaterStorage:
+    """
+    按配置创建存储后端，split 只对 MongoDB 有效
+    """
+
+    # 读取到旧数据时，合并出的 samples 也按这个上限截断
+    Answer.SAMPLES_LIMIT = samples_limit
+    if backend == "sqlite":
+        return SQLiteStorage(sqlite_path, samples_limit)
+    return MongoStorage(split, samples_limit)
+
+
+__all__ = [
+    "AnswerDelta",
+    "BlacklistField",
+    "ContextDelta",
+    "MongoStorage",
+    "RepeaterStorage",
+    "SQLiteStorage",
+    "create_storage",
+]
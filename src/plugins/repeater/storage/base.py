@@ -0,0 +1,128 @@
+from abc import ABC, abstractmethod
+from collections import Counter
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+from typing import Literal
+
+from src.common.db import Answer, Ban, Context
+
+from ..message_buffer import ChatMessage
+
+BlacklistField = Literal["answers", "answers_reserve"]
+
+
+@dataclass
+class AnswerDelta:
+    count: int = 0
+    time: int = 0
+    # 需要合并到 answer.samples 的纯文本消息及其次数
+    messages: Counter[str] = field(default_factory=Counter)
+    # 非纯文本消息只在新建 answer 时记录一条
+    sample: str | None = None
+
+
+@dataclass
+class ContextDelta:
+    count: int = 0
+    time: int = 0
+    answers: dict[tuple[int, str], AnswerDelta] = field(default_factory=dict)
+
+    def merge(self, other: "ContextDelta") -> None:
+        """
+        把另一份增量累加到这一份上
+        """
+
+        self.count += other.count
+        self.time = max(self.time, other.time)
+        for key, other_answer in other.answers.items():
+            answer = self.answers.get(key)
+            if answer is None:
+                self.answers[key] = other_answer
+                continue
+            answer.count += other_answer.count
+            answer.time = max(answer.time, other_answer.time)
+            answer.messages.update(other_answer.messages)
+            if answer.sample is None:
+                answer.sample = other_answer.sample
+
+
+class RepeaterStorage(ABC):
+    """
+    复读机的存储后端，负责 Context、answer、群消息和黑名单的读写
+
+    split_answers 为 True 时 answer 单独存放，find_context 返回的 Context 不包含 answers，需要用 find_answers 获取
+
+    每个 answer 最多保留 samples_limit 条不同的消息，0 为不限
+    """
+
+    split_answers: bool = False
+    samples_limit: int = 0
+    # 写群消息时遇到这些异常会重试
+    transient_errors: tuple[type[Exception], ...] = ()
+
+    @abstractmethod
+    async def find_context(self, keywords: str) -> Context | None: ...
+
+    @abstractmethod
+    async def find_answers(self, keywords: str, count_threshold: int) -> list[Answer]:
+        """
+        拆分存储时，获取 count 达到阈值的 answer
+        """
+
+    @abstractmethod
+    async def apply_deltas(self, pending: dict[str, ContextDelta], flush_id: str) -> None:
+        """
+        把累积的学习内容原子地累加到已有的 Context 和 answer 上，不存在的新建
+
+        失败后用同一个 flush_id 重新写入同一批增量时，已经累加过的部分不会重复累加
+        """
+
+    @abstractmethod
+    async def push_ban(self, keywords: str, ban: Ban, cross_group_threshold: int) -> list[str] | None:
+        """
+        追加一条 ban 记录并更新跨群 ban 的汇总，返回新的汇总；Context 不存在时返回 None
+        """
+
+    @abstractmethod
+    async def count_contexts(self) -> int:
+        """
+        Context 数量的估计值
+        """
+
+    @abstractmethod
+    def iter_context_keywords(self) -> AsyncIterator[str]:
+        """
+        流式读取所有 Context 的 keywords
+        """
+
+    @abstractmethod
+    def prepare_messages(self, messages: list[ChatMessage]) -> list:
+        """
+        把群消息转换为写入用的格式，重试时复用同一份，避免重复写入
+        """
+
+    @abstractmethod
+    async def insert_messages(self, prepared: list) -> None: ...
+
+    @abstractmethod
+    async def load_blacklists(self) -> list[tuple[int, list[str], list[str]]]:
+        """
+        读取所有群的黑名单，返回 (group_id, answers, answers_reserve) 列表
+        """
+
+    @abstractmethod
+    async def save_blacklist(self, group_id: int, field: BlacklistField, answers: list[str]) -> None: ...
+
+    @abstractmethod
+    async def clearup_step(self, state: dict, limit: int, answer_threshold: int) -> dict | None:
+        """
+        分片清理过期的 Context 和 answer，每次处理不超过 limit 条，返回新的进度，清理完成时返回 None
+
+        state 至少包含 phase、last_id、done、cur_time、expiration，phase 从 delete 开始
+        """
+
+    @abstractmethod
+    async def close(self) -> None:
+        """
+        关闭连接等资源
+        """
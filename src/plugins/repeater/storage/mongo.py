@@ -0,0 +1,353 @@
+import asyncio
+from collections.abc import AsyncIterator
+from typing import override
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from nonebot import logger
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure
+
+from src.common.db import Answer, Ban, BlackList, Context, ContextAnswer, Sample
+from src.common.db import Message as MessageModel
+
+from ..ban_index import ContextBans
+from ..message_buffer import ChatMessage
+from .base import BlacklistField, ContextDelta, RepeaterStorage
+
+DUPLICATE_KEY_ERROR = 11000
+# 写回学习内容时每个阶段的重试次数和初始间隔 ( 秒 )
+PHASE_RETRIES = 3
+PHASE_RETRY_DELAY = 0.5
+# 每个文档记住最近多少批写回的 flush_id；同一批重试之前，其他进程写入的批次不会超过这个数
+FLUSH_MARKS = 32
+
+
+class MongoStorage(RepeaterStorage):
+    """
+    MongoDB 存储，answer 内嵌在 context 文档中，或 split 时存到单独的 context_answer 集合
+
+    answer 的消息去重后按次数保存，新的消息先带着 key 追加再按 key 排序截断，不需要读取文档就能限制条数
+    """
+
+    transient_errors = (ConnectionFailure,)
+
+    def __init__(self, split: bool = False, samples_limit: int = 0) -> None:
+        self.split_answers = split
+        self.samples_limit = samples_limit
+
+    @override
+    async def find_context(self, keywords: str) -> Context | None:
+        return await Context.find_one(Context.keywords == keywords)
+
+    @override
+    async def find_answers(self, keywords: str, count_threshold: int) -> list[Answer]:
+        cursor = ContextAnswer.get_motor_collection().find(
+            {"context": keywords, "count": {"$gte": count_threshold}},
+            {"_id": 0, "context": 0},
+        )
+        return [Answer(**doc) async for doc in cursor]
+
+    @override
+    async def apply_deltas(self, pending: dict[str, ContextDelta], flush_id: str) -> None:
+        if self.split_answers:
+            await self._apply_split(pending, flush_id)
+            return
+
+        context_upserts = []
+        answer_inserts = []
+        sample_inserts = []
+        count_updates = []
+        for keywords, delta in pending.items():
+            context_upserts.append(self._context_upsert(keywords, delta))
+            inc = {"count": delta.count}
+            latest = {}
+            array_filters = []
+            for index, ((group_id, answer_keywords), answer_delta) in enumerate(delta.answers.items()):
+                answer_filter = {"group_id": group_id, "keywords": answer_keywords}
+                # 没有对应的 answer 时，先追加一个空的，再统一 $inc
+                placeholder = Answer(
+                    keywords=answer_keywords,
+                    group_id=group_id,
+                    count=0,
+                    time=answer_delta.time,
+                    samples=[Sample(message=answer_delta.sample)] if answer_delta.sample is not None else [],
+                )
+                answer_inserts.append(
+                    UpdateOne(
+                        {"keywords": keywords, "answers": {"$not": {"$elemMatch": answer_filter}}},
+                        {"$push": {"answers": placeholder.model_dump()}},
+                    )
+                )
+                sample_inserts.extend(
+                    UpdateOne(
+                        {"keywords": keywords},
+                        {"$push": {"answers.$[a].samples": self._sample_push(message)}},
+                        array_filters=[
+                            {
+                                "a.group_id": group_id,
+                                "a.keywords": answer_keywords,
+                                "a.samples.message": {"$ne": message},
+                            }
+                        ],
+                    )
+                    for message in answer_delta.messages
+                )
+
+                # 同一个 Context 的所有次数合并成一个更新，整个文档只需要一个批次标记
+                answer = f"a{index}"
+                inc[f"answers.$[{answer}].count"] = answer_delta.count
+                latest[f"answers.$[{answer}].time"] = answer_delta.time
+                array_filters.append({f"{answer}.group_id": group_id, f"{answer}.keywords": answer_keywords})
+                for sample_index, (message, count) in enumerate(answer_delta.messages.items()):
+                    sample = f"{answer}s{sample_index}"
+                    inc[f"answers.$[{answer}].samples.$[{sample}].count"] = count
+                    array_filters.append({f"{sample}.message": message})
+            count_updates.append(
+                self._count_update({"keywords": keywords}, flush_id, {"$inc": inc, "$max": latest}, array_filters)
+            )
+
+        collection = Context.get_motor_collection()
+        await self._write_phases([
+            (collection, context_upserts),
+            (collection, answer_inserts),
+            (collection, sample_inserts),
+            (collection, count_updates),
+        ])
+
+    async def _apply_split(self, pending: dict[str, ContextDelta], flush_id: str) -> None:
+        context_upserts = []
+        context_counts = []
+        answer_upserts = []
+        sample_inserts = []
+        answer_counts = []
+        for keywords, delta in pending.items():
+            context_upserts.append(self._context_upsert(keywords, delta))
+            context_counts.append(
+                self._count_update({"keywords": keywords}, flush_id, {"$inc": {"count": delta.count}})
+            )
+            for (group_id, answer_keywords), answer_delta in delta.answers.items():
+                answer_filter = {"context": keywords, "group_id": group_id, "keywords": answer_keywords}
+                samples = [Sample(message=answer_delta.sample).model_dump()] if answer_delta.sample is not None else []
+                answer_upserts.append(
+                    UpdateOne(
+                        answer_filter,
+                        {"$max": {"time": answer_delta.time}, "$setOnInsert": {"count": 0, "samples": samples}},
+                        upsert=True,
+                    )
+                )
+
+                inc = {"count": answer_delta.count}
+                array_filters = []
+                for index, (message, count) in enumerate(answer_delta.messages.items()):
+                    sample_inserts.append(
+                        UpdateOne(
+                            {**answer_filter, "samples.message": {"$ne": message}},
+                            {"$push": {"samples": self._sample_push(message)}},
+                        )
+                    )
+                    inc[f"samples.$[s{index}].count"] = count
+                    array_filters.append({f"s{index}.message": message})
+                answer_counts.append(self._count_update(answer_filter, flush_id, {"$inc": inc}, array_filters))
+
+        context_collection = Context.get_motor_collection()
+        answer_collection = ContextAnswer.get_motor_collection()
+        await self._write_phases([
+            (context_collection, context_upserts),
+            (answer_collection, answer_upserts),
+            (answer_collection, sample_inserts),
+            (context_collection, context_counts),
+            (answer_collection, answer_counts),
+        ])
+
+    async def _write_phases(self, phases: list[tuple[AsyncIOMotorCollection, list[UpdateOne]]]) -> None:
+        """
+        按顺序执行各个阶段，阶段之间有先后依赖，阶段内部互不相关，可以乱序执行
+
+        前面的阶段只新建文档、追加 answer 和消息，重复执行结果不变；累加次数的阶段带着批次标记，
+        所以任何一个阶段失败后，整批用同一个 flush_id 重新写入都不会重复累加
+        """
+
+        for collection, requests in phases:
+            if requests:
+                await self._bulk_write(collection, requests)
+
+    @staticmethod
+    async def _bulk_write(collection: AsyncIOMotorCollection, requests: list[UpdateOne]) -> None:
+        for attempt in range(PHASE_RETRIES):
+            last = attempt == PHASE_RETRIES - 1
+            try:
+                await collection.bulk_write(requests, ordered=False)
+                return
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                if last:
+                    raise
+                if errors:
+                    # 其他请求已经写入，只重试失败的
+                    requests = [requests[error["index"]] for error in errors]
+                    # 并发 upsert 同一个文档时后插入的一方报重复键，立即重试，这次会作为更新执行
+                    if all(error.get("code") == DUPLICATE_KEY_ERROR for error in errors):
+                        continue
+            except ConnectionFailure:
+                # 连接断开时不知道写入了多少，所有请求都可以安全地重新执行
+                if last:
+                    raise
+            await asyncio.sleep(PHASE_RETRY_DELAY * 2**attempt)
+
+    def _sample_push(self, message: str) -> dict:
+        # 追加一条次数为 0 的消息，超过上限时只保留 key 最小的，之后统一 $inc
+        push = {"$each": [Sample(message=message, count=0).model_dump()], "$sort": {"key": 1}}
+        if self.samples_limit:
+            push["$slice"] = self.samples_limit
+        return push
+
+    @staticmethod
+    def _context_upsert(keywords: str, delta: ContextDelta) -> UpdateOne:
+        # 次数由带批次标记的 _count_update 累加，这里重复执行也没关系
+        return UpdateOne(
+            {"keywords": keywords},
+            {
+                "$max": {"time": delta.time},
+                "$setOnInsert": {"count": 0, "answers": [], "ban": [], "clear_time": 0},
+            },
+            upsert=True,
+        )
+
+    @staticmethod
+    def _count_update(query: dict, flush_id: str, update: dict, array_filters: list[dict] | None = None) -> UpdateOne:
+        """
+        只在文档还没有记下这一批时累加，并把 flush_id 记到 flushes 中 ( 只保留最近 FLUSH_MARKS 个 )
+        """
+
+        return UpdateOne(
+            {**query, "flushes": {"$ne": flush_id}},
+            {**update, "$push": {"flushes": {"$each": [flush_id], "$slice": -FLUSH_MARKS}}},
+            array_filters=array_filters or None,
+        )
+
+    @override
+    async def push_ban(self, keywords: str, ban: Ban, cross_group_threshold: int) -> list[str] | None:
+        collection = Context.get_motor_collection()
+        doc = await collection.find_one_and_update(
+            {"keywords": keywords},
+            {"$push": {"ban": ban.model_dump()}},
+            projection={"ban": 1, "cross_group_ban": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is None:
+            return None
+
+        # ban 只增不减，用 $addToSet 合并，同时 ban 同一个 context 时不会互相覆盖
+        stored = set(doc.get("cross_group_ban", []))
+        cross_group_ban = ContextBans.cross_group_keywords([Ban(**item) for item in doc["ban"]], cross_group_threshold)
+        if not cross_group_ban <= stored:
+            await collection.update_one(
+                {"_id": doc["_id"]}, {"$addToSet": {"cross_group_ban": {"$each": sorted(cross_group_ban - stored)}}}
+            )
+        return sorted(stored | cross_group_ban)
+
+    @override
+    async def count_contexts(self) -> int:
+        return await Context.get_motor_collection().estimated_document_count()
+
+    @override
+    async def iter_context_keywords(self) -> AsyncIterator[str]:
+        cursor = Context.get_motor_collection().find({}, {"keywords": 1, "_id": 0}, batch_size=10000)
+        async for doc in cursor:
+            yield doc["keywords"]
+
+    @override
+    def prepare_messages(self, messages: list[ChatMessage]) -> list[MessageModel]:
+        # 客户端生成 _id，重试时已经写入的消息会报重复键，而不是写两遍
+        return [message.to_model() for message in messages]
+
+    @override
+    async def insert_messages(self, prepared: list[MessageModel]) -> None:
+        try:
+            await MessageModel.insert_many(prepared, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != DUPLICATE_KEY_ERROR for error in errors):
+                raise
+
+    @override
+    async def load_blacklists(self) -> list[tuple[int, list[str], list[str]]]:
+        return [(item.group_id, item.answers, item.answers_reserve) for item in await BlackList.find_all().to_list()]
+
+    @override
+    async def save_blacklist(self, group_id: int, field: BlacklistField, answers: list[str]) -> None:
+        await BlackList.find_one(BlackList.group_id == group_id).upsert(
+            {"$set": {field: answers}}, on_insert=BlackList(group_id=group_id, **{field: answers})
+        )
+
+    @override
+    async def clearup_step(self, state: dict, limit: int, answer_threshold: int) -> dict | None:
+        phase = state["phase"]
+        cur_time = state["cur_time"]
+        expiration = state["expiration"]
+        if phase == "delete":
+            collection = Context.get_motor_collection()
+            query = {"time": {"$lt": expiration}, "count": {"$lt": answer_threshold}}
+            next_phase = "answers" if self.split_answers else "prune"
+        elif phase == "answers":
+            collection = ContextAnswer.get_motor_collection()
+            query = {"count": {"$lte": 1}, "time": {"$lte": expiration}}
+            next_phase = None
+        else:
+            collection = Context.get_motor_collection()
+            query = {"$or": [{"count": {"$gt": 100}}, {"clear_time": {"$lt": expiration}}]}
+            next_phase = None
+
+        if state["last_id"] is not None:
+            query = {"$and": [query, {"_id": {"$gt": state["last_id"]}}]}
+        cursor = collection.find(query, {"_id": 1, "keywords": 1}).sort("_id", 1).limit(limit)
+        docs = await cursor.to_list(length=limit)
+        ids = [doc["_id"] for doc in docs]
+
+        if ids and phase == "delete":
+            if self.split_answers:
+                # 连同被删除的 Context 的 answer 一起删掉
+                await ContextAnswer.get_motor_collection().delete_many({
+                    "context": {"$in": [doc["keywords"] for doc in docs]}
+                })
+            await collection.delete_many({"_id": {"$in": ids}})
+        elif ids and phase == "answers":
+            await collection.delete_many({"_id": {"$in": ids}})
+        elif ids:
+            # 在数据库端用 $filter 过滤 answers，不把文档读进内存
+            await collection.update_many(
+                {"_id": {"$in": ids}},
+                [
+                    {
+                        "$set": {
+                            "answers": {
+                                "$filter": {
+                                    "input": "$answers",
+                                    "as": "answer",
+                                    "cond": {
+                                        "$or": [
+                                            {"$gt": ["$$answer.count", 1]},
+                                            {"$gt": ["$$answer.time", expiration]},
+                                        ]
+                                    },
+                                }
+                            },
+                            "clear_time": cur_time,
+                        }
+                    }
+                ],
+            )
+
+        done = state["done"] + len(ids)
+        if len(ids) >= limit:
+            return {**state, "last_id": ids[-1], "done": done}
+
+        logger.info(f"clearup context: {phase} finished, {done} documents")
+        if next_phase is None:
+            return None
+        return {**state, "phase": next_phase, "last_id": None, "done": 0}
+
+    @override
+    async def close(self) -> None:
+        # 连接由 init_db 创建，和其他插件共用
+        pass
@@ -0,0 +1,323 @@
+import asyncio
+import json
+import sqlite3
+from collections.abc import AsyncIterator, Callable
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TypeVar, get_args, override
+
+from nonebot import logger
+
+from src.common.db import Answer, Ban, Context, Sample, merge_samples
+
+from ..ban_index import ContextBans
+from ..message_buffer import ChatMessage
+from .base import BlacklistField, ContextDelta, RepeaterStorage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS context (
+    id INTEGER PRIMARY KEY,
+    keywords TEXT NOT NULL UNIQUE,
+    count INTEGER NOT NULL DEFAULT 0,
+    time INTEGER NOT NULL DEFAULT 0,
+    clear_time INTEGER NOT NULL DEFAULT 0,
+    ban TEXT NOT NULL DEFAULT '[]',
+    cross_group_ban TEXT NOT NULL DEFAULT '[]'
+);
+CREATE INDEX IF NOT EXISTS context_time_index ON context (time);
+
+CREATE TABLE IF NOT EXISTS context_answer (
+    id INTEGER PRIMARY KEY,
+    context TEXT NOT NULL,
+    group_id INTEGER NOT NULL,
+    keywords TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    time INTEGER NOT NULL DEFAULT 0,
+    samples TEXT NOT NULL DEFAULT '[]',
+    UNIQUE (context, group_id, keywords)
+);
+CREATE INDEX IF NOT EXISTS context_answer_count_index ON context_answer (context, count);
+CREATE INDEX IF NOT EXISTS context_answer_time_index ON context_answer (time);
+
+CREATE TABLE IF NOT EXISTS message (
+    id INTEGER PRIMARY KEY,
+    group_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    bot_id INTEGER NOT NULL,
+    raw_message TEXT NOT NULL,
+    is_plain_text INTEGER NOT NULL,
+    plain_text TEXT NOT NULL,
+    keywords TEXT NOT NULL,
+    time INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS message_time_index ON message (time);
+
+CREATE TABLE IF NOT EXISTS blacklist (
+    group_id INTEGER PRIMARY KEY,
+    answers TEXT NOT NULL DEFAULT '[]',
+    answers_reserve TEXT NOT NULL DEFAULT '[]'
+);
+"""
+
+UPSERT_CONTEXT = """
+INSERT INTO context (keywords, count, time) VALUES (?, ?, ?)
+ON CONFLICT (keywords) DO UPDATE SET count = count + excluded.count, time = max(time, excluded.time)
+"""
+
+UPSERT_ANSWER = """
+INSERT INTO context_answer (context, group_id, keywords, count, time, samples) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (context, group_id, keywords) DO UPDATE SET count = count + excluded.count, time = max(time, excluded.time)
+RETURNING id, samples
+"""
+
+T = TypeVar("T")
+
+
+def dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class SQLiteStorage(RepeaterStorage):
+    """
+    嵌入式的 SQLite 存储 ( WAL 模式 )，不需要单独部署数据库，查询没有网络往返
+
+    所有操作都在同一个线程中用同一个连接执行，answer 总是单独存放，相当于 split 模式
+
+    一个 answer 只会由负责该群的进程写入，合并消息时在事务中读出 samples 修改后写回
+    """
+
+    split_answers = True
+    transient_errors = (sqlite3.OperationalError,)  # 多进程同时写时可能遇到 database is locked
+
+    def __init__(self, path: str, samples_limit: int = 0, busy_timeout: float = 5.0) -> None:
+        self._path = path
+        self.samples_limit = samples_limit
+        self._busy_timeout = busy_timeout
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="repeater-sqlite")
+        self._conn: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            Path(self._path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self._path, timeout=self._busy_timeout, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, func: Callable[[sqlite3.Connection], T]) -> T:
+        def call() -> T:
+            return func(self._connect())
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    @override
+    async def find_context(self, keywords: str) -> Context | None:
+        def query(conn: sqlite3.Connection):
+            return conn.execute(
+                "SELECT count, time, clear_time, ban, cross_group_ban FROM context WHERE keywords = ?", (keywords,)
+            ).fetchone()
+
+        row = await self._run(query)
+        if row is None:
+            return None
+        count, time, clear_time, ban, cross_group_ban = row
+        return Context(
+            keywords=keywords,
+            trigger_count=count,
+            time=time,
+            clear_time=clear_time,
+            ban=[Ban(**item) for item in json.loads(ban)],
+            cross_group_ban=json.loads(cross_group_ban),
+        )
+
+    @override
+    async def find_answers(self, keywords: str, count_threshold: int) -> list[Answer]:
+        def query(conn: sqlite3.Connection):
+            return conn.execute(
+                "SELECT group_id, keywords, count, time, samples FROM context_answer WHERE context = ? AND count >= ?",
+                (keywords, count_threshold),
+            ).fetchall()
+
+        return [
+            Answer(group_id=group_id, keywords=answer_keywords, count=count, time=time, samples=json.loads(samples))
+            for group_id, answer_keywords, count, time, samples in await self._run(query)
+        ]
+
+    @override
+    async def apply_deltas(self, pending: dict[str, ContextDelta], flush_id: str) -> None:
+        # 整批在一个事务里，失败时全部回滚，重新写入时不需要 flush_id 去重
+        contexts = []
+        answers = []
+        for keywords, delta in pending.items():
+            contexts.append((keywords, delta.count, delta.time))
+            for (group_id, answer_keywords), answer_delta in delta.answers.items():
+                samples = [Sample(message=answer_delta.sample).model_dump()] if answer_delta.sample is not None else []
+                answers.append((
+                    (keywords, group_id, answer_keywords, answer_delta.count, answer_delta.time, dumps(samples)),
+                    answer_delta.messages,
+                ))
+
+        def write(conn: sqlite3.Connection) -> None:
+            with conn:
+                conn.executemany(UPSERT_CONTEXT, contexts)
+                for params, messages in answers:
+                    answer_id, samples = conn.execute(UPSERT_ANSWER, params).fetchone()
+                    if not messages:
+                        continue
+                    samples = [Sample(**item) for item in json.loads(samples)]
+                    merge_samples(samples, messages, self.samples_limit)
+                    conn.execute(
+                        "UPDATE context_answer SET samples = ? WHERE id = ?",
+                        (dumps([sample.model_dump() for sample in samples]), answer_id),
+                    )
+
+        await self._run(write)
+
+    @override
+    async def push_ban(self, keywords: str, ban: Ban, cross_group_threshold: int) -> list[str] | None:
+        def update(conn: sqlite3.Connection) -> list[str] | None:
+            with conn:
+                row = conn.execute("SELECT id, ban FROM context WHERE keywords = ?", (keywords,)).fetchone()
+                if row is None:
+                    return None
+                context_id, bans = row
+                bans = [*json.loads(bans), ban.model_dump()]
+                cross_group_ban = sorted(
+                    ContextBans.cross_group_keywords([Ban(**item) for item in bans], cross_group_threshold)
+                )
+                conn.execute(
+                    "UPDATE context SET ban = ?, cross_group_ban = ? WHERE id = ?",
+                    (dumps(bans), dumps(cross_group_ban), context_id),
+                )
+                return cross_group_ban
+
+        return await self._run(update)
+
+    @override
+    async def count_contexts(self) -> int:
+        return await self._run(lambda conn: conn.execute("SELECT count(*) FROM context").fetchone()[0])
+
+    @override
+    async def iter_context_keywords(self, batch_size: int = 10000) -> AsyncIterator[str]:
+        last_id = 0
+        while True:
+
+            def query(conn: sqlite3.Connection, last_id=last_id):
+                return conn.execute(
+                    "SELECT id, keywords FROM context WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size)
+                ).fetchall()
+
+            rows = await self._run(query)
+            for _, keywords in rows:
+                yield keywords
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    @override
+    def prepare_messages(self, messages: list[ChatMessage]) -> list[tuple]:
+        return [
+            (
+                message.group_id,
+                message.user_id,
+                message.bot_id,
+                message.raw_message,
+                message.is_plain_text,
+                message.plain_text,
+                message.keywords,
+                message.time,
+            )
+            for message in messages
+        ]
+
+    @override
+    async def insert_messages(self, prepared: list[tuple]) -> None:
+        def write(conn: sqlite3.Connection) -> None:
+            # 整批在一个事务里，失败时全部回滚，重试不会写两遍
+            with conn:
+                conn.executemany(
+                    "INSERT INTO message (group_id, user_id, bot_id, raw_message, is_plain_text, plain_text, keywords,"
+                    " time) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    prepared,
+                )
+
+        await self._run(write)
+
+    @override
+    async def load_blacklists(self) -> list[tuple[int, list[str], list[str]]]:
+        rows = await self._run(
+            lambda conn: conn.execute("SELECT group_id, answers, answers_reserve FROM blacklist").fetchall()
+        )
+        return [(group_id, json.loads(answers), json.loads(reserve)) for group_id, answers, reserve in rows]
+
+    @override
+    async def save_blacklist(self, group_id: int, field: BlacklistField, answers: list[str]) -> None:
+        # 列名只能拼接进 SQL，不能作为参数绑定
+        if field not in get_args(BlacklistField):
+            raise ValueError(f"unknown blacklist field: {field!r}")
+
+        def write(conn: sqlite3.Connection) -> None:
+            with conn:
+                conn.execute(
+                    f"INSERT INTO blacklist (group_id, {field}) VALUES (?, ?)"
+                    f" ON CONFLICT (group_id) DO UPDATE SET {field} = excluded.{field}",
+                    (group_id, dumps(answers)),
+                )
+
+        await self._run(write)
+
+    @override
+    async def clearup_step(self, state: dict, limit: int, answer_threshold: int) -> dict | None:
+        phase = state["phase"]
+        expiration = state["expiration"]
+        last_id = state["last_id"] or 0
+
+        def delete_contexts(conn: sqlite3.Connection) -> list[int]:
+            with conn:
+                rows = conn.execute(
+                    "SELECT id, keywords FROM context WHERE id > ? AND time < ? AND count < ? ORDER BY id LIMIT ?",
+                    (last_id, expiration, answer_threshold, limit),
+                ).fetchall()
+                # 连同被删除的 Context 的 answer 一起删掉
+                conn.executemany("DELETE FROM context_answer WHERE context = ?", [(keywords,) for _, keywords in rows])
+                conn.executemany("DELETE FROM context WHERE id = ?", [(row_id,) for row_id, _ in rows])
+            return [row_id for row_id, _ in rows]
+
+        def delete_answers(conn: sqlite3.Connection) -> list[int]:
+            with conn:
+                ids = [
+                    row_id
+                    for (row_id,) in conn.execute(
+                        "SELECT id FROM context_answer WHERE id > ? AND count <= 1 AND time <= ? ORDER BY id LIMIT ?",
+                        (last_id, expiration, limit),
+                    )
+                ]
+                conn.executemany("DELETE FROM context_answer WHERE id = ?", [(row_id,) for row_id in ids])
+            return ids
+
+        if phase == "delete":
+            ids = await self._run(delete_contexts)
+            next_phase = "answers"
+        else:
+            ids = await self._run(delete_answers)
+            next_phase = None
+
+        done = state["done"] + len(ids)
+        if len(ids) >= limit:
+            return {**state, "last_id": ids[-1], "done": done}
+
+        logger.info(f"clearup context: {phase} finished, {done} rows")
+        if next_phase is None:
+            return None
+        return {**state, "phase": next_phase, "last_id": None, "done": 0}
+
+    @override
+    async def close(self) -> None:
+        def close(conn: sqlite3.Connection) -> None:
+            conn.close()
+            self._conn = None
+
+        if self._conn is not None:
+            await self._run(close)
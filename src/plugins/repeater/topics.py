@@ -0,0 +1,85 @@
+import math
+from collections import deque
+from collections.abc import Iterable
+
+# 指数超过这个值时重新选取时间原点，避免浮点数溢出
+MAX_EXPONENT = 500
+
+
+class TopicWindow:
+    """
+    群里最近出现的关键词的滑动窗口，追加、淘汰、查询频率都是 O(1)
+
+    half_life 大于 0 时按时间衰减，一个关键词的权重为窗口中每次出现的 0.5 ^ ( 经过的时间 / half_life ) 之和；
+    每次出现记录 e ^ ( λ · ( t - 原点 ) )，查询时整体乘上 e ^ ( -λ · ( now - 原点 ) )，不需要遍历窗口
+    """
+
+    __slots__ = ("_capacity", "_counts", "_decay", "_items", "_origin", "_sums")
+
+    def __init__(self, capacity: int, half_life: float = 0) -> None:
+        self._capacity = max(capacity, 1)
+        self._decay = math.log(2) / half_life if half_life > 0 else 0.0
+        self._items: deque[tuple[str, float]] = deque()
+        self._counts: dict[str, int] = {}
+        self._sums: dict[str, float] = {}
+        self._origin: float | None = None
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, keyword: str) -> bool:
+        return keyword in self._counts
+
+    def count(self, keyword: str) -> int:
+        return self._counts.get(keyword, 0)
+
+    def weight(self, keyword: str, now: float) -> float:
+        """
+        关键词在窗口中的权重，不衰减时就是出现次数
+        """
+
+        if not self._decay:
+            return self._counts.get(keyword, 0)
+        total = self._sums.get(keyword)
+        if not total:
+            return 0.0
+        return total * math.exp(-self._decay * (now - self._origin))
+
+    def push(self, keyword: str, now: float) -> None:
+        if len(self._items) >= self._capacity:
+            self._evict()
+
+        stamp = self._stamp(now)
+        self._items.append((keyword, stamp))
+        self._counts[keyword] = self._counts.get(keyword, 0) + 1
+        self._sums[keyword] = self._sums.get(keyword, 0.0) + stamp
+
+    def extend(self, keywords: Iterable[str], now: float) -> None:
+        for keyword in keywords:
+            self.push(keyword, now)
+
+    def _evict(self) -> None:
+        keyword, stamp = self._items.popleft()
+        count = self._counts[keyword] - 1
+        if count:
+            self._counts[keyword] = count
+            self._sums[keyword] -= stamp
+        else:
+            # 最后一次出现被淘汰时直接删除，不留下浮点误差
+            del self._counts[keyword]
+            del self._sums[keyword]
+
+    def _stamp(self, now: float) -> float:
+        if not self._decay:
+            return 1.0
+        if self._origin is None:
+            self._origin = now
+        exponent = self._decay * (now - self._origin)
+        if exponent > MAX_EXPONENT:
+            # 很少发生，整体缩放一次
+            factor = math.exp(-exponent)
+            self._items = deque((keyword, stamp * factor) for keyword, stamp in self._items)
+            self._sums = {keyword: total * factor for keyword, total in self._sums.items()}
+            self._origin = now
+            exponent = 0.0
+        return math.exp(exponent)
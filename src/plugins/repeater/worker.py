@@ -0,0 +1,144 @@
+import asyncio
+import contextlib
+import sys
+from pathlib import Path
+
+from nonebot import get_driver, logger
+
+from src.common.config import BotConfig
+from src.common.db import init_db
+from src.common.utils.locks import lock_stats
+
+from .model import Chat, ChatData, keywords_extractor
+from .sharding import read_frame, write_frame
+
+
+class Worker:
+    """
+    多进程模式下的 worker，负责一部分群的学习和回复
+    """
+
+    def __init__(self, index: int, path: str) -> None:
+        self.index = index
+        self._path = path
+        self._stopped = asyncio.Event()
+        self._tasks: set[asyncio.Task] = set()
+
+    async def run(self) -> None:
+        config = get_driver().config
+        await init_db(config.mongo_host, config.mongo_port)
+
+        # 每个 worker 只保存自己负责的群的回复记录
+        if Chat.REPLY_HISTORY_SNAPSHOT:
+            snapshot = Path(Chat.REPLY_HISTORY_SNAPSHOT)
+            Chat.REPLY_HISTORY_SNAPSHOT = str(snapshot.with_name(f"{snapshot.stem}.{self.index}{snapshot.suffix}"))
+
+        await Chat.update_global_blacklist()
+        Chat.load_reply_history()
+        self._spawn(Chat.build_context_filter())
+        self._spawn(self._flush_loop())
+
+        server = await asyncio.start_unix_server(self._handle, path=self._path)
+        logger.info(f"repeater worker [{self.index}] listening on {self._path}")
+        await self._stopped.wait()
+        server.close()
+        await asyncio.to_thread(Path(self._path).unlink, missing_ok=True)
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _flush_loop() -> None:
+        while True:
+            await asyncio.sleep(Chat.CONTEXT_FLUSH_INTERVAL)
+            await Chat.flush_context()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_id, op, args = await read_frame(reader)
+                self._spawn(self._dispatch(writer, request_id, op, args))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    async def _dispatch(self, writer: asyncio.StreamWriter, request_id: int, op: str, args: tuple) -> None:
+        try:
+            result = await getattr(self, f"_op_{op}")(*args)
+        except Exception as e:
+            logger.exception(f"repeater worker [{self.index}] {op} failed")
+            response = (request_id, False, repr(e))
+        else:
+            response = (request_id, True, result)
+
+        with contextlib.suppress(ConnectionError):
+            write_frame(writer, response)
+            await writer.drain()
+        # 回复了 close 之后再退出，NoneBot 进程知道数据已经写完了
+        if op == "close":
+            self._stopped.set()
+
+    @staticmethod
+    async def _op_chat(data: dict, drunkenness: int, answer: bool, learn: bool) -> list[str] | None:
+        chat = Chat(ChatData(**data))
+        await BotConfig(data["bot_id"], data["group_id"]).set_drunkenness(drunkenness)
+
+        answers = None
+        if answer:
+            answer_generator = await chat.answer()
+            if answer_generator:
+                answers = [str(item) async for item in answer_generator]
+        if learn:
+            await chat.learn()
+        return answers
+
+    @staticmethod
+    async def _op_post_proc(raw_message: str, new_msg: str, bot_id: int, group_id: int) -> bool:
+        return await Chat.reply_post_proc(raw_message, new_msg, bot_id, group_id)
+
+    @staticmethod
+    async def _op_ban(group_id: int, bot_id: int, ban_raw_message: str, reason: str) -> bool:
+        return await Chat.ban(group_id, bot_id, ban_raw_message, reason)
+
+    @staticmethod
+    async def _op_speak():
+        ret = await Chat.speak()
+        if not ret:
+            return None
+        bot_id, group_id, messages, target_id = ret
+        return bot_id, group_id, [str(msg) for msg in messages], target_id
+
+    @staticmethod
+    async def _op_random_messages():
+        return await Chat.get_random_message_from_each_group()
+
+    @staticmethod
+    async def _op_clearup(done: bool) -> None:
+        # 清理在 router 进程中进行，开始前把学到的内容写回，结束后再写回一次，
+        # 丢掉缓存中可能已被清理的文档，并重建过滤器
+        if done:
+            await Chat.flush_context()
+            await Chat.build_context_filter()
+        else:
+            await Chat.sync()
+        Chat.clear_context_cache()
+
+    @staticmethod
+    async def _op_stats() -> None:
+        logger.info(f"context cache stats: {Chat.context_cache_stats()}")
+        logger.info(f"message writer stats: {Chat.message_writer_stats()}")
+        logger.info(f"lock wait stats: {lock_stats()}")
+
+    async def _op_close(self) -> None:
+        current = asyncio.current_task()
+        for task in self._tasks:
+            if task is not current:
+                task.cancel()
+        await Chat.close()
+        keywords_extractor.shutdown()
+
+
+def main() -> None:
+    index, path = int(sys.argv[1]), sys.argv[2]
+    asyncio.run(Worker(index, path).run())
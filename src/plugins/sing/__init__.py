@@ -9,7 +9,7 @@ from ulid import ULID
 
 from src.common.config import GroupConfig, TaskManager
 from src.common.db import SingProgress
-from src.common.utils import HTTPXClient
+from src.common.utils import HostOptions, HTTPXClient
 
 from .config import Config
 from .ncm import get_song_id, get_song_title
@@ -17,6 +17,10 @@ from .ncm import get_song_id, get_song_title
 plugin_config = get_plugin_config(Config)
 
 SERVER_URL = f"http://{plugin_config.ai_server_host}:{plugin_config.ai_server_port}"
+HTTPXClient.configure_host(
+    SERVER_URL,
+    HostOptions(http2=plugin_config.ai_server_http2, concurrency=plugin_config.ai_server_concurrency),
+)
 
 SPEAKERS = plugin_config.sing_speakers.keys()
 SING_CMD = "唱歌"
@@ -4,6 +4,10 @@ from pydantic import BaseModel
 class Config(BaseModel, extra="ignore"):
     ai_server_host: str = "127.0.0.1"
     ai_server_port: int = 9099
+    # 同时向 AI Server 发出的请求数上限，0 为不限
+    ai_server_concurrency: int = 0
+    # 与 AI Server 之间使用 HTTP/2，需要安装 h2
+    ai_server_http2: bool = False
     sing_enable: bool = False
     sing_endpoint: str = "/api/sing"
     play_endpoint: str = "/api/play"
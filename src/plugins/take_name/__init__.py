@@ -9,13 +9,17 @@ from nonebot.rule import Rule
 from src.common.config import BotConfig
 from src.common.utils import is_bot_admin
 from src.plugins.repeater.model import Chat
+from src.plugins.repeater.sharding import router
 
 change_name_sched = require("nonebot_plugin_apscheduler").scheduler
 
 
 @change_name_sched.scheduled_job("cron", minute="*/1")
 async def change_name():
-    rand_messages = await Chat.get_random_message_from_each_group()
+    if router is not None:
+        rand_messages = await router.get_random_message_from_each_group()
+    else:
+        rand_messages = await Chat.get_random_message_from_each_group()
     if not rand_messages:
         return
 
@@ -23,12 +27,12 @@ async def change_name():
         if random.random() > 0.002:  # 期望约每8个多小时改一次
             continue
 
-        bot_id = target_msg["bot_id"]
+        bot_id = target_msg.bot_id
         config = BotConfig(bot_id, group_id)
         if await config.is_sleep():
             continue
 
-        target_user_id = target_msg["user_id"]
+        target_user_id = target_msg.user_id
         logger.info(f"bot [{bot_id}] ready to change name by using [{target_user_id}] in group [{group_id}]")
 
         bot = get_bot(str(bot_id))
@@ -0,0 +1,60 @@
+from pymongo.errors import AutoReconnect
+
+from src.common.utils.dedup import MessageDedup
+
+
+class FakeStore:
+    def __init__(self, claimed: set | None = None, error: Exception | None = None) -> None:
+        self.claimed = claimed if claimed is not None else set()
+        self.error = error
+
+    async def claim(self, name: str, group_id: int, message_id: int, ttl: float) -> bool:
+        if self.error is not None:
+            raise self.error
+        if (group_id, message_id) in self.claimed:
+            return False
+        self.claimed.add((group_id, message_id))
+        return True
+
+
+def test_seen_locally_per_group():
+    dedup = MessageDedup("test")
+
+    assert not dedup.seen_locally(1, 100, now=0)
+    assert dedup.seen_locally(1, 100, now=1)
+    assert not dedup.seen_locally(2, 100, now=1)
+    assert dedup.stats()["duplicates"] == 1
+
+
+def test_seen_locally_expires():
+    dedup = MessageDedup("test", ttl=10)
+
+    assert not dedup.seen_locally(1, 100, now=0)
+    assert not dedup.seen_locally(1, 100, now=11)
+
+
+def test_seen_locally_capacity():
+    dedup = MessageDedup("test", capacity=2)
+    for message_id in range(3):
+        dedup.seen_locally(1, message_id, now=0)
+
+    assert not dedup.seen_locally(1, 0, now=0)
+    assert dedup.stats()["tracked"] == 2
+
+
+async def test_first_seen_shared_between_processes():
+    store = FakeStore()
+    first = MessageDedup("test", store=store)
+    second = MessageDedup("test", store=store)
+
+    assert await first.first_seen(1, 100)
+    assert not await second.first_seen(1, 100)
+    assert second.stats()["shared_duplicates"] == 1
+
+
+async def test_first_seen_falls_back_when_store_fails():
+    dedup = MessageDedup("test", store=FakeStore(error=AutoReconnect("down")))
+
+    assert await dedup.first_seen(1, 100)
+    assert not await dedup.first_seen(1, 100)
+    assert dedup.stats()["store_errors"] == 1
@@ -0,0 +1,43 @@
+import asyncio
+
+from src.common.utils.locks import StripedLock, lock_stats
+
+
+async def test_same_key_is_serialized():
+    lock = StripedLock("test.same_key", stripes=4)
+    order = []
+
+    async def work(tag: str) -> None:
+        async with lock(1):
+            order.append(f"{tag} start")
+            await asyncio.sleep(0.01)
+            order.append(f"{tag} end")
+
+    await asyncio.gather(work("a"), work("b"))
+
+    assert order == ["a start", "a end", "b start", "b end"]
+    assert lock.stats()["acquisitions"] == 2
+    assert lock.stats()["contended"] == 1
+
+
+async def test_different_stripes_do_not_wait():
+    lock = StripedLock("test.different_keys", stripes=4)
+    entered = asyncio.Event()
+
+    async def hold() -> None:
+        async with lock(0):
+            await entered.wait()
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    async with asyncio.timeout(1), lock(1):
+        entered.set()
+    await holder
+
+    assert lock.stats()["contended"] == 0
+
+
+def test_registered_in_lock_stats():
+    StripedLock("test.registry")
+
+    assert "test.registry" in lock_stats()
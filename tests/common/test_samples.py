@@ -0,0 +1,58 @@
+from collections import Counter
+
+from src.common.db import Answer, Sample, merge_samples, sample_key
+
+
+def test_sample_key_is_stable_and_fits_int64():
+    assert sample_key("牛牛喝酒") == sample_key("牛牛喝酒")
+    assert sample_key("牛牛喝酒") != sample_key("牛牛唱歌")
+    assert 0 <= sample_key("牛牛喝酒") < 2**63
+
+
+def test_merge_samples_adds_counts():
+    samples = [Sample(message="a", count=2)]
+    merge_samples(samples, {"a": 3, "b": 1})
+
+    assert {sample.message: sample.count for sample in samples} == {"a": 5, "b": 1}
+    assert [sample.key for sample in samples] == sorted(sample.key for sample in samples)
+
+
+def test_merge_samples_keeps_lowest_keys():
+    messages = [f"message {i}" for i in range(100)]
+    samples = []
+    for message in messages:
+        merge_samples(samples, {message: 1}, limit=10)
+
+    expected = sorted(messages, key=sample_key)[:10]
+    assert [sample.message for sample in samples] == expected
+
+
+def test_merge_samples_order_does_not_matter():
+    messages = [f"message {i}" for i in range(50)]
+    forward = []
+    merge_samples(forward, Counter(messages), limit=8)
+    backward = []
+    for message in reversed(messages):
+        merge_samples(backward, {message: 1}, limit=8)
+
+    assert [sample.message for sample in forward] == [sample.message for sample in backward]
+
+
+def test_merge_samples_keeps_existing_counts_when_full():
+    samples = []
+    merge_samples(samples, Counter(f"message {i}" for i in range(20)), limit=5)
+    kept = samples[0].message
+    merge_samples(samples, {kept: 4}, limit=5)
+
+    assert len(samples) == 5
+    assert samples[0].message == kept
+    assert samples[0].count == 5
+
+
+def test_answer_merges_legacy_messages(monkeypatch):
+    monkeypatch.setattr(Answer, "SAMPLES_LIMIT", 2)
+    answer = Answer(keywords="b", group_id=1, messages=["x", "y", "x", "z"])
+
+    assert answer.messages == []
+    assert len(answer.samples) == 2
+    assert [sample.message for sample in answer.samples] == sorted(["x", "y", "z"], key=sample_key)[:2]
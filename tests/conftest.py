@@ -0,0 +1,52 @@
+import os
+import sys
+import types
+from pathlib import Path
+
+import nonebot
+import pytest
+from beanie import init_beanie
+
+ROOT = Path(__file__).parent.parent
+
+# 插件读取配置前需要先初始化 NoneBot
+nonebot.init()
+
+# 只测试复读机的内部模块，不执行插件的 __init__ ( 注册 matcher、配置图片缓存、启动后台任务等 )
+_repeater = types.ModuleType("src.plugins.repeater")
+_repeater.__path__ = [str(ROOT / "src" / "plugins" / "repeater")]
+sys.modules.setdefault("src.plugins.repeater", _repeater)
+
+from src.common.db import DOCUMENT_MODELS  # noqa: E402
+
+# 设置后存储后端的测试也在真实的 MongoDB 上跑一遍，如 mongodb://127.0.0.1:27017
+MONGO_URL = os.environ.get("PALLAS_TEST_MONGO")
+
+
+@pytest.fixture
+async def beanie_db():
+    """
+    构造 Document 需要先初始化 beanie；默认用内存中的 mongomock，不需要部署数据库
+    """
+
+    from mongomock_motor import AsyncMongoMockClient  # noqa: PLC0415
+
+    database = AsyncMongoMockClient()["PallasBotTest"]
+    await init_beanie(database=database, document_models=DOCUMENT_MODELS)
+    return database
+
+
+@pytest.fixture
+async def mongo_db():
+    if not MONGO_URL:
+        pytest.skip("PALLAS_TEST_MONGO is not set")
+
+    from motor.motor_asyncio import AsyncIOMotorClient  # noqa: PLC0415
+
+    client = AsyncIOMotorClient(MONGO_URL)
+    await client.drop_database("PallasBotTest")
+    database = client["PallasBotTest"]
+    await init_beanie(database=database, document_models=DOCUMENT_MODELS)
+    yield database
+    await client.drop_database("PallasBotTest")
+    client.close()
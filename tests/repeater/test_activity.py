@@ -0,0 +1,61 @@
+from src.plugins.repeater.activity import ActivityTracker
+from src.plugins.repeater.message_buffer import ChatMessage
+
+
+def message(group_id: int, user_id: int, time: int) -> ChatMessage:
+    return ChatMessage(group_id, user_id, 0, "hi", True, "hi", "hi", time)
+
+
+def feed(tracker: ActivityTracker, group_id: int, count: int, interval: int = 10, start: int = 0) -> int:
+    time = start
+    for i in range(count):
+        time = start + i * interval
+        tracker.record(message(group_id, i % 3, time))
+    return time
+
+
+def test_not_due_before_min_messages():
+    tracker = ActivityTracker(speak_threshold=5, basic_delay=0, min_messages=10)
+    feed(tracker, 1, 9)
+
+    assert tracker.pop_due(10**9) is None
+
+
+def test_due_after_quiet_period():
+    tracker = ActivityTracker(speak_threshold=5, basic_delay=100, min_messages=3, alpha=1)
+    last = feed(tracker, 1, 5, interval=10)
+    due = last + 10 * 5 + 100
+
+    assert tracker.pop_due(due - 1) is None
+    assert tracker.pop_due(due) == 1
+    # 弹出后直到有新消息都不会再被弹出
+    assert tracker.pop_due(due + 10**6) is None
+
+
+def test_new_message_invalidates_old_entry():
+    tracker = ActivityTracker(speak_threshold=5, basic_delay=100, min_messages=3, alpha=1)
+    last = feed(tracker, 1, 5, interval=10)
+    old_due = last + 150
+    tracker.record(message(1, 0, last + 10))
+
+    assert tracker.pop_due(old_due) is None
+    assert tracker.pop_due(old_due + 10) == 1
+
+
+def test_evicted_messages_leave_user_counts():
+    tracker = ActivityTracker(speak_threshold=5)
+    first = message(1, 42, 0)
+    tracker.record(first)
+    tracker.record(message(1, 7, 1), evicted=first)
+
+    activity = tracker.get(1)
+    assert activity.count == 1
+    assert dict(activity.user_counts) == {7: 1}
+    assert tracker.sample_user(1) == 7
+
+
+def test_heap_is_compacted():
+    tracker = ActivityTracker(speak_threshold=5, basic_delay=0, min_messages=1)
+    feed(tracker, 1, 1000, interval=1)
+
+    assert len(tracker._heap) <= 4 * 1 + 64
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from src.plugins.repeater.context_cache import ContextCache, ContextCacheOptions
+from src.plugins.repeater.message_buffer import ChatMessage
+from src.plugins.repeater.storage import SQLiteStorage
+
+
+class FlakyStorage(SQLiteStorage):
+    """
+    前 failures 次写回失败，记录每次写回用的 flush_id
+    """
+
+    def __init__(self, path: str, failures: int = 0) -> None:
+        super().__init__(path)
+        self.failures = failures
+        self.flush_ids: list[str] = []
+
+    async def apply_deltas(self, pending, flush_id):
+        self.flush_ids.append(flush_id)
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("storage is down")
+        await super().apply_deltas(pending, flush_id)
+
+
+def message(keywords: str, time: int = 100, raw_message: str | None = None) -> ChatMessage:
+    raw_message = raw_message or keywords
+    return ChatMessage(1, 2, 3, raw_message, True, raw_message, keywords, time)
+
+
+@pytest.fixture
+async def storage(beanie_db, tmp_path):
+    storage = FlakyStorage(str(tmp_path / "repeater.db"))
+    yield storage
+    await storage.close()
+
+
+async def test_learned_content_is_visible_before_flush(storage):
+    cache = ContextCache(storage, ContextCacheOptions())
+    cache.learn("a", message("b"))
+
+    context = await cache.get("a")
+    assert context.trigger_count == 1
+    [answer] = await cache.answers(context, 0)
+    assert (answer.keywords, answer.count) == ("b", 1)
+
+
+async def test_failed_flush_retries_same_batch(storage):
+    storage.failures = 1
+    cache = ContextCache(storage, ContextCacheOptions())
+    cache.learn("a", message("b", raw_message="hi"))
+    assert await cache.flush() == 0
+    assert cache.stats()["retrying"] == 1
+
+    # 失败期间学到的内容仍然可见
+    cache.learn("a", message("b", time=101, raw_message="hi"))
+    context = await cache.get("a")
+    assert context.trigger_count == 2
+
+    assert await cache.flush() == 2
+    first, retried, new = storage.flush_ids
+    assert first == retried
+    assert new != first
+
+    cache.clear()
+    context = await cache.get("a")
+    assert context.trigger_count == 2
+    [answer] = await cache.answers(context, 0)
+    assert answer.count == 2
+    assert [(sample.message, sample.count) for sample in answer.samples] == [("hi", 2)]
+
+
+async def test_ttl_reloads_what_other_processes_learned(storage):
+    options = ContextCacheOptions(ttl=0.05)
+    cache = ContextCache(storage, options)
+    other = ContextCache(storage, options)
+    cache.learn("a", message("b"))
+    await cache.flush()
+    assert (await cache.get("a")).trigger_count == 1
+
+    other.learn("a", message("b", time=101))
+    await other.flush()
+    assert (await cache.get("a")).trigger_count == 1
+
+    await asyncio.sleep(0.1)
+    assert (await cache.get("a")).trigger_count == 2
+    assert cache.stats()["expired"] == 1
+
+
+async def test_capacity_evicts_least_recently_used(storage):
+    cache = ContextCache(storage, ContextCacheOptions(capacity=2))
+    for keywords in ("a", "b", "c"):
+        cache.learn(keywords, message("x"))
+        await cache.get(keywords)
+
+    assert len(cache) == 2
+    await cache.flush()
+    assert (await cache.get("a")).trigger_count == 1
@@ -0,0 +1,41 @@
+from collections import Counter
+
+from src.plugins.repeater.storage import AnswerDelta, ContextDelta
+
+
+def delta(count: int, time: int, **answers: AnswerDelta) -> ContextDelta:
+    return ContextDelta(count=count, time=time, answers={(1, keywords): answer for keywords, answer in answers.items()})
+
+
+def test_merge_adds_counts_and_keeps_latest_time():
+    merged = delta(1, 100, a=AnswerDelta(count=1, time=100, messages=Counter({"hi": 1})))
+    merged.merge(delta(2, 90, a=AnswerDelta(count=2, time=90, messages=Counter({"hi": 1, "yo": 1}))))
+
+    assert merged.count == 3
+    assert merged.time == 100
+    answer = merged.answers[1, "a"]
+    assert answer.count == 3
+    assert answer.time == 100
+    assert answer.messages == Counter({"hi": 2, "yo": 1})
+
+
+def test_merge_adds_new_answers():
+    merged = delta(1, 100, a=AnswerDelta(count=1, time=100))
+    merged.merge(delta(1, 110, b=AnswerDelta(count=1, time=110)))
+
+    assert set(merged.answers) == {(1, "a"), (1, "b")}
+    assert merged.time == 110
+
+
+def test_merge_keeps_first_sample():
+    merged = delta(1, 100, a=AnswerDelta(count=1, time=100, sample="[CQ:image,file=1.image]"))
+    merged.merge(delta(1, 110, a=AnswerDelta(count=1, time=110, sample="[CQ:image,file=2.image]")))
+
+    assert merged.answers[1, "a"].sample == "[CQ:image,file=1.image]"
+
+
+def test_merge_fills_missing_sample():
+    merged = delta(1, 100, a=AnswerDelta(count=1, time=100))
+    merged.merge(delta(1, 110, a=AnswerDelta(count=1, time=110, sample="[CQ:face,id=1]")))
+
+    assert merged.answers[1, "a"].sample == "[CQ:face,id=1]"
@@ -0,0 +1,30 @@
+from collections import Counter
+
+from src.plugins.repeater.sharding import HashRing
+
+
+def test_same_group_same_node():
+    ring = HashRing(4)
+
+    assert all(ring.get(group_id) == ring.get(group_id) for group_id in range(1000))
+
+
+def test_distribution_is_roughly_even():
+    nodes = 4
+    groups = 10000
+    counts = Counter(HashRing(nodes).get(group_id) for group_id in range(groups))
+
+    assert set(counts) == set(range(nodes))
+    assert max(counts.values()) < groups / nodes * 1.5
+    assert min(counts.values()) > groups / nodes * 0.5
+
+
+def test_adding_a_node_moves_few_groups():
+    groups = range(10000)
+    before = HashRing(4)
+    after = HashRing(5)
+    moved = sum(before.get(group_id) != after.get(group_id) for group_id in groups)
+
+    # 理想情况下只有 1/5 的群换到新的 worker
+    assert moved < len(groups) * 0.35
+    assert all(after.get(group_id) == 4 for group_id in groups if before.get(group_id) != after.get(group_id))
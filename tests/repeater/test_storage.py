@@ -0,0 +1,191 @@
+"""
+存储后端的共同约定，SQLite 总是运行，MongoDB 需要设置 PALLAS_TEST_MONGO
+"""
+
+from collections import Counter
+
+import pytest
+
+from src.common.db import Answer, Ban
+from src.plugins.repeater.message_buffer import ChatMessage
+from src.plugins.repeater.storage import (
+    AnswerDelta,
+    ContextDelta,
+    MongoStorage,
+    RepeaterStorage,
+    SQLiteStorage,
+)
+
+
+@pytest.fixture(params=["sqlite", "mongo", "mongo-split"])
+def backend(request) -> str:
+    # SQLite 也需要 beanie 才能构造 Context
+    request.getfixturevalue("beanie_db" if request.param == "sqlite" else "mongo_db")
+    return request.param
+
+
+@pytest.fixture
+async def storage(backend, tmp_path):
+    if backend == "sqlite":
+        storage = SQLiteStorage(str(tmp_path / "repeater.db"), samples_limit=3)
+    else:
+        storage = MongoStorage(split=backend == "mongo-split", samples_limit=3)
+    yield storage
+    await storage.close()
+
+
+def learn(
+    keywords: str, answer: str, time: int = 100, group_id: int = 1, message: str | None = None
+) -> dict[str, ContextDelta]:
+    answer_delta = AnswerDelta(count=1, time=time)
+    answer_delta.messages[message or answer] += 1
+    return {keywords: ContextDelta(count=1, time=time, answers={(group_id, answer): answer_delta})}
+
+
+async def answers_of(storage: RepeaterStorage, keywords: str, count_threshold: int = 0) -> list[Answer]:
+    if storage.split_answers:
+        return await storage.find_answers(keywords, count_threshold)
+    context = await storage.find_context(keywords)
+    return [answer for answer in context.answers if answer.count >= count_threshold]
+
+
+async def test_apply_creates_context_and_answer(storage):
+    await storage.apply_deltas(learn("a", "b"), "flush-1")
+
+    context = await storage.find_context("a")
+    assert context.trigger_count == 1
+    assert context.time == 100
+    [answer] = await answers_of(storage, "a")
+    assert (answer.group_id, answer.keywords, answer.count) == (1, "b", 1)
+    assert [(sample.message, sample.count) for sample in answer.samples] == [("b", 1)]
+    assert await storage.find_context("missing") is None
+
+
+async def test_apply_accumulates(storage):
+    await storage.apply_deltas(learn("a", "b", time=100), "flush-1")
+    await storage.apply_deltas(learn("a", "b", time=90), "flush-2")
+    await storage.apply_deltas(learn("a", "c", time=120), "flush-3")
+
+    context = await storage.find_context("a")
+    assert context.trigger_count == 3
+    assert context.time == 120
+    answers = {answer.keywords: answer for answer in await answers_of(storage, "a")}
+    assert answers["b"].count == 2
+    assert answers["b"].time == 100
+    assert answers["b"].samples[0].count == 2
+    assert answers["c"].count == 1
+
+
+async def test_find_answers_threshold(storage):
+    for flush_id in ("flush-1", "flush-2"):
+        await storage.apply_deltas(learn("a", "b"), flush_id)
+    await storage.apply_deltas(learn("a", "c"), "flush-3")
+
+    assert [answer.keywords for answer in await answers_of(storage, "a", 2)] == ["b"]
+
+
+async def test_samples_limit(storage):
+    for i in range(10):
+        await storage.apply_deltas(learn("a", "b", message=f"message {i}"), f"flush-{i}")
+
+    [answer] = await answers_of(storage, "a")
+    assert answer.count == 10
+    assert len(answer.samples) == storage.samples_limit
+    assert [sample.key for sample in answer.samples] == sorted(sample.key for sample in answer.samples)
+
+
+async def test_non_plain_text_keeps_one_sample(storage):
+    first = AnswerDelta(count=1, time=100, sample="[CQ:image,file=1.image]")
+    await storage.apply_deltas({"a": ContextDelta(count=1, time=100, answers={(1, "img"): first})}, "flush-1")
+    second = AnswerDelta(count=1, time=110, sample="[CQ:image,file=1.image]")
+    await storage.apply_deltas({"a": ContextDelta(count=1, time=110, answers={(1, "img"): second})}, "flush-2")
+
+    [answer] = await answers_of(storage, "a")
+    assert answer.count == 2
+    assert [sample.message for sample in answer.samples] == ["[CQ:image,file=1.image]"]
+
+
+async def test_retry_with_same_flush_id_counts_once(storage):
+    if isinstance(storage, SQLiteStorage):
+        pytest.skip("SQLite 整批在一个事务里，失败时全部回滚，不会出现部分写入")
+
+    pending = learn("a", "b")
+    await storage.apply_deltas(pending, "flush-1")
+    await storage.apply_deltas(pending, "flush-1")
+
+    context = await storage.find_context("a")
+    assert context.trigger_count == 1
+    [answer] = await answers_of(storage, "a")
+    assert answer.count == 1
+    assert answer.samples[0].count == 1
+
+
+async def test_push_ban(storage):
+    assert await storage.push_ban("missing", Ban(keywords="b", group_id=1, reason="test"), 2) is None
+
+    await storage.apply_deltas(learn("a", "b"), "flush-1")
+    assert await storage.push_ban("a", Ban(keywords="b", group_id=1, reason="test", time=1), 2) == []
+    assert await storage.push_ban("a", Ban(keywords="b", group_id=2, reason="test", time=2), 2) == ["b"]
+
+    context = await storage.find_context("a")
+    assert [ban.group_id for ban in context.ban] == [1, 2]
+    assert context.cross_group_ban == ["b"]
+
+
+async def test_context_keywords(storage):
+    for keywords in ("a", "b", "c"):
+        await storage.apply_deltas(learn(keywords, "x"), f"flush-{keywords}")
+
+    assert await storage.count_contexts() == 3
+    assert sorted([keywords async for keywords in storage.iter_context_keywords()]) == ["a", "b", "c"]
+
+
+async def test_blacklists(storage):
+    await storage.save_blacklist(1, "answers", ["x"])
+    await storage.save_blacklist(1, "answers_reserve", ["y"])
+    await storage.save_blacklist(1, "answers", ["x", "z"])
+
+    assert await storage.load_blacklists() == [(1, ["x", "z"], ["y"])]
+
+
+async def test_insert_messages(storage):
+    messages = [ChatMessage(1, 2, 3, "hi", True, "hi", "hi", 100)]
+
+    await storage.insert_messages(storage.prepare_messages(messages))
+
+
+async def test_clearup_deletes_expired_contexts(storage):
+    await storage.apply_deltas(learn("old", "x", time=100), "flush-1")
+    await storage.apply_deltas(learn("new", "x", time=10000), "flush-2")
+    popular = {"popular": ContextDelta(count=5, time=100)}
+    await storage.apply_deltas(popular, "flush-3")
+
+    state = {"phase": "delete", "last_id": None, "done": 0, "cur_time": 20000, "expiration": 1000}
+    while state is not None:
+        state = await storage.clearup_step(state, 1, answer_threshold=3)
+
+    assert await storage.find_context("old") is None
+    assert await storage.find_context("new") is not None
+    assert await storage.find_context("popular") is not None
+    if storage.split_answers:
+        assert await storage.find_answers("old", 0) == []
+
+
+async def test_sqlite_rejects_unknown_blacklist_field(beanie_db, tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "repeater.db"))
+    with pytest.raises(ValueError, match="unknown blacklist field"):
+        await storage.save_blacklist(1, "answers = '[]'; --", [])
+    await storage.close()
+
+
+async def test_sqlite_rolls_back_failed_batch(beanie_db, tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "repeater.db"))
+    pending = learn("a", "b")
+    # 第二个 Context 的 answer 写入失败，整批回滚
+    pending["c"] = ContextDelta(count=1, time=100, answers={(1, "d"): AnswerDelta(count=1, time=100)})
+    pending["c"].answers[1, "d"].messages = Counter({object(): 1})
+    with pytest.raises(ValueError, match="validation error"):
+        await storage.apply_deltas(pending, "flush-1")
+
+    assert await storage.find_context("a") is None
+    await storage.close()
@@ -0,0 +1,52 @@
+import pytest
+
+from src.plugins.repeater.topics import MAX_EXPONENT, TopicWindow
+
+
+def test_counts_without_decay():
+    window = TopicWindow(3)
+    window.extend(["牛牛", "喝酒", "牛牛"], now=0)
+
+    assert window.count("牛牛") == 2
+    assert window.weight("牛牛", now=1000) == 2
+    assert "喝酒" in window
+
+
+def test_evicts_oldest():
+    window = TopicWindow(2)
+    window.extend(["a", "b", "c"], now=0)
+
+    assert len(window) == 2
+    assert "a" not in window
+    assert window.weight("a", now=0) == 0
+
+
+def test_half_life_decay():
+    window = TopicWindow(10, half_life=60)
+    window.push("a", now=0)
+    window.push("a", now=60)
+
+    assert window.weight("a", now=60) == pytest.approx(1.5)
+    assert window.weight("a", now=120) == pytest.approx(0.75)
+    assert window.count("a") == 2
+
+
+def test_evicted_stamp_is_removed_from_weight():
+    window = TopicWindow(2, half_life=60)
+    window.extend(["a", "b"], now=0)
+    window.push("a", now=60)
+
+    # 第一次出现的 a 被淘汰，只剩 60 秒时那一次
+    assert window.weight("a", now=60) == pytest.approx(1.0)
+
+
+def test_rebases_before_overflow():
+    half_life = 1.0
+    window = TopicWindow(4, half_life=half_life)
+    window.push("a", now=0)
+    late = MAX_EXPONENT * 2 * half_life
+    window.push("b", now=late)
+    window.push("b", now=late + half_life)
+
+    assert window.weight("b", now=late + half_life) == pytest.approx(1.5)
+    assert window.weight("a", now=late + half_life) == pytest.approx(0.0)
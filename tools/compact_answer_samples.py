@@ -0,0 +1,99 @@
+"""
+把旧数据中 answer 逐条追加的 messages 压缩成去重后的 samples ( 消息 + 出现次数 )
+
+每个 answer 最多保留 --limit 条不同的消息，超过时和牛牛运行时一样保留 key 最小的，
+limit 请与 ANSWER_SAMPLES_LIMIT 保持一致
+只处理还有 messages 的文档，中断后可以重新运行；请先停止牛牛再运行
+"""
+
+import argparse
+import hashlib
+from collections import Counter
+from operator import itemgetter
+
+import pymongo
+from pymongo import UpdateOne
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--host", default="127.0.0.1")
+parser.add_argument("--port", type=int, default=27017)
+parser.add_argument("--database", default="PallasBot")
+parser.add_argument("--limit", type=int, default=50, help="每个 answer 最多保留多少条不同的消息，0 为不限")
+parser.add_argument("--batch", type=int, default=1000)
+args = parser.parse_args()
+
+mongo_client = pymongo.MongoClient(args.host, args.port, unicode_decode_error_handler="ignore")
+
+mongo_db = mongo_client[args.database]
+
+context_mongo = mongo_db["context"]
+answer_mongo = mongo_db["context_answer"]
+
+
+def sample_key(message: str) -> int:
+    # 与 src/common/db/modules.py 中的 sample_key 保持一致
+    return int.from_bytes(hashlib.blake2b(message.encode(), digest_size=8).digest(), "big") >> 1
+
+
+def compact(answer: dict) -> list[dict]:
+    counts = Counter()
+    for sample in answer.get("samples", []):
+        counts[sample["message"]] += sample.get("count", 1)
+    counts.update(answer.get("messages", []))
+    samples = sorted(
+        ({"message": message, "count": count, "key": sample_key(message)} for message, count in counts.items()),
+        key=itemgetter("key"),
+    )
+    if args.limit:
+        del samples[args.limit :]
+    return samples
+
+
+def compact_answer(answer: dict) -> dict:
+    samples = compact(answer)
+    answer = {key: value for key, value in answer.items() if key != "messages"}
+    answer["samples"] = samples
+    return answer
+
+
+def run(collection, query: dict, projection: dict, to_update) -> int:
+    requests = []
+    index = 0
+    before = after = 0
+    for doc in collection.find(query, projection, no_cursor_timeout=True):
+        update, old, new = to_update(doc)
+        requests.append(UpdateOne({"_id": doc["_id"]}, update))
+        before += old
+        after += new
+
+        if len(requests) >= args.batch:
+            collection.bulk_write(requests, ordered=False)
+            requests = []
+
+        index += 1
+        if index % 1000 == 0:
+            print(f"{collection.name}: {index}, {before} messages -> {after} samples")
+
+    if requests:
+        collection.bulk_write(requests, ordered=False)
+    print(f"{collection.name}: done, {index} documents, {before} messages -> {after} samples")
+    return index
+
+
+def context_update(doc: dict) -> tuple[dict, int, int]:
+    answers = [compact_answer(answer) for answer in doc["answers"]]
+    before = sum(len(answer.get("messages", [])) + len(answer.get("samples", [])) for answer in doc["answers"])
+    after = sum(len(answer["samples"]) for answer in answers)
+    return {"$set": {"answers": answers}}, before, after
+
+
+def answer_update(doc: dict) -> tuple[dict, int, int]:
+    samples = compact(doc)
+    before = len(doc.get("messages", [])) + len(doc.get("samples", []))
+    return {"$set": {"samples": samples}, "$unset": {"messages": ""}}, before, len(samples)
+
+
+# 内嵌存储
+run(context_mongo, {"answers.messages.0": {"$exists": True}}, {"answers": 1}, context_update)
+# 拆分存储
+run(answer_mongo, {"messages.0": {"$exists": True}}, {"messages": 1, "samples": 1}, answer_update)
@@ -0,0 +1,111 @@
+"""
+合并 keywords 相同的 context 文档，然后建立 keywords 的唯一索引
+
+旧版本的 keywords 索引不是唯一索引，多个进程同时写回学习内容时可能各自新建了同一个 context；
+新版本启动时会建立唯一索引，有重复文档时会建立失败，请先停止牛牛运行这个工具
+
+同一组重复文档合并到最早的一个：次数相加，时间取最大，answer 按 ( 群, keywords ) 合并，ban 记录去重后合并
+--limit 请与 ANSWER_SAMPLES_LIMIT 保持一致；中断后可以重新运行，不会重复累加
+"""
+
+import argparse
+import hashlib
+from operator import itemgetter
+
+import pymongo
+
+
+def sample_key(message: str) -> int:
+    # 与 src/common/db/modules.py 中的 sample_key 保持一致
+    return int.from_bytes(hashlib.blake2b(message.encode(), digest_size=8).digest(), "big") >> 1
+
+
+def merge_answers(docs: list[dict], limit: int) -> list[dict]:
+    merged: dict[tuple[int, str], dict] = {}
+    for doc in docs:
+        for answer in doc.get("answers", []):
+            key = (answer["group_id"], answer["keywords"])
+            target = merged.get(key)
+            if target is None:
+                merged[key] = {**answer, "samples": list(answer.get("samples", []))}
+                continue
+            target["count"] = target.get("count", 1) + answer.get("count", 1)
+            target["time"] = max(target.get("time", 0), answer.get("time", 0))
+            target["messages"] = [*target.get("messages", []), *answer.get("messages", [])]
+            target["samples"] = [*target["samples"], *answer.get("samples", [])]
+
+    for answer in merged.values():
+        counts: dict[str, int] = {}
+        for sample in answer["samples"]:
+            counts[sample["message"]] = counts.get(sample["message"], 0) + sample.get("count", 1)
+        samples = sorted(
+            ({"message": message, "count": count, "key": sample_key(message)} for message, count in counts.items()),
+            key=itemgetter("key"),
+        )
+        answer["samples"] = samples[:limit] if limit else samples
+    return list(merged.values())
+
+
+def merge(docs: list[dict], limit: int) -> dict:
+    bans = []
+    seen = set()
+    for doc in docs:
+        for ban in doc.get("ban", []):
+            key = (ban.get("keywords"), ban.get("group_id"), ban.get("time"))
+            if key not in seen:
+                seen.add(key)
+                bans.append(ban)
+    return {
+        "count": sum(doc.get("count", 1) for doc in docs),
+        "time": max(doc.get("time", 0) for doc in docs),
+        "answers": merge_answers(docs, limit),
+        "ban": bans,
+        "cross_group_ban": sorted({keywords for doc in docs for keywords in doc.get("cross_group_ban", [])}),
+        "clear_time": max(doc.get("clear_time", 0) for doc in docs),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=27017)
+    parser.add_argument("--database", default="PallasBot")
+    parser.add_argument("--limit", type=int, default=50, help="每个 answer 最多保留多少条不同的消息，0 为不限")
+    args = parser.parse_args()
+
+    mongo_client = pymongo.MongoClient(args.host, args.port, unicode_decode_error_handler="ignore")
+    context_mongo = mongo_client[args.database]["context"]
+
+    duplicates = context_mongo.aggregate(
+        [
+            {"$group": {"_id": "$keywords", "ids": {"$push": "$_id"}, "n": {"$sum": 1}}},
+            {"$match": {"n": {"$gt": 1}}},
+        ],
+        allowDiskUse=True,
+    )
+    merged = 0
+    removed = 0
+    for group in duplicates:
+        keep, *rest = context_mongo.find({"_id": {"$in": group["ids"]}}).sort("_id", 1)
+        if not rest:
+            continue
+        rest_ids = [doc["_id"] for doc in rest]
+        # 合并结果和被合并的文档 id 一起写入，中断后重新运行时不会把同一批文档再加一次
+        if not set(rest_ids) <= set(keep.get("dedup_from", [])):
+            context_mongo.update_one(
+                {"_id": keep["_id"]}, {"$set": {**merge([keep, *rest], args.limit), "dedup_from": rest_ids}}
+            )
+        context_mongo.delete_many({"_id": {"$in": rest_ids}})
+        context_mongo.update_one({"_id": keep["_id"]}, {"$unset": {"dedup_from": ""}})
+        merged += 1
+        removed += len(rest)
+        if merged % 1000 == 0:
+            print(f"{merged} keywords merged, {removed} documents removed")
+
+    # 与 src/common/db/modules.py 中的索引保持一致
+    context_mongo.create_index([("keywords", pymongo.ASCENDING)], name="keywords_unique_index", unique=True)
+    print(f"done, {merged} keywords merged, {removed} documents removed, unique index created")
+
+
+if __name__ == "__main__":
+    main()
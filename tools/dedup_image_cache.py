@@ -0,0 +1,69 @@
+"""
+合并 cq_code 相同的 image_cache 文档，然后建立 cq_code 的唯一索引
+
+旧版本的 cq_code 索引不是唯一索引，多个进程同时写回出现次数时可能各自新建了同一张图片的记录；
+新版本启动时会建立唯一索引，有重复文档时会建立失败，请先停止牛牛运行这个工具
+
+同一组重复文档合并到最早的一个：出现次数相加，日期取最大，已经缓存过的图片保留缓存；中断后可以重新运行，不会重复累加
+"""
+
+import argparse
+
+import pymongo
+
+
+def merge(docs: list[dict]) -> dict:
+    merged = {
+        "ref_times": sum(doc.get("ref_times", 1) for doc in docs),
+        "date": max(doc.get("date", 0) for doc in docs),
+    }
+    cached = next((doc for doc in docs if doc.get("digest")), None)
+    if cached is not None:
+        merged.update(digest=cached["digest"], size=cached.get("size", 0))
+    legacy = next((doc for doc in docs if doc.get("base64_data")), None)
+    if legacy is not None:
+        merged["base64_data"] = legacy["base64_data"]
+    return merged
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=27017)
+    parser.add_argument("--database", default="PallasBot")
+    args = parser.parse_args()
+
+    mongo_client = pymongo.MongoClient(args.host, args.port, unicode_decode_error_handler="ignore")
+    image_mongo = mongo_client[args.database]["image_cache"]
+
+    duplicates = image_mongo.aggregate(
+        [
+            {"$group": {"_id": "$cq_code", "ids": {"$push": "$_id"}, "n": {"$sum": 1}}},
+            {"$match": {"n": {"$gt": 1}}},
+        ],
+        allowDiskUse=True,
+    )
+    merged = 0
+    removed = 0
+    for group in duplicates:
+        keep, *rest = image_mongo.find({"_id": {"$in": group["ids"]}}).sort("_id", 1)
+        if not rest:
+            continue
+        rest_ids = [doc["_id"] for doc in rest]
+        # 合并结果和被合并的文档 id 一起写入，中断后重新运行时不会把同一批文档再加一次
+        if not set(rest_ids) <= set(keep.get("dedup_from", [])):
+            image_mongo.update_one({"_id": keep["_id"]}, {"$set": {**merge([keep, *rest]), "dedup_from": rest_ids}})
+        image_mongo.delete_many({"_id": {"$in": rest_ids}})
+        image_mongo.update_one({"_id": keep["_id"]}, {"$unset": {"dedup_from": ""}})
+        merged += 1
+        removed += len(rest)
+        if merged % 1000 == 0:
+            print(f"{merged} images merged, {removed} documents removed")
+
+    # 与 src/common/db/modules.py 中的索引保持一致
+    image_mongo.create_index([("cq_code", pymongo.ASCENDING)], name="cq_code_unique_index", unique=True)
+    print(f"done, {merged} images merged, {removed} documents removed, unique index created")
+
+
+if __name__ == "__main__":
+    main()
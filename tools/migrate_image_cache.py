@@ -0,0 +1,74 @@
+"""
+把 image_cache 文档中内嵌的 base64_data 转存到按内容哈希存放的图片目录 ( 或 GridFS )，文档中只保留 digest 和大小
+
+--store、--path 请与 IMAGE_STORE、IMAGE_STORE_PATH 保持一致；只处理还有 base64_data 的文档，中断后可以重新运行
+不迁移也可以，牛牛读取到旧数据时会自动转存
+"""
+
+import argparse
+import base64
+import hashlib
+import os
+from pathlib import Path
+
+import gridfs
+import pymongo
+from pymongo import UpdateOne
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--host", default="127.0.0.1")
+parser.add_argument("--port", type=int, default=27017)
+parser.add_argument("--database", default="PallasBot")
+parser.add_argument("--store", choices=["disk", "gridfs"], default="disk")
+parser.add_argument("--path", default="data/images")
+parser.add_argument("--batch", type=int, default=100)
+args = parser.parse_args()
+
+mongo_client = pymongo.MongoClient(args.host, args.port, unicode_decode_error_handler="ignore")
+
+mongo_db = mongo_client[args.database]
+
+image_mongo = mongo_db["image_cache"]
+bucket = gridfs.GridFSBucket(mongo_db, bucket_name="image_blob")
+root = Path(args.path)
+
+
+def save(data: bytes) -> str:
+    # 与 src/common/utils/media_cache/store.py 中的布局保持一致
+    digest = hashlib.sha256(data).hexdigest()
+    if args.store == "gridfs":
+        if not mongo_db["image_blob.files"].find_one({"_id": digest}, {"_id": 1}):
+            bucket.upload_from_stream_with_id(digest, digest, data)
+        return digest
+
+    path = root / digest[:2] / digest[2:4] / digest
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{digest}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        tmp.replace(path)
+    return digest
+
+
+requests = []
+index = 0
+digests = set()
+for doc in image_mongo.find({"base64_data": {"$type": "string"}}, {"base64_data": 1}, no_cursor_timeout=True):
+    data = base64.b64decode(doc["base64_data"])
+    digest = save(data)
+    digests.add(digest)
+    requests.append(
+        UpdateOne({"_id": doc["_id"]}, {"$set": {"digest": digest, "size": len(data)}, "$unset": {"base64_data": ""}})
+    )
+
+    if len(requests) >= args.batch:
+        image_mongo.bulk_write(requests, ordered=False)
+        requests = []
+
+    index += 1
+    if index % 1000 == 0:
+        print(f"{index} images -> {len(digests)} blobs")
+
+if requests:
+    image_mongo.bulk_write(requests, ordered=False)
+print(f"done, {index} images -> {len(digests)} blobs")
@@ -0,0 +1,340 @@
+"""
+从 message 集合重新学习，重建 context ( 以及拆分存储时的 context_answer ) 集合
+
+修改了关键词提取 ( 关键词个数、jieba 词典等 ) 之后，已经学到的 context 和新提取的关键词对不上，用这个工具离线重建
+
+按群分给多个进程，每个进程按时间顺序流式读取一个群的消息，重新提取关键词，
+按和 Chat.learn 相同的规则 ( 群里的上一条发言、该用户三句之内的上一条发言 ) 配对，
+先乱序批量写入临时集合，再在数据库端聚合成新的 context 集合，最后用 renameCollection 替换
+
+请先停止牛牛再运行，原有的 ban 记录会被保留；重建出的 answer 保存的是原始消息列表，
+牛牛读取时会自动去重并按 ANSWER_SAMPLES_LIMIT 截断，也可以再运行 tools/compact_answer_samples.py 压缩
+"""
+
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+import pymongo
+
+try:
+    import jieba_fast as jieba
+    import jieba_fast.analyse as jieba_analyse
+except ImportError:
+    import jieba
+    import jieba.analyse as jieba_analyse
+
+STAGING = "context_relearn_staging"
+
+
+class _Worker:
+    # 每个进程的参数、数据库连接和关键词缓存，由 init_worker 设置
+    args: argparse.Namespace | None = None
+    db = None
+    keywords_cache: dict[str, str] = {}
+
+
+def init_worker(args: argparse.Namespace) -> None:
+    # 每个进程单独连接数据库，单独加载词典
+    _Worker.args = args
+    _Worker.db = pymongo.MongoClient(args.host, args.port, unicode_decode_error_handler="ignore")[args.database]
+    if args.user_dict:
+        jieba.load_userdict(args.user_dict)
+
+
+def get_keywords(raw_message: str, plain_text: str) -> str:
+    # 与 ChatData.keywords 保持一致
+    is_plain_text = "[CQ:" not in raw_message and len(plain_text) != 0
+    if not is_plain_text and len(plain_text) == 0:
+        return raw_message
+
+    keywords = _Worker.keywords_cache.get(plain_text)
+    if keywords is None:
+        keywords_list = jieba_analyse.extract_tags(plain_text, topK=_Worker.args.top_k)
+        keywords = " ".join(keywords_list) if keywords_list else plain_text
+        if len(_Worker.keywords_cache) >= _Worker.args.cache_size:
+            _Worker.keywords_cache.clear()
+        _Worker.keywords_cache[plain_text] = keywords
+    return keywords
+
+
+def relearn_group(group_id: int) -> tuple[int, int, int]:
+    """
+    重新学习一个群，返回 ( 群号, 消息数, 学到的次数 )
+    """
+
+    pending: dict[tuple[str, str], list] = {}
+    messages = 0
+    learned = 0
+
+    def learn(pre_msg: dict, msg: dict) -> None:
+        nonlocal learned
+        raw_message = msg["raw_message"]
+        # 在复读，不学
+        if pre_msg["raw_message"] == raw_message:
+            return
+        # 回复别人的，不学
+        if "[CQ:reply," in raw_message:
+            return
+
+        learned += 1
+        key = (pre_msg["keywords"], msg["keywords"])
+        answer = pending.get(key)
+        if answer is None:
+            # count, time, messages；非纯文本消息只在新建时记录一条
+            answer = pending[key] = [0, 0, [] if msg["is_plain_text"] else [raw_message]]
+        answer[0] += 1
+        answer[1] = max(answer[1], msg["time"])
+        if msg["is_plain_text"]:
+            answer[2].append(raw_message)
+
+    recent: list[dict] = []  # 最近的两条消息，[-1] 为最新
+    cursor = _Worker.db["message"].find(
+        {"group_id": group_id},
+        {"_id": 0, "user_id": 1, "raw_message": 1, "plain_text": 1, "time": 1},
+        batch_size=_Worker.args.batch,
+        no_cursor_timeout=True,
+    )
+    cursor = cursor.sort([("group_id", pymongo.ASCENDING), ("time", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)])
+    for doc in cursor:
+        raw_message = doc.get("raw_message", "")
+        if len(raw_message.strip()) == 0:
+            continue
+        plain_text = doc.get("plain_text", "")
+        msg = {
+            "user_id": doc.get("user_id"),
+            "raw_message": raw_message,
+            "is_plain_text": "[CQ:" not in raw_message and len(plain_text) != 0,
+            "keywords": get_keywords(raw_message, plain_text),
+            "time": doc.get("time", 0),
+        }
+        messages += 1
+
+        if recent:
+            pre_msg = recent[-1]
+            learn(pre_msg, msg)
+            # 该用户在群里的上一条发言（倒序三句之内）
+            if pre_msg["user_id"] != msg["user_id"] and len(recent) > 1 and recent[-2]["user_id"] == msg["user_id"]:
+                learn(recent[-2], msg)
+        recent = [*recent[-1:], msg]
+
+        if len(pending) >= _Worker.args.flush_size:
+            flush_group(group_id, pending)
+            pending = {}
+
+    flush_group(group_id, pending)
+    return group_id, messages, learned
+
+
+def flush_group(group_id: int, pending: dict) -> None:
+    # 同一个群只在一个进程中处理，这里只有插入，没有并发的更新
+    documents = [
+        {"context": context, "group_id": group_id, "keywords": keywords, "count": count, "time": t, "messages": msgs}
+        for (context, keywords), (count, t, msgs) in pending.items()
+    ]
+    for i in range(0, len(documents), _Worker.args.batch):
+        _Worker.db[STAGING].insert_many(documents[i : i + _Worker.args.batch], ordered=False)
+
+
+def answer_pipeline(args: argparse.Namespace) -> list[dict]:
+    # 同一个 answer 可能被分几次写入临时集合，先合并
+    messages = {"$reduce": {"input": "$messages", "initialValue": [], "in": {"$concatArrays": ["$$value", "$$this"]}}}
+    if args.max_messages:
+        messages = {"$slice": [messages, -args.max_messages]}
+    pipeline = [
+        {
+            "$group": {
+                "_id": {"context": "$context", "group_id": "$group_id", "keywords": "$keywords"},
+                "count": {"$sum": "$count"},
+                "time": {"$max": "$time"},
+                "messages": {"$push": "$messages"},
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "context": "$_id.context",
+                "group_id": "$_id.group_id",
+                "keywords": "$_id.keywords",
+                "count": 1,
+                "time": 1,
+                "messages": messages,
+            }
+        },
+    ]
+    if args.prune:
+        # 与每天的 clearup_context 相同，只留下学会了的、或最近说过的
+        expiration = int(time.time()) - 15 * 24 * 3600
+        pipeline.append({"$match": {"$or": [{"count": {"$gt": 1}}, {"time": {"$gt": expiration}}]}})
+    return pipeline
+
+
+def build_collections(db, args: argparse.Namespace) -> list[tuple[str, str]]:
+    """
+    在数据库端聚合出新的集合，返回 ( 新集合, 要替换的集合 ) 列表
+    """
+
+    context_fields = {
+        "_id": 0,
+        "keywords": "$_id",
+        "count": 1,
+        "time": 1,
+        "ban": {"$literal": []},
+        "cross_group_ban": {"$literal": []},
+        "clear_time": {"$literal": 0},
+    }
+    if args.storage == "split":
+        db[STAGING].aggregate([*answer_pipeline(args), {"$out": "context_answer_relearn"}], allowDiskUse=True)
+        db["context_answer_relearn"].aggregate(
+            [
+                {"$group": {"_id": "$context", "count": {"$sum": "$count"}, "time": {"$max": "$time"}}},
+                {"$project": {**context_fields, "answers": {"$literal": []}}},
+                {"$out": "context_relearn"},
+            ],
+            allowDiskUse=True,
+        )
+        return [("context_relearn", "context"), ("context_answer_relearn", "context_answer")]
+
+    db[STAGING].aggregate(
+        [
+            *answer_pipeline(args),
+            {
+                "$group": {
+                    "_id": "$context",
+                    "count": {"$sum": "$count"},
+                    "time": {"$max": "$time"},
+                    "answers": {
+                        "$push": {
+                            "keywords": "$keywords",
+                            "group_id": "$group_id",
+                            "count": "$count",
+                            "time": "$time",
+                            "messages": "$messages",
+                        }
+                    },
+                }
+            },
+            {"$project": {**context_fields, "answers": 1}},
+            {"$out": "context_relearn"},
+        ],
+        allowDiskUse=True,
+    )
+    return [("context_relearn", "context")]
+
+
+def create_indexes(db, args: argparse.Namespace) -> None:
+    # 与 src/common/db/modules.py 中的索引保持一致
+    context = db["context_relearn"]
+    context.create_index([("keywords", pymongo.HASHED)], name="keywords_index")
+    context.create_index([("keywords", pymongo.ASCENDING)], name="keywords_unique_index", unique=True)
+    context.create_index([("count", pymongo.DESCENDING)], name="count_index")
+    context.create_index([("time", pymongo.DESCENDING)], name="time_index")
+    context.create_index(
+        [("answers.group_id", pymongo.TEXT), ("answers.keywords", pymongo.TEXT)],
+        name="answers_index",
+        default_language="none",
+    )
+    if args.storage == "split":
+        answer = db["context_answer_relearn"]
+        answer.create_index(
+            [("context", pymongo.ASCENDING), ("group_id", pymongo.ASCENDING), ("keywords", pymongo.ASCENDING)],
+            name="answer_key_index",
+            unique=True,
+        )
+        answer.create_index([("context", pymongo.ASCENDING), ("count", pymongo.DESCENDING)], name="context_count_index")
+        answer.create_index([("time", pymongo.DESCENDING)], name="time_index")
+
+
+def copy_bans(db, args: argparse.Namespace) -> int:
+    requests = []
+    copied = 0
+    fields = {"keywords": 1, "ban": 1, "cross_group_ban": 1}
+    for doc in db["context"].find({"ban.0": {"$exists": True}}, fields, no_cursor_timeout=True):
+        update = {"ban": doc["ban"], "cross_group_ban": doc.get("cross_group_ban", [])}
+        requests.append(pymongo.UpdateOne({"keywords": doc["keywords"]}, {"$set": update}))
+        if len(requests) >= args.batch:
+            db["context_relearn"].bulk_write(requests, ordered=False)
+            copied += len(requests)
+            requests = []
+    if requests:
+        db["context_relearn"].bulk_write(requests, ordered=False)
+        copied += len(requests)
+    return copied
+
+
+def swap(client, args: argparse.Namespace, collections: list[tuple[str, str]]) -> None:
+    suffix = time.strftime("%Y%m%d%H%M%S")
+    for source, target in collections:
+        if args.keep_backup and target in client[args.database].list_collection_names():
+            client.admin.command(
+                "renameCollection", f"{args.database}.{target}", to=f"{args.database}.{target}_backup_{suffix}"
+            )
+        # 单个集合的替换是原子的
+        client.admin.command(
+            "renameCollection", f"{args.database}.{source}", to=f"{args.database}.{target}", dropTarget=True
+        )
+        print(f"{source} -> {target}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=27017)
+    parser.add_argument("--database", default="PallasBot")
+    parser.add_argument("--workers", type=int, default=4, help="进程数")
+    parser.add_argument("--top-k", type=int, default=2, help="每条消息提取的关键词个数，对应 ChatData._keywords_size")
+    parser.add_argument("--user-dict", help="jieba 自定义词典")
+    parser.add_argument("--storage", choices=["embedded", "split"], default="embedded", help="对应 ANSWER_STORAGE")
+    parser.add_argument("--batch", type=int, default=10000)
+    parser.add_argument("--flush-size", type=int, default=200000, help="每个进程内存中最多累积多少个 answer")
+    parser.add_argument("--cache-size", type=int, default=1000000, help="每个进程缓存多少条消息的关键词")
+    parser.add_argument("--max-messages", type=int, default=0, help="每个 answer 最多保留多少条原始消息，0 为不限")
+    parser.add_argument("--no-prune", dest="prune", action="store_false", help="不按 clearup_context 的规则清理")
+    parser.add_argument("--keep-backup", action="store_true", help="替换前把原集合重命名为 *_backup_时间")
+    parser.add_argument("--dry-run", action="store_true", help="只生成新集合，不替换")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(args.host, args.port, unicode_decode_error_handler="ignore")
+    db = client[args.database]
+    for name in (STAGING, "context_relearn", "context_answer_relearn"):
+        db.drop_collection(name)
+    # 按群、时间顺序读取消息需要这个索引
+    db["message"].create_index(
+        [("group_id", pymongo.ASCENDING), ("time", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)],
+        name="group_time_index",
+    )
+
+    start = time.time()
+    group_ids = db["message"].distinct("group_id")
+    total_messages = 0
+    total_learned = 0
+    with ProcessPoolExecutor(
+        args.workers, mp_context=get_context("spawn"), initializer=init_worker, initargs=(args,)
+    ) as pool:
+        futures = [pool.submit(relearn_group, group_id) for group_id in group_ids]
+        for done, future in enumerate(as_completed(futures), 1):
+            group_id, messages, learned = future.result()
+            total_messages += messages
+            total_learned += learned
+            elapsed = time.time() - start
+            print(
+                f"[{done}/{len(group_ids)}] group {group_id}: {messages} messages, {learned} learned; "
+                f"total {total_messages} messages, {total_messages / max(elapsed, 1):.0f} msg/s"
+            )
+
+    print("building collections")
+    collections = build_collections(db, args)
+    create_indexes(db, args)
+    print(f"{copy_bans(db, args)} contexts with bans copied")
+    db.drop_collection(STAGING)
+
+    if args.dry_run:
+        print("dry run, new collections are left as " + ", ".join(source for source, _ in collections))
+    else:
+        swap(client, args, collections)
+    print(f"done in {time.time() - start:.0f}s, {total_messages} messages, {total_learned} learned")
+
+
+if __name__ == "__main__":
+    main()
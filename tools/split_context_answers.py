@@ -0,0 +1,103 @@
+"""
+将 context 文档中内嵌的 answers 迁移到单独的 context_answer 集合
+
+请先停止牛牛，迁移完成后在 .env.prod 中设置 ANSWER_STORAGE="split" 再启动
+指定 --drop-embedded 时，迁移过的 context 会被清空 answers，中断后可以加上 --resume 重新运行；
+否则请勿重复运行，count 会被重复累加，context_answer 已有数据时默认拒绝运行
+"""
+
+import argparse
+import sys
+
+import pymongo
+from pymongo import UpdateOne
+
+
+def create_indexes(answer_mongo) -> None:
+    # 与 src/common/db/modules.py 中的索引保持一致
+    answer_mongo.create_index(
+        [("context", pymongo.ASCENDING), ("group_id", pymongo.ASCENDING), ("keywords", pymongo.ASCENDING)],
+        name="answer_key_index",
+        unique=True,
+    )
+    answer_mongo.create_index(
+        [("context", pymongo.ASCENDING), ("count", pymongo.DESCENDING)], name="context_count_index"
+    )
+    answer_mongo.create_index([("time", pymongo.DESCENDING)], name="time_index")
+
+
+def answer_requests(context: dict) -> list[UpdateOne]:
+    return [
+        UpdateOne(
+            {"context": context["keywords"], "group_id": answer["group_id"], "keywords": answer["keywords"]},
+            {
+                "$inc": {"count": answer.get("count", 1)},
+                "$max": {"time": answer.get("time", 0)},
+                "$push": {
+                    "messages": {"$each": answer.get("messages", [])},
+                    "samples": {"$each": answer.get("samples", [])},
+                },
+            },
+            upsert=True,
+        )
+        for answer in context["answers"]
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=27017)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--drop-embedded", action="store_true", help="迁移后清空 context 文档中的 answers")
+    parser.add_argument(
+        "--resume", action="store_true", help="context_answer 已有数据时仍然运行，仅用于 --drop-embedded 中断后继续"
+    )
+    args = parser.parse_args()
+    if args.resume and not args.drop_embedded:
+        parser.error("--resume only works with --drop-embedded, otherwise migrated answers are counted twice")
+
+    mongo_client = pymongo.MongoClient(args.host, args.port, unicode_decode_error_handler="ignore")
+
+    mongo_db = mongo_client["PallasBot"]
+
+    context_mongo = mongo_db["context"]
+    answer_mongo = mongo_db["context_answer"]
+
+    if not args.resume and answer_mongo.find_one({}, {"_id": 1}):
+        sys.exit(
+            "context_answer is not empty, running again would add the counts twice; "
+            "use --drop-embedded --resume to continue an interrupted --drop-embedded run"
+        )
+
+    create_indexes(answer_mongo)
+
+    def flush(requests: list, context_ids: list):
+        if requests:
+            answer_mongo.bulk_write(requests, ordered=False)
+        if args.drop_embedded and context_ids:
+            context_mongo.update_many({"_id": {"$in": context_ids}}, {"$set": {"answers": []}})
+
+    requests = []
+    context_ids = []
+    index = 0
+    query = {"answers.0": {"$exists": True}}
+    for context in context_mongo.find(query, {"keywords": 1, "answers": 1}, no_cursor_timeout=True):
+        requests.extend(answer_requests(context))
+        context_ids.append(context["_id"])
+
+        if len(requests) >= args.batch:
+            flush(requests, context_ids)
+            requests = []
+            context_ids = []
+
+        index += 1
+        if index % 1000 == 0:
+            print(index)
+
+    flush(requests, context_ids)
+    print(f"done, {index} contexts migrated")
+
+
+if __name__ == "__main__":
+    main()